@@ -0,0 +1,100 @@
+"""
+The registry of algorithms that can be run from the web-app.
+
+Each algorithm is a module (or any object) with a function run(url, language).
+An algorithm that accepts an already-opened spreadsheet (run(url, language, spreadsheet=...)) can also run on uploaded files (see uploads);
+it can list the possible titles of its input worksheet in INPUT_SHEET_NAMES, the Hebrew title first, so that it can run on uploaded CSV files.
+The options of /run (e.g. explanations=...) are accepted only for algorithms whose run function has them as keyword arguments (see supports_option).
+Algorithms are imported only when they are first used, so that starting the web-app does not import fairpy, NumPy or gspread.
+The built-in algorithms are listed in BUILTIN_ALGORITHMS; other installed packages can add algorithms
+through entry points in the group "fairweb.algorithms", for example in their pyproject.toml:
+
+    [project.entry-points."fairweb.algorithms"]
+    my_algorithm = "my_package.run_my_algorithm"
+"""
+
+import importlib, importlib.metadata, inspect, threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = "fairweb.algorithms"
+
+BUILTIN_ALGORITHMS = {    # maps an algorithm name to the module that runs it
+	"bounded_sharing":   "run_bounded_sharing",
+	"course_allocation": "run_course_allocation",
+	"course_comparison": "run_course_comparison",
+}
+
+_entry_points = None      # maps an algorithm name to an entry point, read on first use
+_loaded = {}              # maps an algorithm name to its loaded module
+_lock = threading.Lock()
+
+
+def _get_entry_points()->dict:
+	global _entry_points
+	if _entry_points is None:
+		_entry_points = {
+			entry_point.name: entry_point
+			for entry_point in importlib.metadata.entry_points(group=ENTRY_POINT_GROUP)
+			if entry_point.name not in BUILTIN_ALGORITHMS}
+	return _entry_points
+
+
+def names()->list:
+	"""
+	Returns the names of all available algorithms, without importing them.
+
+	>>> names()[:2]
+	['bounded_sharing', 'course_allocation']
+	"""
+	return list(BUILTIN_ALGORITHMS) + sorted(_get_entry_points())
+
+
+def get(name:str):
+	"""
+	Returns the algorithm with the given name, importing it on first use.
+	Raises KeyError if there is no such algorithm.
+	"""
+	with _lock:
+		if name not in _loaded:
+			if name in BUILTIN_ALGORITHMS:
+				_loaded[name] = importlib.import_module(BUILTIN_ALGORITHMS[name])
+			elif name in _get_entry_points():
+				_loaded[name] = _get_entry_points()[name].load()
+			else:
+				raise KeyError(f"No algorithm named {name!r}. Available algorithms: {names()}")
+			logger.info("algorithm %s loaded", name)
+		return _loaded[name]
+
+
+def supports_option(algorithm, name:str)->bool:
+	"""
+	Returns True if the run function of the given algorithm accepts the given keyword option
+	(e.g. explanations=..., which only course_allocation supports).
+
+	>>> class Algorithm:
+	...     def run(url, language, spreadsheet=None, explanations=None): pass
+	>>> supports_option(Algorithm, "explanations"), supports_option(Algorithm, "decompose")
+	(True, False)
+	"""
+	parameters = inspect.signature(algorithm.run).parameters
+	return name in parameters or any(parameter.kind==inspect.Parameter.VAR_KEYWORD for parameter in parameters.values())
+
+
+def preload():
+	"""
+	Imports all algorithms now.
+	Called in the gunicorn master process (see gunicorn.conf.py), so that the forked workers share the imported modules.
+	An algorithm that cannot be imported is logged and skipped; it will raise the error when it is used.
+	"""
+	for name in names():
+		try:
+			get(name)
+		except Exception:
+			logger.exception("could not preload algorithm %s", name)
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
@@ -1,5 +1,9 @@
-from flask import Flask, render_template, Response, request
+from flask import Flask, render_template, Response, request, jsonify, stream_with_context, send_file
+import jobs, log_file, metrics, algorithms, uploads, profiling
+import io
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = uploads.MAX_BYTES    # larger uploads get HTTP 413
+log_file.tag_job_output()
 
 # Solution from here: https://stackoverflow.com/a/49334973
 
@@ -13,15 +17,10 @@ def healthz():
 def root():
     return render_template('0.html')
 
-class algorithms:
-    import run_bounded_sharing   as bounded_sharing
-    import run_course_allocation as course_allocation
-
-
 # Page 1: select spreadsheet and algorithm
 @app.route('/1/<lang>')
 def step1(lang:str):
-    return render_template(f'1-{lang}.html', lang=lang, algorithm_names=["bounded_sharing", "course_allocation"])
+    return render_template(f'1-{lang}.html', lang=lang, algorithm_names=algorithms.names())
 
 @app.route('/2/<lang>')
 def step2(lang:str):
@@ -31,10 +30,8 @@ def step2(lang:str):
     print("algorithm_name=",algorithm_name)
     error = None
     try:
-        import gspread
-        account = gspread.service_account("credentials.json")
-        print("account=",account)
-        spreadsheet = account.open_by_url(url)
+        import gspread, gspread_client
+        spreadsheet = gspread_client.open_by_url(url)
         print("spreadsheet=",spreadsheet)
     except gspread.exceptions.APIError:
         error = "Google Spreadsheet API error! Please verify that you shared your spreadsheet with the above address."
@@ -55,20 +52,186 @@ def step2(lang:str):
 
 @app.route('/run/<algorithm_name>')
 def run_algorithm(algorithm_name:str):
-    algorithm = getattr(algorithms, algorithm_name)
+    try:
+        algorithm = algorithms.get(algorithm_name)
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
     url = request.args.get('url')
     lang = request.args.get('lang')
     print("url=",url, "lang=",lang)
-    algorithm.run(url=url, language=lang)
-    return "Run complete"
+    try:
+        options = _run_options(algorithm, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if request.args.get('profile'):
+        if not profiling.is_authorized(_admin_token()):
+            return jsonify({"error": "Profiling requires the administrator token"}), 403
+        job = jobs.submit(algorithm_name, profiling.run, algorithm=algorithm, url=url, language=lang, **options)
+    else:
+        job = jobs.submit(algorithm_name, algorithm.run, url=url, language=lang, **options)
+    print("job=",job.id)
+    return jsonify(job.to_dict()), 202
+
+# The administrator token (see profiling) is given in the header "Authorization: Bearer <token>", or in the argument token=<token>.
+def _admin_token()->str:
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        return authorization[len('Bearer '):]
+    return request.args.get('token')
+
+# The options of /run and /upload, that are passed to the run function of the algorithm (if it supports them; see algorithms.supports_option):
+# maps a URL argument to the name of the keyword argument of run, and a function that converts its value.
+RUN_OPTIONS = {
+    'incremental':  ("incremental_update", lambda value: value!="0"),    # course_allocation
+    'explanations': ("explanations", str),                              # course_allocation: off, summary, full or on_demand
+    'pipelined':    ("pipelined", lambda value: value!="0"),             # course_allocation
+    'decompose':    ("decompose", lambda value: value!="0"),             # course_allocation
+    'algorithms':   ("algorithms", lambda value: value.split(",")),      # course_comparison: names of fairpy.courses algorithms
+    'seeds':        ("seeds", int),                                      # course_comparison: number of tie-breaking orders
+}
+
+# Returns the keyword options of the run function of the given algorithm, from the given URL or form arguments.
+# Raises ValueError if the algorithm does not support one of them.
+def _run_options(algorithm, args)->dict:
+    arguments = [argument for argument in RUN_OPTIONS if args.get(argument)]
+    unsupported = [argument for argument in arguments if not algorithms.supports_option(algorithm, RUN_OPTIONS[argument][0])]
+    if len(unsupported)>0:
+        raise ValueError(f"The algorithm does not support the option(s) {unsupported}")
+    options = {}
+    for argument in arguments:
+        name, convert = RUN_OPTIONS[argument]
+        try:
+            options[name] = convert(args.get(argument))
+        except ValueError:
+            raise ValueError(f"Invalid value {args.get(argument)!r} for the option {argument}")
+    return options
+
+
+# Running an algorithm on an uploaded CSV or XLSX file instead of a Google spreadsheet (see uploads):
+#   POST /upload/<lang> with the file in the form field "file", the algorithm in "algorithm_name",
+#   and optionally the download format in "format" (xlsx or zip; default: xlsx for an XLSX file, zip for a CSV file)
+#   and the options of /run (explanations, pipelined, decompose).
+# Returns the job; when it is done, its output is at /jobs/<job-id>/download.
+@app.route('/upload/<lang>', methods=['POST'])
+def upload(lang:str):
+    algorithm_name = request.form.get('algorithm_name')
+    try:
+        algorithm = algorithms.get(algorithm_name)
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 404
+    file = request.files.get('file')
+    if file is None or file.filename=="":
+        return jsonify({"error": "Missing file"}), 400
+    print("file=",file.filename, "algorithm_name=",algorithm_name)
+    format = request.form.get('format') or ("xlsx" if file.filename.lower().endswith(".xlsx") else "zip")
+    if format not in uploads.FORMATS:
+        return jsonify({"error": f"Unknown download format {format!r}. Available formats: {list(uploads.FORMATS)}"}), 400
+    try:
+        options = _run_options(algorithm, request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        spreadsheet = uploads.open_upload(file.stream, file.filename, algorithm, lang)
+    except Exception as e:
+        print("error=",e)
+        return jsonify({"error": f"Could not read {file.filename}: {e}"}), 400
+    job = jobs.submit(algorithm_name, uploads.run, algorithm=algorithm, spreadsheet=spreadsheet, language=lang, format=format, **options)
+    print("job=",job.id)
+    return jsonify(job.to_dict()), 202
 
 
-# Viewing the log file
+# Polling the state of background jobs
+@app.route('/jobs')
+def list_jobs():
+    return jsonify([job.to_dict() for job in jobs.all_jobs()])
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id:str):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"No job with id {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id:str):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": f"No job with id {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/download')
+def download_job_output(job_id:str):
+    output = uploads.download(job_id)
+    if output is None:
+        return jsonify({"error": f"No output to download for job {job_id}"}), 404
+    filename, mimetype, contents = output
+    return send_file(io.BytesIO(contents), mimetype=mimetype, as_attachment=True, download_name=filename)
+
+
+# The profile of a run with profile=1 (administrator only):
+#   /jobs/<id>/profile              - the sampled stacks, in the folded format of flamegraph.pl and speedscope
+#   /jobs/<id>/profile?format=zip   - the sampled stacks, a summary of the memory use, and the tracemalloc snapshot
+@app.route('/jobs/<job_id>/profile')
+def download_job_profile(job_id:str):
+    if not profiling.is_authorized(_admin_token()):
+        return jsonify({"error": "Profiles require the administrator token"}), 403
+    profile = profiling.get(job_id)
+    if profile is None:
+        return jsonify({"error": f"No profile for job {job_id}"}), 404
+    if request.args.get('format')=='zip':
+        return send_file(io.BytesIO(profile.archive()), mimetype='application/zip', as_attachment=True, download_name=f"{job_id}-profile.zip")
+    return send_file(io.BytesIO(profile.folded.encode('utf-8')), mimetype='text/plain', as_attachment=True, download_name=f"{job_id}.folded")
+
+
+# The explanation of a single student, from the last run with explanations=on_demand on the given spreadsheet (in this worker process):
+#   /explain/<agent>?url=<spreadsheet url>&lang=<language>
+@app.route('/explain/<agent>')
+def explain(agent:str):
+    import spreadsheets
+    from courses import explanations
+    url = request.args.get('url')
+    if url is None:
+        return jsonify({"error": "Missing url"}), 400
+    explanation = explanations.explain(spreadsheets.spreadsheet_id(url), request.args.get('lang', 'he'), agent)
+    if explanation is None:
+        return jsonify({"error": f"No on-demand explanations for {url}. Run course_allocation with explanations=on_demand first."}), 404
+    return Response(explanation, mimetype='text/plain')
+
+
+# Viewing the log file:
+#   /log?tail=N                - the last N lines (default 1000)
+#   /log?offset=B&limit=L      - the lines in the byte range [B,B+L); the next offset is in the X-Next-Offset header
+#   /log?job=<id>              - only the lines of the given job (with either of the above)
+#   /log?follow=1              - the last lines, then new lines as server-sent events
 @app.route('/log')
 def log():
-    with open("app.log") as logfile:
-        logtext = logfile.read()
-    return Response(logtext, mimetype='text/plain')
+    job_id = request.args.get('job')
+    tail_lines = request.args.get('tail', 1000, type=int)
+    if request.args.get('follow'):
+        last_event_id = request.headers.get('Last-Event-ID', type=int)
+        if last_event_id is None:
+            backlog, offset = log_file.tail(log_file.LOG_FILE, tail_lines, job_id)
+        else:
+            offset, backlog = last_event_id, b""
+        events = ("data: "+line.decode('utf-8', errors='replace')+"\n\n" for line in backlog.splitlines())
+        stream = stream_with_context(log_file.follow(log_file.LOG_FILE, offset, job_id))
+        return Response((event for part in (events, stream) for event in part), mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    if 'offset' in request.args:
+        offset = request.args.get('offset', type=int)
+        limit = request.args.get('limit', type=int) if 'limit' in request.args else 1024*1024
+        if offset is None or offset<0 or limit is None or limit<=0:
+            return jsonify({"error": "offset must be a non-negative integer, and limit a positive integer"}), 400
+        text, next_offset = log_file.read_page(log_file.LOG_FILE, offset, limit, job_id)
+    else:
+        text, next_offset = log_file.tail(log_file.LOG_FILE, tail_lines, job_id)
+    return Response(text, mimetype='text/plain', headers={'X-Next-Offset': str(next_offset)})
+
+# Stage durations and API call counts of this worker process, in the Prometheus text format
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 # Testing background process
 @app.route('/background_process_test')
@@ -0,0 +1,111 @@
+"""
+Runs the algorithms on many spreadsheets or local files, from the command line.
+
+The manifest is a CSV file with the columns url, algorithm and (optionally) language,
+or a JSON-lines file with one object with these keys per line. For example:
+
+    url,algorithm,language
+    https://docs.google.com/spreadsheets/d/1tJPV.../edit,course_allocation,he
+    instances/coalition.xlsx,bounded_sharing,en
+
+Usage (from the main folder):
+
+    python batch.py manifest.csv --workers 4 --solver-processes 2 --report report.json
+
+Up to --workers spreadsheets are read and written at the same time, and up to --solver-processes allocations are computed at the same time.
+Each Sheets API request is rate-limited and retried by sheets_scheduler; a run that still fails because of the rate limit (HTTP 429)
+or a server error (HTTP 5xx) is retried as a whole, with the same backoff.
+"""
+
+import argparse, concurrent.futures, csv, json, sys, time, traceback, os
+import logging
+import sheets_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+def read_manifest(path:str, default_language:str="he")->list:
+	"""
+	Returns the entries of the given manifest (CSV or JSON lines) as a list of dicts with the keys url, algorithm and language.
+	"""
+	with open(path, newline="", encoding="utf-8") as file:
+		if path.endswith((".jsonl", ".json")):
+			entries = [json.loads(line) for line in file if line.strip()!="" and not line.startswith("#")]
+		else:
+			entries = list(csv.DictReader(line for line in file if not line.startswith("#")))
+	for number,entry in enumerate(entries, start=1):
+		if not entry.get("url") or not entry.get("algorithm"):
+			raise ValueError(f"{path}: entry {number} must have a url and an algorithm: {entry}")
+		entry["language"] = entry.get("language") or default_language
+	return entries
+
+
+def run_entry(entry:dict, max_attempts:int)->dict:
+	"""
+	Runs the algorithm of a single manifest entry, with retries, and returns a report of the run.
+	"""
+	import algorithms
+	report = {**entry, "status": None, "attempts": 0, "seconds": None, "result": None, "error": None}
+	start = time.perf_counter()
+	for attempt in range(max_attempts):
+		report["attempts"] = attempt+1
+		try:
+			report["result"] = algorithms.get(entry["algorithm"]).run(url=entry["url"], language=entry["language"])
+			report["status"] = "ok"
+			break
+		except Exception as error:
+			delay = sheets_scheduler.retry_delay(error, attempt)
+			if delay is None or attempt+1 >= max_attempts:
+				traceback.print_exc()
+				report["status"] = "failed"
+				report["error"] = str(error) or type(error).__name__
+				break
+			logger.warning("%s: HTTP %s, retrying in %.1f seconds", entry["url"], sheets_scheduler.status_code(error), delay)
+			time.sleep(delay)
+	report["seconds"] = time.perf_counter()-start
+	return report
+
+
+def write_report(reports:list, path:str):
+	"""
+	Writes the reports as JSON (if the path ends with .json) or CSV (otherwise).
+	"""
+	if path.endswith(".json"):
+		with open(path, "w", encoding="utf-8") as file:
+			json.dump(reports, file, indent=1, ensure_ascii=False, default=str)
+	else:
+		with open(path, "w", newline="", encoding="utf-8") as file:
+			writer = csv.DictWriter(file, fieldnames=["url", "algorithm", "language", "status", "attempts", "seconds", "error"], extrasaction="ignore")
+			writer.writeheader()
+			writer.writerows(reports)
+
+
+def main(argv=None)->int:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("manifest", help="CSV or JSON-lines file with the columns url, algorithm, language")
+	parser.add_argument("--workers", type=int, default=4, help="number of spreadsheets processed at the same time")
+	parser.add_argument("--solver-processes", type=int, default=None, help="number of solver processes (default: FAIRWEB_SOLVER_PROCESSES or the number of CPUs)")
+	parser.add_argument("--language", default="he", help="language of entries that do not specify one")
+	parser.add_argument("--attempts", type=int, default=5, help="maximum number of attempts per entry")
+	parser.add_argument("--report", default=None, help="file for the summary report (.json or .csv)")
+	args = parser.parse_args(argv)
+
+	if args.solver_processes is not None:
+		os.environ["FAIRWEB_SOLVER_PROCESSES"] = str(args.solver_processes)   # read when solver_pool is first imported
+	entries = read_manifest(args.manifest, args.language)
+	start = time.perf_counter()
+	with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="batch") as executor:
+		reports = list(executor.map(lambda entry: run_entry(entry, args.attempts), entries))
+
+	for report in reports:
+		print(f"{report['status']:7} {report['seconds']:8.1f}s  {report['algorithm']:20} {report['url']}" + (f"  ({report['error']})" if report['error'] else ""), file=sys.stderr)
+	num_failed = sum(report["status"]!="ok" for report in reports)
+	print(f"{len(reports)-num_failed} succeeded, {num_failed} failed, in {time.perf_counter()-start:.1f} seconds", file=sys.stderr)
+	if args.report is not None:
+		write_report(reports, args.report)
+	return 1 if num_failed>0 else 0
+
+
+if __name__=="__main__":
+	logging.basicConfig(level=logging.WARNING)
+	sys.exit(main())
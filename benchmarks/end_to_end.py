@@ -0,0 +1,172 @@
+"""
+End-to-end benchmark of both algorithms on synthetic instances.
+Times each stage (read, parse, allocate, output values, write) separately,
+records its peak memory and the number of Sheets API calls, and writes the results as JSON.
+The spreadsheet is a LocalSpreadsheet kept in memory, so no Google account is needed.
+
+Usage (from the main folder):
+
+    python -m benchmarks.end_to_end --sizes 100x20,1000x100 --output bench.json
+    python -m benchmarks.end_to_end --algorithms course_allocation --sizes 5000x500 --skip-allocate
+
+With --skip-allocate, the solver is replaced by a trivial allocation, so that the other stages
+can be measured on instances that are too large for the solver.
+"""
+
+import argparse, datetime, json, platform, subprocess, sys, tempfile, time, tracemalloc, os
+import numpy as np
+import gspread
+from benchmarks.generate import course_rows, bounded_sharing_rows
+from local_spreadsheet import LocalSpreadsheet
+from gspread_utils import write_worksheet, get_or_create_worksheets, update_first_cells
+
+# The same as in run_course_allocation and run_bounded_sharing, which cannot be imported without fairpy:
+COURSE_ALLOCATION_OUTPUT_SHEET_NAMES = ["allocation", "חלוקה"]
+BOUNDED_SHARING_OUTPUT_SHEET_NAMES = ["output", "תוצאות"]
+
+
+class Stages:
+	"""
+	Measures the time and peak memory of consecutive stages.
+	"""
+	def __init__(self):
+		self.results = {}
+
+	def run(self, name:str, function, *args, **kwargs):
+		tracemalloc.reset_peak()
+		start_memory = tracemalloc.get_traced_memory()[0]
+		start = time.perf_counter()
+		result = function(*args, **kwargs)
+		seconds = time.perf_counter()-start
+		peak_memory = tracemalloc.get_traced_memory()[1] - start_memory
+		self.results[name] = {"seconds": seconds, "peak_memory_bytes": peak_memory}
+		return result
+
+
+def _spreadsheet_with_rows(title:str, rows:list, simulated_latency:float)->LocalSpreadsheet:
+	spreadsheet = LocalSpreadsheet(os.path.join(tempfile.mkdtemp(), "benchmark"), simulated_latency=simulated_latency, autosave=False)
+	worksheet = spreadsheet._add_worksheet(title, len(rows), max(len(row) for row in rows))
+	worksheet._rows = [list(row) for row in rows]
+	return spreadsheet
+
+
+def trivial_course_allocation(agent_capacities:dict, item_capacities:dict, valuations:dict):
+	"""
+	Gives each agent its best items, ignoring the item capacities. Used instead of the solver with --skip-allocate.
+	"""
+	items = np.array(list(item_capacities.keys()))
+	map_agent_to_bundle = {}
+	for agent,capacity in agent_capacities.items():
+		values = np.fromiter(valuations[agent].values(), dtype=float, count=len(items))
+		map_agent_to_bundle[agent] = sorted(items[np.argsort(-values)[:capacity]].tolist())
+	return map_agent_to_bundle, {agent: f"{agent}: {bundle}" for agent,bundle in map_agent_to_bundle.items()}
+
+
+def trivial_bounded_sharing_allocation(agents:list, entitlement_normalized_preferences:dict):
+	"""
+	Gives each agent an equal fraction of each item. Used instead of the solver with --skip-allocate.
+	"""
+	num_items = len(next(iter(entitlement_normalized_preferences.values())))
+	return {agent: np.full(num_items, np.round(1/len(agents),3)) for agent in agents}
+
+
+def benchmark_course_allocation(num_agents:int, num_items:int, skip_allocate:bool, simulated_latency:float)->dict:
+	from courses import input, output
+	rows = course_rows(num_agents, num_items)
+	spreadsheet = _spreadsheet_with_rows("valuations", rows, simulated_latency)
+	stages = Stages()
+	rows = stages.run("read", input.read_rows, spreadsheet)
+	agent_capacities, item_capacities, valuations = stages.run("parse", input.analyze_rows, rows)
+	if skip_allocate:
+		allocate = trivial_course_allocation
+	else:
+		from courses.allocate import allocate
+	map_agent_to_bundle, map_agent_to_explanation = stages.run("allocate", allocate, agent_capacities, item_capacities, valuations)
+	new_values = stages.run("output_values", output.values, rows, agent_capacities, item_capacities, map_agent_to_bundle, map_agent_to_explanation, "en")
+	def write():
+		write_worksheet(spreadsheet, COURSE_ALLOCATION_OUTPUT_SHEET_NAMES, new_values)
+		get_or_create_worksheets(spreadsheet, list(map_agent_to_explanation.keys()), 1, 1)
+		update_first_cells(spreadsheet, map_agent_to_explanation)
+	stages.run("write", write)
+	return {"stages": stages.results, "api_calls": dict(spreadsheet.api_calls)}
+
+
+def benchmark_bounded_sharing(num_agents:int, num_items:int, skip_allocate:bool, simulated_latency:float)->dict:
+	from bounded_sharing import input, output
+	rows = bounded_sharing_rows(num_agents, num_items)
+	spreadsheet = _spreadsheet_with_rows("input", rows, simulated_latency)
+	stages = Stages()
+	rows = stages.run("read", input.read_rows, spreadsheet)
+	agents, items, entitlement_normalized_preferences = stages.run("parse", input.analyze_rows, rows)
+	if skip_allocate:
+		allocate = trivial_bounded_sharing_allocation
+	else:
+		from bounded_sharing.allocate import allocate
+	map_agent_to_fractions = stages.run("allocate", allocate, agents, entitlement_normalized_preferences)
+	new_values = stages.run("output_values", output.values, rows, agents, items, map_agent_to_fractions, "en")
+	first_cell = gspread.utils.rowcol_to_a1(2, 3)
+	last_cell = gspread.utils.rowcol_to_a1(len(agents)+2, len(items)+5)
+	stages.run("write", write_worksheet, spreadsheet, BOUNDED_SHARING_OUTPUT_SHEET_NAMES, new_values,
+		number_formats={f"{first_cell}:{last_cell}": {"type": "PERCENT", "pattern": "##.#%"}})
+	return {"stages": stages.results, "api_calls": dict(spreadsheet.api_calls)}
+
+
+BENCHMARKS = {
+	"course_allocation": benchmark_course_allocation,
+	"bounded_sharing": benchmark_bounded_sharing,
+}
+
+
+def _git_commit()->str:
+	try:
+		return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def parse_sizes(text:str)->list:
+	"""
+	>>> parse_sizes("100x20,5000x500")
+	[(100, 20), (5000, 500)]
+	"""
+	return [tuple(int(n) for n in size.split("x")) for size in text.split(",")]
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--algorithms", default=",".join(BENCHMARKS.keys()), help="comma-separated algorithm names")
+	parser.add_argument("--sizes", default="10x5,100x20,1000x100", help="comma-separated sizes, agents x items, up to 5000x500")
+	parser.add_argument("--skip-allocate", action="store_true", help="replace the solver by a trivial allocation")
+	parser.add_argument("--latency", type=float, default=0.0, help="simulated latency of each Sheets API call, in seconds")
+	parser.add_argument("--output", default=None, help="JSON file for the results (default: standard output)")
+	args = parser.parse_args(argv)
+
+	results = {
+		"git_commit": _git_commit(),
+		"timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+		"python": platform.python_version(),
+		"numpy": np.__version__,
+		"skip_allocate": args.skip_allocate,
+		"simulated_latency": args.latency,
+		"runs": [],
+	}
+	tracemalloc.start()
+	for algorithm_name in args.algorithms.split(","):
+		for num_agents,num_items in parse_sizes(args.sizes):
+			print(f"{algorithm_name} {num_agents}x{num_items} ...", file=sys.stderr)
+			run = BENCHMARKS[algorithm_name](num_agents, num_items, args.skip_allocate, args.latency)
+			results["runs"].append({"algorithm": algorithm_name, "agents": num_agents, "items": num_items, **run})
+			for stage,measures in run["stages"].items():
+				print(f"\t{stage:15} {measures['seconds']:9.4f}s {measures['peak_memory_bytes']/2**20:9.1f} MiB", file=sys.stderr)
+	tracemalloc.stop()
+
+	text = json.dumps(results, indent=1)
+	if args.output is None:
+		print(text)
+	else:
+		with open(args.output, "w") as file:
+			file.write(text)
+
+
+if __name__=="__main__":
+	main()
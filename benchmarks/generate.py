@@ -0,0 +1,56 @@
+"""
+Generators of synthetic input rows, in the layouts read by courses.input and bounded_sharing.input.
+"""
+
+import numpy as np
+
+
+def course_rows(num_agents:int, num_items:int, seed:int=0)->list:
+	"""
+	Returns random rows in the layout of the "valuations" worksheet of course allocation.
+
+	>>> rows = course_rows(3, 2)
+	>>> rows[1]
+	['', 'item', 'total', 'c1', 'c2']
+	>>> len(rows), len(rows[3])
+	(6, 5)
+	"""
+	rng = np.random.default_rng(seed)
+	items = [f"c{o+1}" for o in range(num_items)]
+	agent_capacities = rng.integers(1, min(num_items,6)+1, size=num_agents)
+	item_capacities  = rng.integers(1, max(2, 2*num_agents//max(num_items,1))+1, size=num_items)
+	valuations = rng.integers(0, 100, size=(num_agents,num_items))
+	valuations[:,0] += 1      # ensure that no agent has only zeros
+	rows = [["intro"]]
+	rows.append(["", "item", "total"] + items)
+	rows.append(["agent", "capacity", str(item_capacities.sum())] + [str(c) for c in item_capacities])
+	for i in range(num_agents):
+		rows.append([f"s{i+1}", str(agent_capacities[i]), str(valuations[i].sum())] + [str(v) for v in valuations[i]])
+	return rows
+
+
+def bounded_sharing_rows(num_agents:int, num_items:int, seed:int=0)->list:
+	"""
+	Returns random rows in the layout of the "input" worksheet of bounded sharing.
+
+	>>> rows = bounded_sharing_rows(2, 3)
+	>>> rows[0]
+	['party', 'mandates', 'i1', 'i2', 'i3', 'total']
+	>>> rows[-1][:2] == ['total', str(sum(int(row[1]) for row in rows[1:-1]))]
+	True
+	"""
+	rng = np.random.default_rng(seed)
+	items = [f"i{o+1}" for o in range(num_items)]
+	entitlements = rng.integers(1, 40, size=num_agents)
+	valuations = rng.integers(0, 30, size=(num_agents,num_items))
+	valuations[:,0] += 1
+	rows = [["party", "mandates"] + items + ["total"]]
+	for i in range(num_agents):
+		rows.append([f"p{i+1}", str(entitlements[i])] + [str(v) for v in valuations[i]] + [str(valuations[i].sum())])
+	rows.append(["total", str(entitlements.sum())] + [""]*(num_items+1))
+	return rows
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
@@ -0,0 +1,86 @@
+"""
+Compares the vectorized analyze_rows functions with the original pure-Python implementations.
+
+Usage (from the main folder):
+
+    python -m benchmarks.parsing --agents 2000 --items 200
+"""
+
+import argparse, timeit
+import numpy as np
+from benchmarks.generate import course_rows, bounded_sharing_rows
+import courses.input, bounded_sharing.input
+
+
+def legacy_course_analyze_rows(rows):
+	"""
+	The original courses.input.analyze_rows, with nested Python loops.
+	"""
+	items = [item for item in rows[1][3:] if item != '']
+	item_capacities = rows[2][3:]
+	map_item_to_capacity = {items[i]: int(item_capacities[i]) for i in range(len(items))}
+	rows_of_agents = rows[3:]
+	agents = [row[0] for row in rows_of_agents]
+	map_agent_to_capacity = {agents[i]: int(rows_of_agents[i][1]) for i in range(len(agents))}
+	def row_to_prefs(row:list)->list:
+		prefs_list = row[3:]
+		prefs_dict = {}
+		for o in range(len(items)):
+			value = prefs_list[o]
+			value = 0.0 if value=='' else float(value)
+			prefs_dict[items[o]] = value
+		return prefs_dict
+	raw_preferences = {row[0]: row_to_prefs(row) for row in rows_of_agents}
+	def normalized_prefs(prefs, new_sum):
+		current_sum = sum(prefs.values())
+		ratio = new_sum/current_sum
+		return {item: int(value*ratio) for item,value in prefs.items()}
+	normalized_valuations = {agent: normalized_prefs(prefs, new_sum=1000) for agent,prefs in raw_preferences.items()}
+	return map_agent_to_capacity, map_item_to_capacity, normalized_valuations
+
+
+def legacy_bounded_sharing_analyze_rows(rows):
+	"""
+	The original bounded_sharing.input.analyze_rows, with nested Python loops.
+	"""
+	items = [item for item in rows[0][2:-1] if item != '']
+	rows_of_agents = rows[1:-1]
+	agents = [row[0] for row in rows_of_agents]
+	entitlements = [int(row[1]) for row in rows_of_agents]
+	total_entitlements = sum(entitlements)
+	map_agent_to_entitlement = {agents[i]: entitlements[i] for i in range(len(agents))}
+	def row_to_prefs(row:list)->list:
+		prefs_list = row[2:-1]
+		prefs_dict = {}
+		for o in range(len(items)):
+			value = prefs_list[o]
+			value = 0.0 if value=='' else float(value)
+			prefs_dict[items[o]] = value
+		return prefs_dict
+	raw_preferences = {row[0]: row_to_prefs(row) for row in rows_of_agents}
+	def normalized_prefs(prefs, new_sum):
+		current_sum = sum(prefs.values())
+		ratio = new_sum/current_sum
+		return {item: np.round(value*ratio,3) for item,value in prefs.items()}
+	EPSILON =  0.001
+	entitlement_normalized_preferences = {
+		agent: normalized_prefs(prefs, total_entitlements / (map_agent_to_entitlement[agent]+EPSILON)) for agent,prefs in raw_preferences.items()
+	}
+	return agents, items, entitlement_normalized_preferences
+
+
+def compare(name:str, legacy_function, new_function, rows, repeat:int):
+	legacy_seconds = min(timeit.repeat(lambda: legacy_function(rows), number=1, repeat=repeat))
+	new_seconds    = min(timeit.repeat(lambda: new_function(rows), number=1, repeat=repeat))
+	print(f"{name:20} legacy: {legacy_seconds:8.4f}s   vectorized: {new_seconds:8.4f}s   speedup: {legacy_seconds/new_seconds:6.1f}x")
+
+
+if __name__=="__main__":
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--agents", type=int, default=2000)
+	parser.add_argument("--items", type=int, default=200)
+	parser.add_argument("--repeat", type=int, default=3)
+	args = parser.parse_args()
+	print(f"{args.agents} agents, {args.items} items")
+	compare("courses", legacy_course_analyze_rows, courses.input.analyze_rows, course_rows(args.agents, args.items), args.repeat)
+	compare("bounded_sharing", legacy_bounded_sharing_analyze_rows, bounded_sharing.input.analyze_rows, bounded_sharing_rows(args.agents, args.items), args.repeat)
@@ -10,22 +10,73 @@ import logging, sys, os
 currentdir = os.path.dirname(__file__)
 parentdir = os.path.dirname(currentdir)
 sys.path.append(parentdir)
-from gspread_utils import get_worksheet_by_list_of_possible_names
+from gspread_utils import get_worksheet_by_list_of_possible_names, read_table
+import matrix_input
+import metrics
 
 logger = logging.getLogger(__name__)
 
 
+INPUT_SHEET_NAMES = ["נתונים", "input"]
+
+
+@metrics.timed("read_rows")
 def read_rows(spreadsheet:gspread.Spreadsheet)->List[List[str]]:
 	"""
-	Returns a list of rows in the "input" worksheet of the given spreadsheet.
-	Each row is a list of string values.
+	Returns a list of rows in the "input" worksheet of the given spreadsheet (only its data region; see gspread_utils.read_table).
+	Each row is a list of values: numbers are int or float, and other values are strings.
 	"""
-	input_sheet = get_worksheet_by_list_of_possible_names(spreadsheet, ["נתונים", "input"], error_if_not_found=True)
+	input_sheet = get_worksheet_by_list_of_possible_names(spreadsheet, INPUT_SHEET_NAMES, error_if_not_found=True)
 	logger.info("Rows: %d, Cols: %d", input_sheet.row_count, input_sheet.col_count)
-	rows = input_sheet.get_all_values()
+	rows = read_table(spreadsheet, input_sheet.title, header_row=0)   # the item names are on row 0 (see parse_rows)
 	return rows
 
 
+def parse_rows(rows:List[List[str]])->Tuple[list,list,np.ndarray,np.ndarray]:
+	"""
+	Parses the given list of rows into arrays:
+	the list of agents, the list of items, the vector of entitlements,
+	and the agents*items matrix of valuations, normalized based on the entitlements.
+
+	>>> rows = [['party', 'mandates', 'foreign', 'defence', '', 'total'], ['likkud', '32', '20', '10', '', '30'], ['shas', '11', '5', '', '', '5'], ['total', '43', '', '', '', '']]
+	>>> agents, items, entitlements, entitlement_normalized_preferences = parse_rows(rows)
+	>>> agents, items, entitlements
+	(['likkud', 'shas'], ['foreign', 'defence'], array([32, 11]))
+	>>> entitlement_normalized_preferences
+	array([[0.896, 0.448],
+	       [3.909, 0.   ]])
+	"""
+	ROW_OF_ITEM_NAMES = 0         # The item names are on row 0
+	FIRST_COL_OF_ITEM_NAMES = 2   # The item names start at column 2 (columns 0,1 are for agent names, entitlements).
+	items = rows[ROW_OF_ITEM_NAMES][FIRST_COL_OF_ITEM_NAMES:-1]  # remove last column (total)
+	items = [str(item) for item in items if item != '']
+	logger.info("items: %s", items)
+
+	FIRST_ROW_OF_AGENT_NAMES = 1                          # remove item names 
+	rows_of_agents = rows[FIRST_ROW_OF_AGENT_NAMES:-1]    # remove total
+	agents = [str(row[0]) for row in rows_of_agents]         
+	logger.info("agents: %s", agents)
+
+	ENTITLEMENT_COLUMN = 1
+	entitlements = matrix_input.numbers(rows_of_agents, ENTITLEMENT_COLUMN, 1)[:,0].astype(int)
+	total_entitlements = entitlements.sum()
+	logger.info("entitlements: %s, total: %f", entitlements, total_entitlements)
+
+	def print_prefs(title, matrix):
+		if logger.isEnabledFor(logging.INFO):
+			logger.info(title)
+			for agent,prefs,total in zip(agents, matrix.tolist(), matrix.sum(axis=1)):
+				logger.info("\t%s:\t\t%s\t\t%f",agent, dict(zip(items,prefs)), total)
+
+	raw_preferences = matrix_input.numbers(rows_of_agents, FIRST_COL_OF_ITEM_NAMES, len(items))
+	print_prefs("raw_preferences: ", raw_preferences)
+
+	EPSILON =  0.001
+	entitlement_normalized_preferences = np.round(matrix_input.normalized(raw_preferences, total_entitlements / (entitlements+EPSILON)), 3)
+	print_prefs("entitlement_normalized_preferences: ", entitlement_normalized_preferences)
+	return agents, items, entitlements, entitlement_normalized_preferences
+
+
 def analyze_rows(rows:List[List[str]])->Tuple[list,list,dict]:
 	"""
 	Analyzes the given list of rows. 
@@ -51,54 +102,8 @@ def analyze_rows(rows:List[List[str]])->Tuple[list,list,dict]:
 	>>> entitlement_normalized_preferences[agents[0]]  # doctest: +ELLIPSIS
 	{'foreign': 5333.333, 'defence': 5333.333, 'finance': 5333.333, 'police': 2666.667, 'justice': 2666.667, 'interior': 2666.667, 'health': 2666.667, 'educations': 5333.333}
 	"""
-	ROW_OF_ITEM_NAMES = 0         # The item names are on row 0
-	FIRST_COL_OF_ITEM_NAMES = 2   # The item names start at column 2 (columns 0,1 are for agent names, entitlements).
-	items = rows[ROW_OF_ITEM_NAMES][FIRST_COL_OF_ITEM_NAMES:-1]  # remove last column (total)
-	items = [item for item in items if item != '']
-	logger.info("items: %s", items)
-
-
-	FIRST_ROW_OF_AGENT_NAMES = 1                          # remove item names 
-	rows_of_agents = rows[FIRST_ROW_OF_AGENT_NAMES:-1]    # remove total
-	agents = [row[0] for row in rows_of_agents]         
-	logger.info("agents: %s", agents)
-
-	entitlements = [int(row[1]) for row in rows_of_agents]
-	total_entitlements = sum(entitlements)
-	map_agent_to_entitlement = {agents[i]: entitlements[i] for i in range(len(agents))}
-	logger.info("entitlements: %s, total: %f", map_agent_to_entitlement, total_entitlements)
-
-	def print_prefs(title, map_agent_to_prefs):
-		logger.info(title)
-		for agent,prefs in map_agent_to_prefs.items():
-			logger.info("\t%s:\t\t%s\t\t%f",agent, prefs, sum(prefs.values()))	
-
-	def row_to_prefs(row:list)->list:
-		prefs_list = row[FIRST_COL_OF_ITEM_NAMES:-1]   # Remove party name, party entitlement, and total
-		prefs_dict = {}
-		for o in range(len(items)):
-			value = prefs_list[o]
-			value = 0.0 if value=='' else float(value)
-			prefs_dict[items[o]] = value
-		return prefs_dict
-	raw_preferences = {row[0]: row_to_prefs(row) for row in rows_of_agents}
-	print_prefs("raw_preferences: ", raw_preferences)
-
-	def normalized_prefs(prefs, new_sum):
-		current_sum = sum(prefs.values())
-		ratio = new_sum/current_sum
-		return {item: np.round(value*ratio,3) for item,value in prefs.items()}
-
-	# normalized_preferences = {
-	# 	agent: normalized_prefs(prefs, total_entitlements) for agent,prefs in raw_preferences.items()
-	# }
-	# print_prefs("normalized_preferences: ", normalized_preferences)
-
-	EPSILON =  0.001
-	entitlement_normalized_preferences = {
-		agent: normalized_prefs(prefs, total_entitlements / (map_agent_to_entitlement[agent]+EPSILON)) for agent,prefs in raw_preferences.items()
-	}
-	print_prefs("entitlement_normalized_preferences: ", entitlement_normalized_preferences)
+	agents, items, entitlements, entitlement_normalized_preferences = parse_rows(rows)
+	entitlement_normalized_preferences = matrix_input.to_dicts(agents, items, entitlement_normalized_preferences)
 	return agents, items, entitlement_normalized_preferences
 
 
@@ -3,11 +3,12 @@ Utilities for updating the output spreadsheet.
 """
 
 import gspread
-import logging, sys, os
+import logging, re, sys, os
 
 currentdir = os.path.dirname(__file__)
 parentdir = os.path.dirname(currentdir)
 sys.path.append(parentdir) 
+import matrix_input, metrics
 
 
 logger = logging.getLogger(__name__)
@@ -28,9 +29,29 @@ TEXTS = {
 }
 
 
-def cells(input_rows, agents, items, map_agent_to_fractions, language="he"):
+@metrics.timed("output_values")
+def values(input_rows, agents, items, map_agent_to_fractions, language="he", input_title:str="input", formulas:bool=True)->list:
 	"""
-	Returns new cells, for updating the output worksheet.
+	Returns a 2-D list of the new values of the output worksheet (None for an empty cell).
+	The formulas refer to the input worksheet by the given title.
+	If formulas is False, the copied input cells, the sums and the values are computed here rather than written as formulas
+	(for spreadsheets that do not evaluate formulas; see spreadsheets.evaluates_formulas).
+
+	>>> input_rows = [['party', 'mandates', 'x', 'y', 'total'], ['a', '3', '1', '2', '3'], ['b', '1', '2', '2', '4'], ['total', '4', '', '', '']]
+	>>> new_values = values(input_rows, ['a','b'], ['x','y'], {'a': [1.0, 0.25], 'b': [0.0, 0.75]}, "en")
+	>>> new_values[0]
+	['=input!A1', '=input!B1', 'x', 'y', None, 'Value in percent', 'Due value in percent', 'Value ratio']
+	>>> new_values[1]
+	['=input!A2', '=input!B2', 1.0, 0.25, None, '=SUMPRODUCT(input!C2:D2,C2:D2)/SUM(input!C2:D2)', '=B2/SUM(B2:B3)', '=F2/G2']
+	>>> new_values[3][:4]
+	['=input!A4', '=input!B4', '=SUM(C2:C3)', '=SUM(D2:D3)']
+	>>> values(input_rows, ['a','b'], ['x','y'], {'a': [1.0, 0.25], 'b': [0.0, 0.75]}, "he", input_title="נתונים")[1][0]
+	"='נתונים'!A2"
+	>>> for row in values(input_rows, ['a','b'], ['x','y'], {'a': [1.0, 0.25], 'b': [0.0, 0.75]}, "en", formulas=False): print(row)
+	['party', 'mandates', 'x', 'y', None, 'Value in percent', 'Due value in percent', 'Value ratio']
+	['a', '3', 1.0, 0.25, None, 0.5, 0.75, 0.6666666666666666]
+	['b', '1', 0.0, 0.75, None, 0.375, 0.25, 1.5]
+	['total', '4', 1.0, 1.0, None, None, None, None]
 	"""
 
 	def text(code:str):
@@ -38,51 +59,81 @@ def cells(input_rows, agents, items, map_agent_to_fractions, language="he"):
 
 	NAME_COLUMN = 1
 	ENTITLEMENT_COLUMN = 2
+	utility_column = len(items)+4
 
-	new_cells = []
-	new_cells += [gspread.Cell(i+1, NAME_COLUMN, "=input!"+gspread.utils.rowcol_to_a1(i+1,NAME_COLUMN)) for i in range(len(input_rows))]  # Copy column 1
-	new_cells += [gspread.Cell(i+1, ENTITLEMENT_COLUMN, "=input!"+gspread.utils.rowcol_to_a1(i+1,ENTITLEMENT_COLUMN)) for i in range(len(input_rows))]  # Copy column 2
-	new_cells += [gspread.Cell(1, o+3, items[o]) for o in range(len(items))]   # Write item names
+	num_rows = max(len(input_rows), len(agents)+2)
+	num_cols = utility_column+2
+	new_values = [[None]*num_cols for _ in range(num_rows)]
+	def set_cell(row:int, col:int, value):   # row and col are 1-based, as in gspread
+		new_values[row-1][col-1] = value
+
+	def input_cell(a1:str)->str:   # the title is quoted only if it must be, as Google Sheets shows it
+		return f"{input_title}!{a1}" if re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", input_title) else gspread.utils.absolute_range_name(input_title, a1)
+
+	for i in range(len(input_rows)):
+		for col in (NAME_COLUMN, ENTITLEMENT_COLUMN):   # Copy columns 1 and 2
+			if formulas:
+				set_cell(i+1, col, "="+input_cell(gspread.utils.rowcol_to_a1(i+1,col)))
+			elif len(input_rows[i])>=col:
+				set_cell(i+1, col, input_rows[i][col-1])
+	for o in range(len(items)):
+		set_cell(1, o+3, items[o])   # Write item names
 
 	# Insert results:
 	for i in range(len(agents)):
 		bundle_i = map_agent_to_fractions[agents[i]]
-		print(agents[i], ": ", bundle_i)
+		logger.info("%s: %s", agents[i], bundle_i)
 		for o in range(len(items)):
-			fraction_i_o = map_agent_to_fractions[agents[i]][o]
-			new_cells += [gspread.Cell(i+2, o+3, fraction_i_o)]
+			set_cell(i+2, o+3, bundle_i[o])
 
 	row_of_total = len(agents)+2
 	for o in range(len(items)):
 		col = o+3
 		first_cell = gspread.utils.rowcol_to_a1(2, col)
 		last_cell = gspread.utils.rowcol_to_a1(len(agents)+1, col)
-		new_cells += [gspread.Cell(row_of_total, col, f"=SUM({first_cell}:{last_cell})")]
+		set_cell(row_of_total, col, f"=SUM({first_cell}:{last_cell})" if formulas else
+			float(sum(map_agent_to_fractions[agent][o] for agent in agents)))
 
 	# Insert formula for computing the utilities:
 
-	utility_column = len(items)+4
-	new_cells += [gspread.Cell(1, utility_column,  text("value_percent"))]
-	new_cells += [gspread.Cell(1, utility_column+1, text("due_value_percent"))]
-	new_cells += [gspread.Cell(1, utility_column+2, text("value_ratio"))]
+	set_cell(1, utility_column,  text("value_percent"))
+	set_cell(1, utility_column+1, text("due_value_percent"))
+	set_cell(1, utility_column+2, text("value_ratio"))
+
+	if not formulas:
+		valuations = matrix_input.numbers(input_rows[1:len(agents)+1], 2, len(items))
+		entitlements = matrix_input.numbers(input_rows[1:len(agents)+1], ENTITLEMENT_COLUMN-1, 1)[:,0]
+		def ratio(numerator, denominator):
+			return float(numerator/denominator) if denominator!=0 else None
+		for i in range(len(agents)):
+			value = ratio(valuations[i] @ map_agent_to_fractions[agents[i]], valuations[i].sum())
+			due_value = ratio(entitlements[i], entitlements.sum())
+			set_cell(i+2, utility_column, value)
+			set_cell(i+2, utility_column+1, due_value)
+			set_cell(i+2, utility_column+2, ratio(value, due_value) if value is not None and due_value is not None else None)
+		return new_values
 
 	for i in range(len(agents)):
 		row_num = i+2
 		first_cell = gspread.utils.rowcol_to_a1(row_num, 3)
 		last_cell = gspread.utils.rowcol_to_a1(row_num, len(items)+2)
 		range_a1 = f"{first_cell}:{last_cell}"
-		new_cells += [gspread.Cell(row_num, utility_column, f"=SUMPRODUCT(input!{range_a1},output!{range_a1})/sum(input!{range_a1})")]
+		set_cell(row_num, utility_column, f"=SUMPRODUCT({input_cell(range_a1)},{range_a1})/SUM({input_cell(range_a1)})")
 
 		utility_cell = gspread.utils.rowcol_to_a1(row_num, utility_column)
 		entitlement_cell = gspread.utils.rowcol_to_a1(row_num, ENTITLEMENT_COLUMN)
 		first_entitlement_cell = gspread.utils.rowcol_to_a1(2, ENTITLEMENT_COLUMN)
 		last_entitlement_cell = gspread.utils.rowcol_to_a1(len(agents)+1, ENTITLEMENT_COLUMN)
-		new_cells += [gspread.Cell(row_num, utility_column+1, f"={entitlement_cell}/SUM({first_entitlement_cell}:{last_entitlement_cell})")]
+		set_cell(row_num, utility_column+1, f"={entitlement_cell}/SUM({first_entitlement_cell}:{last_entitlement_cell})")
 
 		entitlement_cell_percent = gspread.utils.rowcol_to_a1(row_num, utility_column+1)
-		new_cells += [gspread.Cell(row_num, utility_column+2, f"={utility_cell}/{entitlement_cell_percent}")]
+		set_cell(row_num, utility_column+2, f"={utility_cell}/{entitlement_cell_percent}")
 
-	return new_cells
+	return new_values
 
 # print("output version 2")
-	
\ No newline at end of file
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
@@ -4,26 +4,68 @@ Utilities for computing the allocation.
 
 import fairpy.courses
 import numpy as np
-import logging
+import logging, os, sys
+
+currentdir = os.path.dirname(__file__)
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+from courses.explanations import EventLog, check_level
 
 logger = logging.getLogger(__name__)
 
-def allocate(agent_capacities, item_capacities, valuations)->dict:
+
+class EventLogExplanationLogger(fairpy.courses.explanations.ExplanationLogger):
+	"""
+	An explanation logger that only records the events (message template, arguments and agents) in an EventLog,
+	without formatting any string. The explanation of an agent is rendered from the log when it is requested.
+	"""
+	def __init__(self):
+		super().__init__()
+		self.event_log = EventLog()
+
+	def debug(self, message:str, *args, agents=None):
+		self.event_log.add(message, args, agents)
+
+	def info(self, message:str, *args, agents=None):
+		self.event_log.add(message, args, agents)
+
+	def warning(self, message:str, *args, agents=None):
+		self.event_log.add(message, args, agents)
+
+
+def allocate(agent_capacities, item_capacities, valuations, explanations:str="full")->tuple:
 	"""
 	Compute a course allocation to students.
+	Returns the allocation, and the explanations at the given level (see courses.explanations):
+	a dict mapping each agent to its explanation if the level is "full", an EventLog if it is "on_demand", and an empty dict otherwise.
 
 	>>> agent_capacities = {'s1': 6, 's2': 4, 's3': 4, 's4': 6, 's5': 3}
 	>>> item_capacities = {'c1': 40, 'c2': 40, 'c3': 40, 'c4': 20}
 	>>> valuations = {'s1': {'c1': 161, 'c2': 85, 'c3': 420, 'c4': 332}, 's2': {'c1': 285, 'c2': 141, 'c3': 486, 'c4': 86}, 's3': {'c1': 153, 'c2': 353, 'c3': 278, 'c4': 215}, 's4': {'c1': 99, 'c2': 122, 'c3': 759, 'c4': 18}, 's5': {'c1': 382, 'c2': 257, 'c3': 8, 'c4': 351}}
 	>>> allocate(agent_capacities, item_capacities, valuations)[0]
 	{'s1': ['c1', 'c2', 'c3', 'c4'], 's2': ['c1', 'c2', 'c3', 'c4'], 's3': ['c1', 'c2', 'c3', 'c4'], 's4': ['c1', 'c2', 'c3', 'c4'], 's5': ['c1', 'c2', 'c4']}
+	>>> allocate(agent_capacities, item_capacities, valuations, explanations="off")[1]
+	{}
+	>>> allocate(agent_capacities, item_capacities, valuations, explanations="on_demand")[1].render('s5') == allocate(agent_capacities, item_capacities, valuations)[1]['s5']
+	True
 	"""
+	check_level(explanations)
 	instance = fairpy.courses.Instance(agent_capacities=agent_capacities, item_capacities=item_capacities, valuations=valuations)
 	agents = agent_capacities.keys()
-	string_explanation_logger = fairpy.courses.explanations.StringsExplanationLogger(agents)
-	map_agent_name_to_bundle = fairpy.courses.divide(fairpy.courses.iterated_maximum_matching, instance=instance, explanation_logger=string_explanation_logger, adjust_utilities=True)
+	if explanations=="full":
+		explanation_logger = fairpy.courses.explanations.StringsExplanationLogger(agents)
+	elif explanations=="on_demand":
+		explanation_logger = EventLogExplanationLogger()
+	else:   # "off" and "summary" (the summary is computed from the allocation, see courses.explanations.summaries)
+		explanation_logger = fairpy.courses.explanations.ExplanationLogger()
+	map_agent_name_to_bundle = fairpy.courses.divide(fairpy.courses.iterated_maximum_matching, instance=instance, explanation_logger=explanation_logger, adjust_utilities=True)
 	logger.info("map_agent_name_to_bundle: %s", map_agent_name_to_bundle)
-	return map_agent_name_to_bundle, string_explanation_logger.map_agent_to_explanation()
+	if explanations=="full":
+		return map_agent_name_to_bundle, explanation_logger.map_agent_to_explanation()
+	elif explanations=="on_demand":
+		return map_agent_name_to_bundle, explanation_logger.event_log
+	else:
+		return map_agent_name_to_bundle, {}
 
 
 if __name__=="__main__":
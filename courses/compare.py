@@ -0,0 +1,116 @@
+"""
+Compares several course-allocation algorithms and tie-breaking seeds on the same instance.
+
+The variants run in parallel in the shared solver pool (see solver_pool), so a comparison is bounded by the same number of processes
+and the same CPU time limit as any other solve. The instance is sent with each variant.
+Each variant is evaluated by its utilitarian welfare (the sum of utilities) and egalitarian welfare (the minimum utility),
+where the utilities are computed from the valuations normalized to a fixed sum (see courses.input).
+"""
+
+import numpy as np
+import time, os, sys
+import logging
+
+currentdir = os.path.dirname(__file__)
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+import solver_pool
+from courses.incidence import Incidence
+
+logger = logging.getLogger(__name__)
+
+ALGORITHMS = [     # Names of algorithms in fairpy.courses that can be compared.
+	"iterated_maximum_matching_adjusted",
+	"iterated_maximum_matching_unadjusted",
+	"round_robin",
+	"bidirectional_round_robin",
+	"serial_dictatorship",
+	"utilitarian_matching",
+]
+PICKING_SEQUENCES = ["round_robin", "bidirectional_round_robin", "serial_dictatorship"]    # Algorithms that accept an agent_order.
+
+
+def agent_order(agents:list, seed:int)->list:
+	"""
+	Returns the order in which the agents are considered when ties are broken. Seed 0 is the order of the input.
+
+	>>> agent_order(['a', 'b', 'c'], 0)
+	['a', 'b', 'c']
+	>>> sorted(agent_order(['a', 'b', 'c'], 1))
+	['a', 'b', 'c']
+	"""
+	if seed==0:
+		return list(agents)
+	return [agents[i] for i in np.random.default_rng(seed).permutation(len(agents))]
+
+
+def run_variant(agent_capacities:dict, item_capacities:dict, valuations:dict, algorithm_name:str, seed:int)->tuple:
+	"""
+	Runs in a worker process. Runs the given algorithm on the given instance,
+	with the agents ordered by the given seed, and returns the allocation, the wall-clock seconds and the CPU seconds.
+	"""
+	import fairpy.courses
+	order = agent_order(list(agent_capacities.keys()), seed)
+	kwargs = {"agent_order": order} if algorithm_name in PICKING_SEQUENCES else {}
+	instance = fairpy.courses.Instance(
+		agent_capacities={agent: agent_capacities[agent] for agent in order},
+		item_capacities=item_capacities,
+		valuations={agent: valuations[agent] for agent in order})
+	start, cpu_start = time.perf_counter(), time.process_time()
+	map_agent_to_bundle = fairpy.courses.divide(getattr(fairpy.courses, algorithm_name), instance=instance, **kwargs)
+	return map_agent_to_bundle, time.perf_counter()-start, time.process_time()-cpu_start
+
+
+def compare(agent_capacities:dict, item_capacities:dict, valuations:dict, algorithm_names:list, seeds:list)->list:
+	"""
+	Runs every algorithm with every seed (seeds matter only for algorithms with ties) in parallel,
+	and returns a list of dicts with the metrics of each variant, the best first (by egalitarian, then utilitarian welfare).
+	A variant that fails is reported with its error, and is listed last.
+
+	>>> agent_capacities, item_capacities = {"s1": 1, "s2": 1}, {"c1": 1, "c2": 1}
+	>>> valuations = {"s1": {"c1": 900, "c2": 100}, "s2": {"c1": 200, "c2": 800}}
+	>>> reports = compare(agent_capacities, item_capacities, valuations, ["round_robin", "serial_dictatorship"], [0, 1])
+	>>> [(report["algorithm"], report["seed"], report["utilitarian"], report["egalitarian"], report["allocation"]) for report in reports]   # doctest: +NORMALIZE_WHITESPACE
+	[('round_robin', 0, 1700.0, 800.0, {'s1': ['c1'], 's2': ['c2']}), ('round_robin', 1, 1700.0, 800.0, {'s1': ['c1'], 's2': ['c2']}),
+	 ('serial_dictatorship', 0, 1700.0, 800.0, {'s1': ['c1'], 's2': ['c2']}), ('serial_dictatorship', 1, 1700.0, 800.0, {'s1': ['c1'], 's2': ['c2']})]
+	>>> compare(agent_capacities, item_capacities, valuations, ["no_such_algorithm"], [0])
+	Traceback (most recent call last):
+	...
+	ValueError: Unknown algorithm 'no_such_algorithm'. Available algorithms: ['iterated_maximum_matching_adjusted', 'iterated_maximum_matching_unadjusted', 'round_robin', 'bidirectional_round_robin', 'serial_dictatorship', 'utilitarian_matching']
+	"""
+	variants = [(algorithm_name, seed) for algorithm_name in algorithm_names for seed in seeds]
+	for algorithm_name,_ in variants:
+		if algorithm_name not in ALGORITHMS:
+			raise ValueError(f"Unknown algorithm {algorithm_name!r}. Available algorithms: {ALGORITHMS}")
+	agents, items = list(agent_capacities.keys()), list(item_capacities.keys())
+	valuation_matrix = np.array([[valuations[agent][item] for item in items] for agent in agents], dtype=float)
+
+	outcomes = dict(zip(variants, solver_pool.solve_many(run_variant,
+		[(agent_capacities, item_capacities, valuations, algorithm_name, seed) for algorithm_name,seed in variants],
+		return_exceptions=True)))
+
+	reports = []
+	for (algorithm_name, seed),outcome in outcomes.items():
+		report = {"algorithm": algorithm_name, "seed": seed}
+		if isinstance(outcome, Exception):
+			logger.warning("%s (seed %d) failed: %s", algorithm_name, seed, outcome)
+			report["error"] = str(outcome) or type(outcome).__name__
+		else:
+			map_agent_to_bundle, seconds, cpu_seconds = outcome
+			utilities = Incidence.from_bundles(agents, items, map_agent_to_bundle).utilities(valuation_matrix)
+			report.update({
+				"utilitarian": float(utilities.sum()),
+				"egalitarian": float(utilities.min()) if len(agents)>0 else 0.0,
+				"mean_utility": float(utilities.mean()) if len(agents)>0 else 0.0,
+				"seconds": seconds,
+				"cpu_seconds": cpu_seconds,
+				"allocation": map_agent_to_bundle,
+			})
+		reports.append(report)
+	reports.sort(key=lambda report: ("error" in report, -report.get("egalitarian", 0), -report.get("utilitarian", 0)))
+	return reports
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
@@ -0,0 +1,177 @@
+"""
+Decomposition of a course-allocation instance into independent components.
+
+Students and courses are the vertices of a bipartite graph, in which a student is connected to each course it values positively
+(if both have a positive capacity). Students in different connected components never compete on a course,
+so each component can be solved separately, in parallel worker processes, and the bundles merged.
+Explanations are merged too; a message of a component that concerns all students concerns only the students of that component.
+
+Students and courses that have no edges are put together in one more component, which is solved only if it has both.
+
+However, iterated_maximum_matching of fairpy also gives a student leftover seats in courses it values at 0,
+and these may belong to another component. So if, after the components are solved, a student of one component
+still has room and a course of another component still has free seats (see may_spill_over), the whole instance is solved instead,
+and the allocation is that of the whole instance.
+"""
+
+import numpy as np
+import logging, sys, os
+
+currentdir = os.path.dirname(__file__)
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+import solver_pool
+from courses.explanations import EventLog
+
+logger = logging.getLogger(__name__)
+
+
+class DisjointSets:
+	"""
+	A union-find structure over the elements 0,...,n-1, with union by size and path halving.
+
+	>>> sets = DisjointSets(5)
+	>>> sets.union(0, 3); sets.union(3, 4)
+	>>> sets.find(4)==sets.find(0), sets.find(1)==sets.find(0)
+	(True, False)
+	"""
+	def __init__(self, n:int):
+		self.parent = list(range(n))
+		self.size = [1]*n
+
+	def find(self, x:int)->int:
+		parent = self.parent
+		while parent[x]!=x:
+			parent[x] = parent[parent[x]]
+			x = parent[x]
+		return x
+
+	def union(self, x:int, y:int):
+		x, y = self.find(x), self.find(y)
+		if x==y:
+			return
+		if self.size[x] < self.size[y]:
+			x, y = y, x
+		self.parent[y] = x
+		self.size[x] += self.size[y]
+
+
+def components(agent_capacities:dict, item_capacities:dict, valuations:dict)->list:
+	"""
+	Returns the connected components of the instance, as a list of pairs (agents, items), the largest first.
+	Agents and items keep their order in the instance. The last pair, if any, contains the agents and items that have no edges.
+
+	>>> agent_capacities = {'s1': 1, 's2': 1, 's3': 1, 's4': 1}
+	>>> item_capacities = {'c1': 1, 'c2': 1, 'c3': 1, 'c4': 1}
+	>>> valuations = {'s1': {'c1': 5, 'c2': 0, 'c3': 0, 'c4': 0}, 's2': {'c1': 0, 'c2': 0, 'c3': 3, 'c4': 0}, 's3': {'c1': 2, 'c2': 0, 'c3': 0, 'c4': 0}, 's4': {'c1': 0, 'c2': 0, 'c3': 0, 'c4': 0}}
+	>>> components(agent_capacities, item_capacities, valuations)
+	[(['s1', 's3'], ['c1']), (['s2'], ['c3']), (['s4'], ['c2', 'c4'])]
+	"""
+	agents, items = list(agent_capacities.keys()), list(item_capacities.keys())
+	num_agents = len(agents)
+	matrix = np.array([[valuations[agent][item] for item in items] for agent in agents], dtype=float).reshape(num_agents, len(items))
+	matrix[np.array([agent_capacities[agent] for agent in agents])<=0, :] = 0
+	matrix[:, np.array([item_capacities[item] for item in items])<=0] = 0
+	sets = DisjointSets(num_agents + len(items))    # agent i is element i, item o is element num_agents+o
+	for i,o in zip(*np.nonzero(matrix>0)):
+		sets.union(int(i), num_agents+int(o))
+	has_edges = np.concatenate([(matrix>0).any(axis=1), (matrix>0).any(axis=0)])
+
+	map_root_to_component = {}
+	isolated = ([], [])
+	for i,agent in enumerate(agents):
+		component = map_root_to_component.setdefault(sets.find(i), ([], [])) if has_edges[i] else isolated
+		component[0].append(agent)
+	for o,item in enumerate(items):
+		component = map_root_to_component.setdefault(sets.find(num_agents+o), ([], [])) if has_edges[num_agents+o] else isolated
+		component[1].append(item)
+	result = sorted(map_root_to_component.values(), key=lambda component: -len(component[0])*len(component[1]))
+	if len(isolated[0])>0 or len(isolated[1])>0:
+		result.append(isolated)
+	return result
+
+
+def may_spill_over(parts:list, agent_capacities:dict, item_capacities:dict, map_agent_to_bundle:dict)->bool:
+	"""
+	Returns True if, in the given allocation of the components, a student of one component has room for more courses
+	and a course of another component has free seats, so that solving the whole instance might give the student that seat.
+
+	>>> parts = [(['s1', 's2'], ['c1']), (['s3'], ['c2'])]
+	>>> may_spill_over(parts, {'s1': 1, 's2': 1, 's3': 1}, {'c1': 1, 'c2': 2}, {'s1': ['c1'], 's2': [], 's3': ['c2']})
+	True
+	>>> may_spill_over(parts, {'s1': 1, 's2': 1, 's3': 1}, {'c1': 1, 'c2': 1}, {'s1': ['c1'], 's2': [], 's3': ['c2']})
+	False
+	"""
+	seats = {item: 0 for item in item_capacities}
+	for bundle in map_agent_to_bundle.values():
+		for item in bundle:
+			seats[item] += 1
+	with_room = {index for index,(agents,_) in enumerate(parts)
+		if any(len(map_agent_to_bundle.get(agent, []))<agent_capacities[agent] for agent in agents)}
+	with_seats = {index for index,(_,items) in enumerate(parts)
+		if any(seats[item]<item_capacities[item] for item in items)}
+	return any(index!=other for index in with_room for other in with_seats)
+
+
+def allocate(allocate_function, agent_capacities:dict, item_capacities:dict, valuations:dict, explanations:str="full")->tuple:
+	"""
+	Calls allocate_function (e.g. courses.allocate.allocate) on each component of the instance in a worker process (see solver_pool),
+	and returns the merged allocation and explanations, in the same format as allocate_function.
+	An instance with a single component is solved as a whole, and so is an instance whose leftover seats may spill over
+between components (see may_spill_over).
+
+	>>> from courses import allocate as whole
+	>>> agent_capacities = {'s1': 1, 's2': 1, 's3': 1}
+	>>> item_capacities = {'c1': 1, 'c2': 1, 'c3': 1, 'c4': 1}
+	>>> valuations = {'s1': {'c1': 60, 'c2': 40, 'c3': 0, 'c4': 0}, 's2': {'c1': 30, 'c2': 70, 'c3': 0, 'c4': 0}, 's3': {'c1': 0, 'c2': 0, 'c3': 80, 'c4': 20}}
+	>>> len(components(agent_capacities, item_capacities, valuations))
+	2
+	>>> bundles = allocate(whole.allocate, agent_capacities, item_capacities, valuations, explanations="off")[0]
+	>>> bundles, bundles==whole.allocate(agent_capacities, item_capacities, valuations, explanations="off")[0]
+	({'s1': ['c1'], 's2': ['c2'], 's3': ['c3']}, True)
+
+	A course that students of both groups value joins them into one component, which is not split:
+
+	>>> valuations['s3']['c1'] = 10
+	>>> components(agent_capacities, item_capacities, valuations)
+	[(['s1', 's2', 's3'], ['c1', 'c2', 'c3', 'c4'])]
+
+	Here s2 gets no seat in its component, but c2 of the other component has a free seat, which s2 gets in the whole instance:
+
+	>>> agent_capacities, item_capacities = {'s1': 1, 's2': 1, 's3': 1}, {'c1': 1, 'c2': 2}
+	>>> valuations = {'s1': {'c1': 50, 'c2': 0}, 's2': {'c1': 50, 'c2': 0}, 's3': {'c1': 0, 'c2': 50}}
+	>>> len(components(agent_capacities, item_capacities, valuations))
+	2
+	>>> allocate(whole.allocate, agent_capacities, item_capacities, valuations, explanations="off")[0]==whole.allocate(agent_capacities, item_capacities, valuations, explanations="off")[0]
+	True
+	"""
+	parts = components(agent_capacities, item_capacities, valuations)
+	if len(parts)<=1:
+		return solver_pool.solve(allocate_function, agent_capacities, item_capacities, valuations, explanations=explanations)
+	logger.info("solving %d components, with %s agents", len(parts), [len(agents) for agents,_ in parts])
+	solvable = [(agents,items) for agents,items in parts if len(agents)>0 and len(items)>0]
+	results = solver_pool.solve_many(allocate_function, [
+		({agent: agent_capacities[agent] for agent in agents},
+		 {item: item_capacities[item] for item in items},
+		 {agent: {item: valuations[agent][item] for item in items} for agent in agents})
+		for agents,items in solvable], explanations=explanations)
+
+	map_agent_to_bundle = {agent: [] for agent in agent_capacities}
+	merged_explanations = EventLog() if explanations=="on_demand" else {}
+	for (agents,_),(bundles,component_explanations) in zip(solvable, results):
+		map_agent_to_bundle.update(bundles)
+		if explanations=="on_demand":
+			merged_explanations.extend(component_explanations, agents)
+		else:
+			merged_explanations.update(component_explanations)
+	if may_spill_over(parts, agent_capacities, item_capacities, map_agent_to_bundle):
+		logger.info("leftover seats may spill over between components; solving the whole instance")
+		return solver_pool.solve(allocate_function, agent_capacities, item_capacities, valuations, explanations=explanations)
+	if explanations=="full":   # the explanations of agents that were not solved, in the order of the instance
+		merged_explanations = {agent: merged_explanations.get(agent, "") for agent in agent_capacities}
+	return map_agent_to_bundle, merged_explanations
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
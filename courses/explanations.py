@@ -0,0 +1,167 @@
+"""
+Explanations of a course allocation, at a selectable level:
+
+ * "off"       - no explanations.
+ * "summary"   - one line per student (bundle and value), computed after the allocation and written to a single worksheet.
+ * "full"      - the detailed explanation of the algorithm, written to one worksheet per student.
+ * "on_demand" - the algorithm records a compact event log, and the explanation of a single student is rendered when requested
+                 (see the /explain route of app.py).
+"""
+
+import numpy as np
+import copy, os, sys
+
+currentdir = os.path.dirname(__file__)
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+from courses.incidence import Incidence
+import result_cache
+
+LEVELS = ["off", "summary", "full", "on_demand"]
+DEFAULT_LEVEL = os.environ.get("FAIRWEB_EXPLANATIONS", "full")
+
+MAX_REMEMBERED_LOGS = int(os.environ.get("FAIRWEB_EXPLANATION_LOGS", 16))    # Number of event logs kept for on-demand explanations.
+
+TEXTS = {
+	"summary": {
+		"he": "קיבלת %d קורסים: %s. הניקוד הכולל שלהם הוא %g, שהוא %g%% מהניקוד הגבוה ביותר האפשרי עבורך (%g).",
+		"en": "You received %d courses: %s. Their total value is %g, which is %g%% of your maximum possible value (%g).",
+	},
+}
+
+
+def check_level(level:str)->str:
+	if level not in LEVELS:
+		raise ValueError(f"Unknown explanation level {level!r}. Available levels: {LEVELS}")
+	return level
+
+
+_IMMUTABLE_TYPES = (str, int, float, bool, type(None), np.generic)    # arguments that are kept without copying
+
+
+class EventLog:
+	"""
+	The explanation events of a single run, recorded compactly: each message template is stored once,
+	and each event keeps only the index of its template, its arguments, and its agents.
+
+	>>> log = EventLog()
+	>>> log.add("Iteration %d", (1,), None)
+	>>> log.add("You get course %s", ("c1",), "s1")
+	>>> log.add("You get course %s", ("c2",), ["s2", "s3"])
+	>>> log.render("s1")
+	'Iteration 1\\nYou get course c1'
+	>>> log.render("s3")
+	'Iteration 1\\nYou get course c2'
+	>>> log.messages, log.agents()
+	(['Iteration %d', 'You get course %s'], ['s1', 's2', 's3'])
+
+	The arguments are copied when the event is added, since the algorithm may change them later (e.g. the remaining capacities):
+
+	>>> remaining = {'c1': 40}
+	>>> log.add("Remaining: %s", (remaining,), None)
+	>>> remaining['c1'] = 35
+	>>> log.render("s1").splitlines()[-1]
+	"Remaining: {'c1': 40}"
+	"""
+	def __init__(self):
+		self.messages = []
+		self.events = []          # list of triples (message index, args, agents); agents is None (all agents), an agent, or a tuple of agents
+		self._message_index = {}
+
+	def add(self, message:str, args:tuple, agents):
+		index = self._message_index.get(message, None)
+		if index is None:
+			index = self._message_index[message] = len(self.messages)
+			self.messages.append(message)
+		if agents is not None and not isinstance(agents, (str, int)):
+			agents = tuple(agents)
+		if args:
+			args = tuple(arg if isinstance(arg, _IMMUTABLE_TYPES) else copy.deepcopy(arg) for arg in args)
+		self.events.append((index, args, agents))
+
+	def extend(self, other:"EventLog", agents:list):
+		"""
+		Appends the events of another log, whose events for all agents concern only the given agents
+		(e.g. the log of one component of the instance, see courses.components).
+
+		>>> log, other = EventLog(), EventLog()
+		>>> log.add("Iteration %d", (1,), None); other.add("Iteration %d", (1,), None)
+		>>> log.extend(other, ["s2"])
+		>>> log.render("s1"), log.render("s2")
+		('Iteration 1', 'Iteration 1\\nIteration 1')
+		"""
+		for index,args,event_agents in other.events:
+			self.add(other.messages[index], args, tuple(agents) if event_agents is None else event_agents)
+
+	def _is_for(self, agents, agent)->bool:
+		return agents is None or agents==agent or (isinstance(agents, tuple) and agent in agents)
+
+	def render(self, agent)->str:
+		"""
+		Returns the explanation of the given agent, in the format of the strings explanation logger of fairpy.
+		"""
+		return "\n".join(
+			self.messages[index] % args if args else self.messages[index]
+			for index,args,agents in self.events
+			if self._is_for(agents, agent))
+
+	def agents(self)->list:
+		"""
+		Returns the agents that have events of their own.
+		"""
+		agents = {}
+		for _,_,event_agents in self.events:
+			if event_agents is not None:
+				agents.update(dict.fromkeys(event_agents if isinstance(event_agents, tuple) else (event_agents,)))
+		return sorted(agents)
+
+	def __getstate__(self):
+		return {"messages": self.messages, "events": self.events}
+
+	def __setstate__(self, state):
+		self.messages, self.events = state["messages"], state["events"]
+		self._message_index = {message:index for index,message in enumerate(self.messages)}
+
+
+def summaries(agents:list, items:list, agent_capacities:np.ndarray, valuations:np.ndarray, map_agent_to_bundle:dict, language:str)->dict:
+	"""
+	Returns a one-line explanation for each agent: its bundle, and the value of its bundle relative to the maximum possible value
+	(the sum of its highest valuations, up to its capacity).
+
+	>>> summaries(['s1'], ['c1', 'c2', 'c3'], np.array([2]), np.array([[500, 300, 200]]), {'s1': ['c3', 'c1']}, "en")
+	{'s1': 'You received 2 courses: c1, c3. Their total value is 700, which is 87.5% of your maximum possible value (800).'}
+	"""
+	incidence = Incidence.from_bundles(agents, items, map_agent_to_bundle)
+	utilities = incidence.utilities(valuations)
+	sorted_valuations = -np.sort(-valuations, axis=1)
+	result = {}
+	for i,agent in enumerate(agents):
+		maximum = sorted_valuations[i, :agent_capacities[i]].sum()
+		bundle = incidence.bundle(i)
+		percent = np.round(100*utilities[i]/maximum, 1) if maximum>0 else 100
+		result[agent] = TEXTS["summary"][language] % (len(bundle), ", ".join(bundle), utilities[i], percent, maximum)
+	return result
+
+
+_event_logs = result_cache.ResultCache(max_entries=MAX_REMEMBERED_LOGS)    # maps "spreadsheet id/language" to the EventLog of the last on-demand run
+
+
+def remember_event_log(spreadsheet_id:str, language:str, event_log:EventLog):
+	"""
+	Keeps the event log of the last run on the given spreadsheet, for rendering explanations on demand.
+	"""
+	_event_logs.put(f"{spreadsheet_id}/{language}", event_log)
+
+
+def explain(spreadsheet_id:str, language:str, agent:str)->str:
+	"""
+	Returns the explanation of the given agent in the last on-demand run on the given spreadsheet,
+	or None if there is no such run in this process.
+	"""
+	event_log = _event_logs.get(f"{spreadsheet_id}/{language}")
+	return None if event_log is None else event_log.render(agent)
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
@@ -0,0 +1,87 @@
+"""
+A compact agent*item incidence structure of a course allocation, in compressed sparse row (CSR) form.
+It is built once from map_agent_to_bundle, and can produce the dense 0/1 matrix or the nonzero cells only.
+"""
+
+import numpy as np
+
+
+class Incidence:
+	"""
+	The items allocated to agent i (by their indices in the items list) are indices[indptr[i]:indptr[i+1]], in increasing order.
+
+	>>> incidence = Incidence.from_bundles(['s1', 's2', 's3'], ['c1', 'c2', 'c3'], {'s1': ['c3', 'c1'], 's2': [], 's3': ['c2']})
+	>>> incidence.indptr, incidence.indices
+	(array([0, 2, 2, 3]), array([0, 2, 1]))
+	>>> incidence.dense()
+	array([[1, 0, 1],
+	       [0, 0, 0],
+	       [0, 1, 0]], dtype=uint8)
+	>>> incidence.bundle(0)
+	['c1', 'c3']
+	>>> list(incidence.nonzero())
+	[(0, 0), (0, 2), (2, 1)]
+	>>> incidence.seats()
+	array([1, 1, 1])
+	>>> incidence.utilities(np.array([[1, 2, 3], [4, 5, 6], [7, 8, 9]]))
+	array([4., 0., 8.])
+	"""
+	def __init__(self, agents:list, items:list, indptr:np.ndarray, indices:np.ndarray):
+		self.agents = agents
+		self.items = items
+		self.indptr = indptr
+		self.indices = indices
+
+	@staticmethod
+	def from_bundles(agents:list, items:list, map_agent_to_bundle:dict)->"Incidence":
+		map_item_to_index = {item:o for o,item in enumerate(items)}
+		bundle_sizes = np.fromiter((len(map_agent_to_bundle[agent]) for agent in agents), dtype=np.int64, count=len(agents))
+		indptr = np.zeros(len(agents)+1, dtype=np.int64)
+		np.cumsum(bundle_sizes, out=indptr[1:])
+		indices = np.fromiter(
+			(map_item_to_index[item] for agent in agents for item in map_agent_to_bundle[agent]),
+			dtype=np.int64, count=int(indptr[-1]))
+		for i in range(len(agents)):
+			indices[indptr[i]:indptr[i+1]].sort()
+		return Incidence(agents, items, indptr, indices)
+
+	def bundle(self, i:int)->list:
+		"""
+		Returns the names of the items allocated to agent i, in the order of the items list.
+		"""
+		return [self.items[o] for o in self.indices[self.indptr[i]:self.indptr[i+1]].tolist()]
+
+	def dense(self)->np.ndarray:
+		"""
+		Returns the agents*items 0/1 matrix.
+		"""
+		matrix = np.zeros((len(self.agents), len(self.items)), dtype=np.uint8)
+		rows = np.repeat(np.arange(len(self.agents)), np.diff(self.indptr))
+		matrix[rows, self.indices] = 1
+		return matrix
+
+	def nonzero(self):
+		"""
+		Yields the pairs (agent index, item index) of the allocated items.
+		"""
+		for i in range(len(self.agents)):
+			for o in self.indices[self.indptr[i]:self.indptr[i+1]].tolist():
+				yield i, o
+
+	def seats(self)->np.ndarray:
+		"""
+		Returns the number of agents that got each item.
+		"""
+		return np.bincount(self.indices, minlength=len(self.items))
+
+	def utilities(self, valuations:np.ndarray)->np.ndarray:
+		"""
+		Returns the utility of each agent from its bundle, given the agents*items matrix of valuations (additive).
+		"""
+		rows = np.repeat(np.arange(len(self.agents)), np.diff(self.indptr))
+		return np.bincount(rows, weights=valuations[rows, self.indices], minlength=len(self.agents))
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
@@ -0,0 +1,75 @@
+"""
+Support for incremental re-runs of course allocation.
+
+The input rows, the values written to the output worksheet and the explanations of the last run on each spreadsheet are kept in memory.
+On the next run, only the output rows and the explanation sheets whose contents changed are rewritten.
+"""
+
+import os, sys
+
+currentdir = os.path.dirname(__file__)
+parentdir = os.path.dirname(currentdir)
+sys.path.append(parentdir)
+import result_cache
+
+MAX_REMEMBERED_RUNS = int(os.environ.get("FAIRWEB_INCREMENTAL_RUNS", 64))    # Number of spreadsheets whose last run is remembered.
+
+_last_runs = result_cache.ResultCache(max_entries=MAX_REMEMBERED_RUNS)
+
+
+class LastRun:
+	"""
+	What the last run wrote to a spreadsheet.
+	"""
+	def __init__(self, rows:list, output_title:str, output_values:list, map_agent_to_explanation:dict):
+		self.rows = rows
+		self.output_title = output_title
+		self.output_values = output_values
+		self.map_agent_to_explanation = map_agent_to_explanation
+
+
+def _key(spreadsheet, language:str)->str:
+	return f"{spreadsheet.id}/{language}"
+
+
+def get_last_run(spreadsheet, language:str)->LastRun:
+	"""
+	Returns the last run in this process on the given spreadsheet and language, or None.
+	"""
+	return _last_runs.get(_key(spreadsheet, language))
+
+
+def put_last_run(spreadsheet, language:str, last_run:LastRun):
+	_last_runs.put(_key(spreadsheet, language), last_run)
+
+
+def changed_input(previous_rows:list, rows:list)->dict:
+	"""
+	Compares two versions of the input rows (in the layout of courses.input), and returns the agents and items whose rows or columns changed.
+	An agent or item that was added or removed counts as changed.
+
+	>>> previous_rows = [['intro'], ['', 'item', 'total', 'c1', 'c2'], ['agent', 'capacity', '', '1', '2'], ['s1', '1', '', '5', '5'], ['s2', '2', '', '3', '7']]
+	>>> rows = [['intro'], ['', 'item', 'total', 'c1', 'c2'], ['agent', 'capacity', '', '1', '3'], ['s1', '1', '', '5', '5'], ['s2', '2', '', '4', '6'], ['s3', '1', '', '1', '1']]
+	>>> changed_input(previous_rows, rows)
+	{'agents': ['s2', 's3'], 'items': ['c2']}
+	>>> changed_input(rows, rows)
+	{'agents': [], 'items': []}
+	"""
+	FIRST_COL_OF_ITEM_NAMES = 3
+	FIRST_ROW_OF_AGENT_NAMES = 3
+	def agent_rows(rows):
+		return {str(row[0]): list(row) for row in rows[FIRST_ROW_OF_AGENT_NAMES:] if len(row)>0}
+	def item_columns(rows):
+		names, capacities = rows[1][FIRST_COL_OF_ITEM_NAMES:], rows[2][FIRST_COL_OF_ITEM_NAMES:]
+		return {str(name): capacities[o] if o<len(capacities) else '' for o,name in enumerate(names) if name!=''}
+	previous_agents, agents = agent_rows(previous_rows), agent_rows(rows)
+	previous_items, items = item_columns(previous_rows), item_columns(rows)
+	return {
+		"agents": [agent for agent in dict.fromkeys([*agents, *previous_agents]) if agents.get(agent)!=previous_agents.get(agent)],
+		"items":  [item for item in dict.fromkeys([*items, *previous_items]) if items.get(item)!=previous_items.get(item)],
+	}
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
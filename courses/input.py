@@ -9,22 +9,82 @@ import logging, sys, os
 currentdir = os.path.dirname(__file__)
 parentdir = os.path.dirname(currentdir)
 sys.path.append(parentdir)
-from gspread_utils import get_worksheet_by_list_of_possible_names
+from gspread_utils import get_worksheet_by_list_of_possible_names, read_table
+import matrix_input
+import metrics
 
 logger = logging.getLogger(__name__)
 
 
-def read_rows(spreadsheet:gspread.Spreadsheet)->list[list[str]]:
+INPUT_SHEET_NAMES = ["הערכות", "valuations"]
+
+
+@metrics.timed("read_rows")
+def read_rows(spreadsheet:gspread.Spreadsheet, title:str=None)->list[list[str]]:
 	"""
-	Returns a list of rows in the "input" worksheet of the given spreadsheet.
-	Each row is a list of string values.
+	Returns a list of rows in the "input" worksheet of the given spreadsheet (only its data region; see gspread_utils.read_table).
+	Each row is a list of values: numbers are int or float, and other values are strings.
+	If the title of the input worksheet is given, the worksheet list is not needed.
 	"""
-	input_sheet = get_worksheet_by_list_of_possible_names(spreadsheet, ["הערכות", "valuations"], error_if_not_found=True)
-	logger.info("Rows: %d, Cols: %d", input_sheet.row_count, input_sheet.col_count)
-	rows = input_sheet.get_all_values()
+	if title is None:
+		input_sheet = get_worksheet_by_list_of_possible_names(spreadsheet, INPUT_SHEET_NAMES, error_if_not_found=True)
+		logger.info("Rows: %d, Cols: %d", input_sheet.row_count, input_sheet.col_count)
+		title = input_sheet.title
+	rows = read_table(spreadsheet, title, header_row=1)   # the item names are on row 1 (see parse_rows)
 	return rows
 
 
+FIXED_SUM = 1000    # The valuations of each agent are normalized to this sum.
+
+
+def parse_rows(rows:list[list[str]])->tuple[list,list,np.ndarray,np.ndarray,np.ndarray]:
+	"""
+	Parses the given list of rows into arrays:
+	the list of agents, the list of items, the vector of agent capacities, the vector of item capacities,
+	and the agents*items matrix of valuations, normalized to a fixed sum (1000).
+
+	>>> rows = [['intro'], ['', 'item', 'total', 'c1', 'c2', 'c3', 'c4'], ['agent', 'capacity', '340', '40', '40', '40', '20'], ['s1', '6', '1000', '64', '34', '167', '132'], ['s2', '4', '1000', '105', '52', '179', '32']]
+	>>> agents, items, agent_capacities, item_capacities, valuations = parse_rows(rows)
+	>>> agents, items
+	(['s1', 's2'], ['c1', 'c2', 'c3', 'c4'])
+	>>> agent_capacities, item_capacities
+	(array([6, 4]), array([40, 40, 40, 20]))
+	>>> valuations
+	array([[161,  85, 420, 332],
+	       [285, 141, 486,  86]])
+	"""
+	ROW_OF_ITEM_NAMES = 1         # The item names are on row 1 (row 0 is for instructions).
+	FIRST_COL_OF_ITEM_NAMES = 3   # The item names start at column 3 (columns 0,1,2 are for student names and capacities).
+	items = rows[ROW_OF_ITEM_NAMES][FIRST_COL_OF_ITEM_NAMES:]
+	items = [str(item) for item in items if item != '']
+	logger.info("items: %s", items)
+
+	item_capacities = matrix_input.numbers([rows[ROW_OF_ITEM_NAMES+1]], FIRST_COL_OF_ITEM_NAMES, len(items))[0].astype(int)
+	logger.info("item_capacities: %s", item_capacities)
+
+	FIRST_ROW_OF_AGENT_NAMES = 3                          # remove item names 
+	rows_of_agents = rows[FIRST_ROW_OF_AGENT_NAMES:]  
+	agents = [str(row[0]) for row in rows_of_agents]         
+	logger.info("agents: %s", agents)
+
+	AGENT_CAPACITY_COLUMN = 1
+	agent_capacities = matrix_input.numbers(rows_of_agents, AGENT_CAPACITY_COLUMN, 1)[:,0].astype(int)
+	logger.info("agent_capacities: %s", agent_capacities)
+
+	def print_prefs(title, matrix):
+		if logger.isEnabledFor(logging.INFO):
+			logger.info(title)
+			for agent,prefs,total in zip(agents, matrix.tolist(), matrix.sum(axis=1)):
+				logger.info("\t%s:\t\t%s\t\t%f",agent, dict(zip(items,prefs)), total)
+
+	raw_valuations = matrix_input.numbers(rows_of_agents, FIRST_COL_OF_ITEM_NAMES, len(items))
+	print_prefs("raw valuations: ", raw_valuations)
+
+	normalized_valuations = matrix_input.normalized(raw_valuations, FIXED_SUM).astype(int)
+	print_prefs("normalized valuations: ", normalized_valuations)
+	return agents, items, agent_capacities, item_capacities, normalized_valuations
+
+
 def analyze_rows(rows:list[list[str]])->tuple[dict,dict,dict]:
 	"""
 	Analyzes the given list of rows. 
@@ -42,56 +102,10 @@ def analyze_rows(rows:list[list[str]])->tuple[dict,dict,dict]:
 	>>> valuations
 	{'s1': {'c1': 161, 'c2': 85, 'c3': 420, 'c4': 332}, 's2': {'c1': 285, 'c2': 141, 'c3': 486, 'c4': 86}, 's3': {'c1': 153, 'c2': 353, 'c3': 278, 'c4': 215}, 's4': {'c1': 99, 'c2': 122, 'c3': 759, 'c4': 18}, 's5': {'c1': 382, 'c2': 257, 'c3': 8, 'c4': 351}}
 	"""
-	ROW_OF_ITEM_NAMES = 1         # The item names are on row 1 (row 0 is for instructions).
-	FIRST_COL_OF_ITEM_NAMES = 3   # The item names start at column 3 (columns 0,1,2 are for student names and capacities).
-	items = rows[ROW_OF_ITEM_NAMES][FIRST_COL_OF_ITEM_NAMES:]
-	items = [item for item in items if item != '']
-	logger.info("items: %s", items)
-
-	item_capacities = rows[ROW_OF_ITEM_NAMES+1][FIRST_COL_OF_ITEM_NAMES:]
-	map_item_to_capacity = {items[i]: int(item_capacities[i]) for i in range(len(items))}
-	logger.info("item_capacities: %s", map_item_to_capacity)
-
-	FIRST_ROW_OF_AGENT_NAMES = 3                          # remove item names 
-	rows_of_agents = rows[FIRST_ROW_OF_AGENT_NAMES:]  
-	agents = [row[0] for row in rows_of_agents]         
-	logger.info("agents: %s", agents)
-
-	agent_capacities = [int(row[1]) for row in rows_of_agents]
-	map_agent_to_capacity = {agents[i]: int(agent_capacities[i]) for i in range(len(agents))}
-	logger.info("agent_capacities: %s", map_agent_to_capacity)
-
-	def print_prefs(title, map_agent_to_prefs):
-		logger.info(title)
-		for agent,prefs in map_agent_to_prefs.items():
-			logger.info("\t%s:\t\t%s\t\t%f",agent, prefs, sum(prefs.values()))	
-
-	def row_to_prefs(row:list)->list:
-		prefs_list = row[FIRST_COL_OF_ITEM_NAMES:]
-		prefs_dict = {}
-		for o in range(len(items)):
-			value = prefs_list[o]
-			value = 0.0 if value=='' else float(value)
-			prefs_dict[items[o]] = value
-		return prefs_dict
-	raw_preferences = {row[0]: row_to_prefs(row) for row in rows_of_agents}
-	print_prefs("raw valuations: ", raw_preferences)
-
-	def normalized_prefs(prefs, new_sum):
-		current_sum = sum(prefs.values())
-		ratio = new_sum/current_sum
-		return {item: int(value*ratio) for item,value in prefs.items()}
-
-	# normalized_preferences = {
-	# 	agent: normalized_prefs(prefs, total_entitlements) for agent,prefs in raw_preferences.items()
-	# }
-	# print_prefs("normalized_preferences: ", normalized_preferences)
-
-	FIXED_SUM = 1000
-	normalized_valuations = {
-		agent: normalized_prefs(prefs, new_sum=FIXED_SUM) for agent,prefs in raw_preferences.items()
-	}
-	print_prefs("normalized valuations: ", normalized_valuations)
+	agents, items, agent_capacities, item_capacities, normalized_valuations = parse_rows(rows)
+	map_agent_to_capacity = dict(zip(agents, agent_capacities.tolist()))
+	map_item_to_capacity  = dict(zip(items, item_capacities.tolist()))
+	normalized_valuations = matrix_input.to_dicts(agents, items, normalized_valuations)
 	return map_agent_to_capacity, map_item_to_capacity, normalized_valuations
 
 
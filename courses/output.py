@@ -9,6 +9,8 @@ currentdir = os.path.dirname(__file__)
 parentdir = os.path.dirname(currentdir)
 sys.path.append(parentdir) 
 from gspread_utils import get_worksheet_by_list_of_possible_names
+import metrics
+from courses.incidence import Incidence
 
 
 
@@ -37,9 +39,39 @@ TEXTS = {
 	},
 }
 
-def cells(input_rows, agent_capacities, item_capacities, map_agent_to_bundle, map_agent_to_explanation, language="he"):
+def size(agent_capacities:dict, item_capacities:dict)->tuple:
 	"""
-	Returns new cells, for updating the output worksheet.
+	Returns the number of rows and columns of the output worksheet.
+
+	>>> size({'s1': 2, 's2': 1}, {'c1': 1, 'c2': 2})
+	(6, 6)
+	"""
+	return len(agent_capacities)+4, len(item_capacities)+4
+
+
+@metrics.timed("output_values")
+def values(input_rows, agent_capacities, item_capacities, map_agent_to_bundle, map_agent_to_explanation, language="he", sparse:bool=False, formulas:bool=True)->list:
+	"""
+	Returns a 2-D list of the new values of the output worksheet (None for an empty cell).
+	If sparse is True, the unallocated agent-item cells are None rather than 0,
+	so that only the allocated cells are written to a cleared worksheet (see gspread_utils.write_worksheet).
+	If formulas is False, the numbers of seats are computed here rather than written as formulas
+	(for spreadsheets that do not evaluate formulas; see spreadsheets.evaluates_formulas).
+
+	>>> new_values = values([], {'s1': 2, 's2': 1}, {'c1': 1, 'c2': 2}, {'s1': ['c1', 'c2'], 's2': ['c2']}, {'s1': '', 's2': ''}, "en")
+	>>> for row in new_values: print(row)
+	['This is the output of the fair allocation algorithm.', None, None, None, None, None]
+	[None, 'course >', None, None, 'c1', 'c2']
+	['student v', 'capacity', None, None, 1, 2]
+	[None, None, 'seats', None, '=sum(E5:E)', '=sum(F5:F)']
+	['s1', 2, '=sum(D5:5)', "['c1', 'c2']", 1, 1]
+	['s2', 1, '=sum(D6:6)', "['c2']", 0, 1]
+	>>> values([], {'s1': 2, 's2': 1}, {'c1': 1, 'c2': 2}, {'s1': ['c1', 'c2'], 's2': ['c2']}, {'s1': '', 's2': ''}, "en", sparse=True)[5]
+	['s2', 1, '=sum(D6:6)', "['c2']", None, 1]
+	>>> for row in values([], {'s1': 2, 's2': 1}, {'c1': 1, 'c2': 2}, {'s1': ['c1', 'c2'], 's2': ['c2']}, {'s1': '', 's2': ''}, "en", formulas=False)[3:]: print(row)
+	[None, None, 'seats', None, 1, 2]
+	['s1', 2, 2, "['c1', 'c2']", 1, 1]
+	['s2', 1, 1, "['c2']", 0, 1]
 	"""
 
 	def text(code:str):
@@ -52,44 +84,47 @@ def cells(input_rows, agent_capacities, item_capacities, map_agent_to_bundle, ma
 	ITEM_NAME_ROW = 2
 	ITEM_CAPACITY_ROW = 3
 
-	new_cells = []
 	agents = list(agent_capacities.keys())
 	items  = list(item_capacities.keys())
-	new_cells += [gspread.Cell(INTRO_ROW,  1,text("intro"))]
-	new_cells += [gspread.Cell(INTRO_ROW+1,2,text("item_name"))]
-	new_cells += [gspread.Cell(INTRO_ROW+2,1,text("agent_name"))]
-	new_cells += [gspread.Cell(INTRO_ROW+2,2,text("capacity"))]
-	new_cells += [gspread.Cell(INTRO_ROW+3,3,text("seats"))]
-	# new_cells += [gspread.Cell(i+1, AGENT_NAME_COLUMN, "=valuations!"+gspread.utils.rowcol_to_a1(i+1,AGENT_NAME_COLUMN)) for i in range(len(input_rows))]     # Copy column 1: agent names
-	# new_cells += [gspread.Cell(i+1, AGENT_CAPACITY_COLUMN, "=valuations!"+gspread.utils.rowcol_to_a1(i+1,AGENT_CAPACITY_COLUMN)) for i in range(len(input_rows))]  # Copy column 2: agent capacities
-	# new_cells += [gspread.Cell(ITEM_NAME_ROW, o+3, items[o]) for o in range(len(items))]   # Write item names
-	# new_cells += [gspread.Cell(ITEM_CAPACITY_ROW, o+3, items[o]) for o in range(len(items))]   # Write item names
-
+	num_rows, num_cols = size(agent_capacities, item_capacities)
+	new_values = [[None]*num_cols for _ in range(num_rows)]
+	def set_cell(row:int, col:int, value):   # row and col are 1-based, as in gspread
+		new_values[row-1][col-1] = value
+
+	set_cell(INTRO_ROW,  1,text("intro"))
+	set_cell(INTRO_ROW+1,2,text("item_name"))
+	set_cell(INTRO_ROW+2,1,text("agent_name"))
+	set_cell(INTRO_ROW+2,2,text("capacity"))
+	set_cell(INTRO_ROW+3,3,text("seats"))
+
+	incidence = Incidence.from_bundles(agents, items, map_agent_to_bundle)
+	seats = incidence.seats().tolist()
 	for o in range(len(items)):
 		item_o = items[o]
 		column = o+5
 		column_letter = gspread.utils.rowcol_to_a1(1, column)[:-1]
-		new_cells += [gspread.Cell(ITEM_NAME_ROW, column, item_o)]
-		new_cells += [gspread.Cell(ITEM_NAME_ROW+1, column, item_capacities[item_o])]
-		new_cells += [gspread.Cell(ITEM_NAME_ROW+2, column, f"=sum({column_letter}{ITEM_NAME_ROW+3}:{column_letter})")]
+		set_cell(ITEM_NAME_ROW, column, item_o)
+		set_cell(ITEM_NAME_ROW+1, column, item_capacities[item_o])
+		set_cell(ITEM_NAME_ROW+2, column, f"=sum({column_letter}{ITEM_NAME_ROW+3}:{column_letter})" if formulas else seats[o])
 
 	# Insert results:
+	column_letter = gspread.utils.rowcol_to_a1(1, AGENT_CAPACITY_COLUMN+2)[:-1]
 	for i in range(len(agents)):
 		agent_i = agents[i]
-		bundle_i = map_agent_to_bundle[agent_i]
-		explanation_i = map_agent_to_explanation[agent_i]
+		bundle_i = incidence.bundle(i)
 		row = i+5
-		print(agent_i, ": ", bundle_i)
-		new_cells += [gspread.Cell(row, AGENT_NAME_COLUMN, agent_i)]
-		new_cells += [gspread.Cell(row, AGENT_CAPACITY_COLUMN, agent_capacities[agent_i])]
-		column_letter = gspread.utils.rowcol_to_a1(1, AGENT_CAPACITY_COLUMN+2)[:-1]
-		new_cells += [gspread.Cell(row, AGENT_CAPACITY_COLUMN+1, f"=sum({column_letter}{row}:{row})")]
-		new_cells += [gspread.Cell(row, AGENT_BUNDLE_COLUMN,   str(bundle_i))]
-		for o in range(len(items)):
-			item_o = items[o]
-			column = o+5
-			fraction_i_o = 1 if item_o in bundle_i else 0
-			new_cells += [gspread.Cell(row, column, fraction_i_o)]
+		logger.info("%s: %s", agent_i, bundle_i)
+		set_cell(row, AGENT_NAME_COLUMN, agent_i)
+		set_cell(row, AGENT_CAPACITY_COLUMN, agent_capacities[agent_i])
+		set_cell(row, AGENT_CAPACITY_COLUMN+1, f"=sum({column_letter}{row}:{row})" if formulas else len(bundle_i))
+		set_cell(row, AGENT_BUNDLE_COLUMN,   str(bundle_i))
+	FIRST_ITEM_COLUMN = 5
+	if sparse:
+		for i,o in incidence.nonzero():
+			set_cell(i+5, o+FIRST_ITEM_COLUMN, 1)
+	else:
+		for i,fractions_i in enumerate(incidence.dense().tolist()):
+			new_values[i+4][FIRST_ITEM_COLUMN-1:] = fractions_i
 
 	# row_of_total = len(agents)+2
 	# for o in range(len(items)):
@@ -121,6 +156,9 @@ def cells(input_rows, agent_capacities, item_capacities, map_agent_to_bundle, ma
 	# 	entitlement_cell_percent = gspread.utils.rowcol_to_a1(row_num, utility_column+1)
 	# 	new_cells += [gspread.Cell(row_num, utility_column+2, f"={utility_cell}/{entitlement_cell_percent}")]
 
-	return new_cells
+	return new_values
 
 
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
@@ -0,0 +1,110 @@
+"""
+A gspread client that is shared by all requests of a process.
+The credentials are loaded once, the authorized HTTP session (and its connection pool) is reused,
+opened spreadsheets are cached for a short time, and all requests are scheduled by sheets_scheduler.
+"""
+
+import gspread
+import google.auth.transport.requests
+import requests.adapters
+import datetime, json, threading, time, os
+import logging
+import metrics, sheets_scheduler
+
+logger = logging.getLogger(__name__)
+
+CREDENTIALS_FILE = os.environ.get("FAIRWEB_CREDENTIALS", "credentials.json")
+SPREADSHEET_TTL_SECONDS = float(os.environ.get("FAIRWEB_SPREADSHEET_TTL_SECONDS", 300))   # How long an opened spreadsheet is reused.
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)    # The access token is refreshed when it expires in less than this.
+CONNECTION_POOL_SIZE = 20
+
+
+class ScheduledHTTPClient(gspread.http_client.HTTPClient):
+	"""
+	An HTTP client that sends all Sheets API requests through the process-wide scheduler
+	(rate limit, retries and coalescing of identical reads; see sheets_scheduler),
+	and records the number and duration of the calls (see metrics.count_api_call).
+	"""
+	def request(self, method:str, endpoint:str, params=None, *args, **kwargs):
+		def send():
+			start = time.perf_counter()
+			try:
+				return super(ScheduledHTTPClient, self).request(method, endpoint, params, *args, **kwargs)
+			finally:
+				metrics.count_api_call("google", _api_method(method, endpoint), time.perf_counter()-start)
+		is_read = method.lower()=="get" and not args and not any(kwargs.get(name) is not None for name in ("data", "json", "files"))
+		coalescing_key = (endpoint, json.dumps(params, sort_keys=True, default=str)) if is_read else None
+		return sheets_scheduler.call(send, coalescing_key)
+
+
+def _api_method(method:str, endpoint:str)->str:
+	"""
+	Returns a short name of the API method called by the given request, for use as a metric label.
+
+	>>> _api_method("post", "https://sheets.googleapis.com/v4/spreadsheets/abc:batchUpdate")
+	'batchUpdate'
+	>>> _api_method("get", "https://sheets.googleapis.com/v4/spreadsheets/abc/values/input!A1:B2")
+	'values_get'
+	>>> _api_method("get", "https://sheets.googleapis.com/v4/spreadsheets/abc")
+	'get'
+	"""
+	path = endpoint.split("?")[0].split("/spreadsheets/", 1)[-1]   # e.g. "abc:batchUpdate", "abc/values/input!A1:B2", "abc/values:batchGet"
+	if "/values" in path:
+		rest = path.split("/values", 1)[1]
+		if rest.startswith(":"):
+			return "values_" + rest[1:]
+		if rest.endswith((":append", ":clear")):
+			return "values_" + rest.rsplit(":", 1)[1]
+		return "values_" + method.lower()
+	if ":" in path:
+		return path.rsplit(":", 1)[1]
+	return method.lower()
+
+
+_client = None
+_lock = threading.Lock()
+_map_key_to_spreadsheet = {}   # maps a spreadsheet key to a pair (spreadsheet, time when opened)
+
+
+def _refresh_token_if_expiring(client:gspread.Client):
+	credentials = client.http_client.auth
+	now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)   # google-auth uses naive UTC times
+	if credentials.token is None or credentials.expiry is None or credentials.expiry - now < TOKEN_REFRESH_MARGIN:
+		credentials.refresh(google.auth.transport.requests.Request())
+		logger.info("access token refreshed; expires at %s", credentials.expiry)
+
+
+def get_client()->gspread.Client:
+	"""
+	Returns the gspread client of this process, creating it on first use.
+	"""
+	global _client
+	with _lock:
+		if _client is None:
+			_client = gspread.service_account(CREDENTIALS_FILE, http_client=ScheduledHTTPClient)
+			adapter = requests.adapters.HTTPAdapter(pool_connections=CONNECTION_POOL_SIZE, pool_maxsize=CONNECTION_POOL_SIZE)
+			_client.http_client.session.mount("https://", adapter)
+			logger.info("gspread client created from %s", CREDENTIALS_FILE)
+		_refresh_token_if_expiring(_client)
+		return _client
+
+
+def open_by_url(url:str)->gspread.Spreadsheet:
+	"""
+	Returns the spreadsheet with the given URL.
+	A spreadsheet that was opened less than SPREADSHEET_TTL_SECONDS ago is returned from the cache.
+	Raises the same exceptions as gspread.Client.open_by_url.
+	"""
+	key = gspread.utils.extract_id_from_url(url)
+	now = time.monotonic()
+	with _lock:
+		cached = _map_key_to_spreadsheet.get(key, None)
+		if cached is not None and now - cached[1] < SPREADSHEET_TTL_SECONDS:
+			return cached[0]
+	spreadsheet = get_client().open_by_key(key)
+	with _lock:
+		_map_key_to_spreadsheet[key] = (spreadsheet, now)
+		for old_key in [k for k,(_,opened_at) in _map_key_to_spreadsheet.items() if now - opened_at >= SPREADSHEET_TTL_SECONDS]:
+			del _map_key_to_spreadsheet[old_key]
+	return spreadsheet
+
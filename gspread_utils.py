@@ -1,19 +1,146 @@
 import gspread
+import numbers, random, threading, weakref, os
+
+READ_CHUNK_ROWS = int(os.environ.get("FAIRWEB_READ_CHUNK_ROWS", 5000))   # Number of rows read in a single request by read_table.
+
+
+def _worksheet_from_properties(spreadsheet:gspread.Spreadsheet, properties:dict)->gspread.Worksheet:
+	"""
+	Returns the worksheet with the given properties (as returned by the Sheets API), without another request.
+	"""
+	if isinstance(spreadsheet, gspread.Spreadsheet):
+		return gspread.Worksheet(spreadsheet, properties, spreadsheet.id, spreadsheet.client)
+	return spreadsheet.worksheet_from_properties(properties)   # a local spreadsheet
+
+
+class SheetDirectory:
+	"""
+	The worksheets of a spreadsheet (titles, ids and grid sizes), fetched with a single request when first needed.
+	The functions of this module that create or resize worksheets update it locally, so they do not cause another fetch.
+	It may be used from several threads at once (e.g. by a pipelined run, see pipeline).
+	"""
+	def __init__(self, spreadsheet:gspread.Spreadsheet):
+		self.spreadsheet = spreadsheet
+		self._map_title_to_worksheet = None
+		self._lock = threading.Lock()
+
+	def _worksheets(self)->dict:
+		with self._lock:
+			if self._map_title_to_worksheet is None:
+				metadata = self.spreadsheet.fetch_sheet_metadata(params={"fields": "sheets.properties"})
+				self._map_title_to_worksheet = {
+					sheet["properties"]["title"]: _worksheet_from_properties(self.spreadsheet, sheet["properties"])
+					for sheet in metadata["sheets"]}
+			return self._map_title_to_worksheet
+
+	def worksheets(self)->list:
+		map_title_to_worksheet = self._worksheets()
+		with self._lock:
+			return list(map_title_to_worksheet.values())
+
+	def find(self, title:str)->gspread.Worksheet:
+		"""
+		Returns the worksheet with the given title, or None if there is none.
+		"""
+		return self._worksheets().get(title, None)
+
+	def added(self, worksheet:gspread.Worksheet):
+		"""
+		Records a worksheet that was created after the directory was fetched.
+		"""
+		map_title_to_worksheet = self._worksheets()
+		with self._lock:
+			map_title_to_worksheet[worksheet.title] = worksheet
+
+	def deleted(self, worksheet:gspread.Worksheet):
+		"""
+		Records a worksheet that was deleted after the directory was fetched.
+		"""
+		map_title_to_worksheet = self._worksheets()
+		with self._lock:
+			map_title_to_worksheet.pop(worksheet.title, None)
+
+	def resized(self, worksheet:gspread.Worksheet, row_count:int, col_count:int):
+		"""
+		Records the new grid size of a worksheet that was resized by a batch request (worksheet.add_rows and add_cols update it by themselves).
+		"""
+		if isinstance(worksheet, gspread.Worksheet):
+			worksheet._properties["gridProperties"].update({"rowCount": row_count, "columnCount": col_count})
+		# A local worksheet is the object that the request has resized.
+
+
+_sheet_directories = weakref.WeakKeyDictionary()    # maps an opened spreadsheet to its SheetDirectory
+_sheet_directories_lock = threading.Lock()
+
+
+def sheet_directory(spreadsheet:gspread.Spreadsheet)->SheetDirectory:
+	"""
+	Returns the worksheet directory of the given opened spreadsheet.
+	It is fetched once per opened spreadsheet; a run that reuses an opened spreadsheet should call forget_sheet_directory first
+	(spreadsheets.open_spreadsheet does it for spreadsheets that are reused from the cache of gspread_client).
+	"""
+	with _sheet_directories_lock:
+		directory = _sheet_directories.get(spreadsheet, None)
+		if directory is None:
+			directory = _sheet_directories[spreadsheet] = SheetDirectory(spreadsheet)
+		return directory
+
+
+def forget_sheet_directory(spreadsheet:gspread.Spreadsheet):
+	"""
+	Discards the worksheet directory of the given spreadsheet, so that it is fetched again when needed
+	(e.g. at the start of a run, since the worksheets may have been changed by hand).
+	"""
+	with _sheet_directories_lock:
+		_sheet_directories.pop(spreadsheet, None)
+
 
 def get_worksheet_by_list_of_possible_names(spreadsheet:gspread.Spreadsheet, possible_names:list, error_if_not_found:bool=False)->gspread.Worksheet:
 	"""
 	Searches the given spreadsheet for a worksheet with a name from the given list.
 	If none is found, return None or raise an Error.
+	The worksheets are looked up in the directory of the spreadsheet, so no request is sent after the first lookup.
 	"""
-	worksheet_names = [ws.title for ws in spreadsheet.worksheets()]
+	directory = sheet_directory(spreadsheet)
 	for name in possible_names:
-		if name in worksheet_names:
-			return spreadsheet.worksheet(name)
+		worksheet = directory.find(name)
+		if worksheet is not None:
+			return worksheet
 	if error_if_not_found:
+		worksheet_names = [ws.title for ws in directory.worksheets()]
 		raise gspread.WorksheetNotFound(f"Did not find a worksheet with name in {possible_names}. Worksheets are: {worksheet_names}")
 	return None
 
 
+def read_table(spreadsheet:gspread.Spreadsheet, title:str, header_row:int, chunk_rows:int=READ_CHUNK_ROWS)->list:
+	"""
+	Reads the data region of the worksheet with the given title, without the empty cells around it:
+	its width is the width of the header row (0-based), and its height is the height of the first column.
+	Values are unformatted: numbers are returned as int or float rather than as formatted strings, and empty cells as "".
+	Every row is padded to the width of the region.
+
+	Uses one request for the header rows and the first column, and one request for every chunk_rows data rows,
+	so that the response for a very large sheet is not downloaded and decoded at once.
+	The worksheet is addressed by its title only, so the worksheet list is not needed (see pipeline).
+	"""
+	params = {"valueRenderOption": "UNFORMATTED_VALUE"}
+	response = spreadsheet.values_batch_get([gspread.utils.absolute_range_name(title, f"1:{header_row+1}"), gspread.utils.absolute_range_name(title, "A:A")], params=params)
+	header_rows, first_column = [value_range.get("values", []) for value_range in response["valueRanges"]]
+	width = max(len(header_rows[header_row]) if len(header_rows)>header_row else 0, 1)
+	height = max(len(first_column), header_row+1)     # the API omits trailing empty rows
+	last_column = gspread.utils.rowcol_to_a1(1, width)[:-1]
+	rows = [list(row) for row in header_rows] + [[] for _ in range(header_row+1-len(header_rows))]
+	for first in range(header_row+2, height+1, chunk_rows):   # 1-based row numbers, as in A1 notation
+		last = min(first+chunk_rows-1, height)
+		chunk = spreadsheet.values_get(gspread.utils.absolute_range_name(title, f"A{first}:{last_column}{last}"), params=params).get("values", [])
+		rows.extend(list(row) for row in chunk)
+		rows.extend([] for _ in range(last-first+1-len(chunk)))
+	for row in rows:
+		del row[width:]
+		row.extend([""]*(width-len(row)))
+	return rows
+
+
 def get_or_create_worksheet(spreadsheet:gspread.Spreadsheet, possible_names:list, new_row_count,  new_col_count)->gspread.Worksheet:
 	"""
 	Searches the given spreadsheet for a worksheet with a name from the given list.
@@ -29,8 +156,359 @@ def get_or_create_worksheet(spreadsheet:gspread.Spreadsheet, possible_names:list
 	else: # if output_sheet is None:
 		default_name = possible_names[0]
 		output_sheet = spreadsheet.add_worksheet(title=default_name, rows=new_row_count, cols=new_col_count)
+		sheet_directory(spreadsheet).added(output_sheet)
 		# TODO: change worksheet direction to RTL
 		# I did not find here https://docs.gspread.org/en/latest/api/models/worksheet.html#id1   how to do this.
 	# input_range = input.range(1, 1, len(rows), len(rows[0]))
 	# output.update_cells(input_range)
 	return output_sheet
+
+
+def get_or_create_worksheets(spreadsheet:gspread.Spreadsheet, names:list, new_row_count, new_col_count)->dict:
+	"""
+	Returns a dict mapping each of the given names to a worksheet with this name.
+	Worksheets that do not exist are created, and existing worksheets are enlarged if needed.
+	Uses at most one batch request for all creations and resizes (and one request for listing the worksheets, if they were not listed yet).
+	"""
+	directory = sheet_directory(spreadsheet)
+	requests = []
+	resized = []
+	for name in dict.fromkeys(names):   # remove duplicates, keep order
+		worksheet = directory.find(name)
+		if worksheet is None:
+			requests.append({"addSheet": {"properties": {
+				"title": name,
+				"gridProperties": {"rowCount": new_row_count, "columnCount": new_col_count}}}})
+		elif worksheet.row_count < new_row_count or worksheet.col_count < new_col_count:
+			row_count, col_count = max(worksheet.row_count, new_row_count), max(worksheet.col_count, new_col_count)
+			requests.append({"updateSheetProperties": {
+				"properties": {"sheetId": worksheet.id, "gridProperties": {"rowCount": row_count, "columnCount": col_count}},
+				"fields": "gridProperties.rowCount,gridProperties.columnCount"}})
+			resized.append((worksheet, row_count, col_count))
+	if len(requests)>0:
+		response = spreadsheet.batch_update({"requests": requests})
+		for reply in response["replies"]:
+			if "addSheet" in reply:
+				directory.added(_worksheet_from_properties(spreadsheet, reply["addSheet"]["properties"]))
+		for worksheet, row_count, col_count in resized:
+			directory.resized(worksheet, row_count, col_count)
+	return {name: directory.find(name) for name in names}
+
+
+def delete_worksheets(spreadsheet:gspread.Spreadsheet, names:list)->list:
+	"""
+	Deletes the worksheets with the given names (those that exist) with a single request, and returns their names.
+	"""
+	directory = sheet_directory(spreadsheet)
+	worksheets = [worksheet for worksheet in map(directory.find, names) if worksheet is not None]
+	if len(worksheets)>0:
+		spreadsheet.batch_update({"requests": [{"deleteSheet": {"sheetId": worksheet.id}} for worksheet in worksheets]})
+		for worksheet in worksheets:
+			directory.deleted(worksheet)
+	return [worksheet.title for worksheet in worksheets]
+
+
+def clear_worksheets(spreadsheet:gspread.Spreadsheet, names:list):
+	"""
+	Clears the values of the given worksheets, in a single request (none if there are no worksheets).
+	"""
+	if len(names)==0:
+		return
+	spreadsheet.values_batch_clear(body={"ranges": [gspread.utils.absolute_range_name(name) for name in names]})
+
+
+def write_first_cells(spreadsheet:gspread.Spreadsheet, map_worksheet_name_to_value:dict):
+	"""
+	Writes each value into cell A1 of its worksheet, in a single request (none if there are no worksheets).
+	"""
+	if len(map_worksheet_name_to_value)==0:
+		return
+	spreadsheet.values_batch_update(body={
+		"valueInputOption": "USER_ENTERED",
+		"data": [
+			{"range": gspread.utils.absolute_range_name(name, "A1"), "values": [[value]]}
+			for name,value in map_worksheet_name_to_value.items()]})
+
+
+def replace_first_cells(spreadsheet:gspread.Spreadsheet, map_worksheet_name_to_value:dict):
+	"""
+	Clears the given existing worksheets (e.g. created by get_or_create_worksheets) and writes each value into cell A1 of its worksheet,
+	in a single request (none if there are no worksheets), so each worksheet keeps its previous value until the new one replaces it.
+	"""
+	directory = sheet_directory(spreadsheet)
+	requests = []
+	for name,value in map_worksheet_name_to_value.items():
+		worksheet = directory.find(name)
+		requests.append(_clear_request(worksheet.id))
+		requests.append({"updateCells": {
+			"start": {"sheetId": worksheet.id, "rowIndex": 0, "columnIndex": 0},
+			"rows": [{"values": [_cell_data(value)]}],
+			"fields": "userEnteredValue"}})
+	if len(requests)>0:
+		spreadsheet.batch_update({"requests": requests})
+
+
+def update_first_cells(spreadsheet:gspread.Spreadsheet, map_worksheet_name_to_value:dict):
+	"""
+	Clears the given worksheets and writes each value into cell A1 of its worksheet.
+	Uses two requests, regardless of the number of worksheets.
+	"""
+	clear_worksheets(spreadsheet, list(map_worksheet_name_to_value.keys()))
+	write_first_cells(spreadsheet, map_worksheet_name_to_value)
+
+
+def _normalized_value(value)->str:
+	"""
+	Normalizes a cell value, so that a value written to a worksheet can be compared to the value read back.
+
+	>>> _normalized_value(1), _normalized_value("1"), _normalized_value(1.0), _normalized_value(0.2760000001)
+	('1', '1', '1', '0.276')
+	>>> _normalized_value("=sum(A1:A3)"), _normalized_value("=SUM(A1:A3)"), _normalized_value(None), _normalized_value("name")
+	('=SUM(A1:A3)', '=SUM(A1:A3)', '', 'name')
+	"""
+	if value is None:
+		return ""
+	if isinstance(value,str) and value.startswith("="):
+		return value.upper()
+	try:
+		return "%.6g" % float(value)
+	except (TypeError, ValueError):
+		return str(value)
+
+
+def _normalized_grid(rows:list)->dict:
+	"""
+	Returns a dict mapping (row,col) to the normalized value, for each non-empty cell in the given list of rows.
+	"""
+	return {
+		(r,c): _normalized_value(value)
+		for r,row in enumerate(rows) for c,value in enumerate(row)
+		if _normalized_value(value)!=""}
+
+
+def worksheet_has_values(spreadsheet:gspread.Spreadsheet, possible_names:list, values:list)->bool:
+	"""
+	Checks whether the spreadsheet has a worksheet with a name from the given list,
+	whose contents are exactly the given 2-D list of values (formulas are compared as formulas, not as computed values).
+	"""
+	worksheet = get_worksheet_by_list_of_possible_names(spreadsheet, possible_names, error_if_not_found=False)
+	if worksheet is None:
+		return False
+	current_values = worksheet.get_values(value_render_option=gspread.utils.ValueRenderOption.formula)
+	return _normalized_grid(current_values)==_normalized_grid(values)
+
+
+def _cell_data(value)->dict:
+	"""
+	Converts a Python value to a CellData object of the Sheets API.
+	Strings that start with "=" are formulas; None is an empty cell.
+
+	>>> _cell_data(3), _cell_data("=SUM(A1:A3)"), _cell_data("name"), _cell_data(None)
+	({'userEnteredValue': {'numberValue': 3.0}}, {'userEnteredValue': {'formulaValue': '=SUM(A1:A3)'}}, {'userEnteredValue': {'stringValue': 'name'}}, {})
+	"""
+	if value is None or value=="":
+		return {}
+	if isinstance(value, bool):
+		return {"userEnteredValue": {"boolValue": value}}
+	if isinstance(value, numbers.Number):
+		return {"userEnteredValue": {"numberValue": float(value)}}
+	value = str(value)
+	if value.startswith("="):
+		return {"userEnteredValue": {"formulaValue": value}}
+	return {"userEnteredValue": {"stringValue": value}}
+
+
+MAX_EMPTY_CELLS_IN_BLOCK = 25   # A longer run of empty cells in a row is skipped, rather than sent as empty cells.
+
+
+def _runs(row:list, max_gap:int=MAX_EMPTY_CELLS_IN_BLOCK)->list:
+	"""
+	Returns the pairs (start,end) of the runs of non-empty cells in the given row,
+	where runs that are separated by at most max_gap empty cells are merged.
+
+	>>> _runs([None, 1, None, 2, None, None, None, 3, None], max_gap=2)
+	[(1, 4), (7, 8)]
+	>>> _runs([None, ""])
+	[]
+	"""
+	runs = []
+	for col,value in enumerate(row):
+		if value is None or value=="":
+			continue
+		if len(runs)>0 and col-runs[-1][1] <= max_gap:
+			runs[-1][1] = col+1
+		else:
+			runs.append([col, col+1])
+	return [tuple(run) for run in runs]
+
+
+def _blocks(values:list)->list:
+	"""
+	Splits a 2-D list of values into blocks that contain all its non-empty cells, for writing into a cleared worksheet.
+	Returns a list of triples (first row, first column, 2-D list of values).
+	Consecutive rows with a single run of cells starting at the same column are written as one block.
+
+	>>> _blocks([['a', 'b'], [None, 1, 2], [None, 3], [], [4] + [None]*30 + [5]])
+	[(0, 0, [['a', 'b']]), (1, 1, [[1, 2], [3]]), (4, 0, [[4]]), (4, 31, [[5]])]
+	"""
+	blocks = []
+	previous_single_run_start = None
+	for r,row in enumerate(values):
+		runs = _runs(row)
+		for start,end in runs:
+			if len(runs)==1 and previous_single_run_start==start and blocks[-1][0]+len(blocks[-1][2])==r:
+				blocks[-1][2].append(row[start:end])
+			else:
+				blocks.append((r, start, [row[start:end]]))
+		previous_single_run_start = runs[0][0] if len(runs)==1 else None
+	return blocks
+
+
+class _PreparedWorksheet:
+	"""
+	The requests that create or enlarge a worksheet with a name from a list, and clear its values (if clear is True),
+	and the update of the sheet directory after they are sent.
+	"""
+	def __init__(self, spreadsheet:gspread.Spreadsheet, possible_names:list, new_row_count:int, new_col_count:int, clear:bool=True):
+		self.spreadsheet = spreadsheet
+		self.directory = sheet_directory(spreadsheet)
+		self.worksheet = get_worksheet_by_list_of_possible_names(spreadsheet, possible_names, error_if_not_found=False)
+		self.requests = []
+		self.new_size = None
+		if self.worksheet is None:
+			existing_ids = {ws.id for ws in self.directory.worksheets()}
+			self.sheet_id = random.randrange(1, 2**31)
+			while self.sheet_id in existing_ids:
+				self.sheet_id = random.randrange(1, 2**31)
+			self.title = possible_names[0]
+			self.requests.append({"addSheet": {"properties": {
+				"sheetId": self.sheet_id, "title": self.title,
+				"gridProperties": {"rowCount": new_row_count, "columnCount": new_col_count}}}})
+		else:
+			self.sheet_id, self.title = self.worksheet.id, self.worksheet.title
+			row_count, col_count = self.worksheet.row_count, self.worksheet.col_count
+			if row_count < new_row_count or col_count < new_col_count:
+				self.new_size = (max(row_count, new_row_count), max(col_count, new_col_count))
+				self.requests.append({"updateSheetProperties": {
+					"properties": {"sheetId": self.sheet_id, "gridProperties": {"rowCount": self.new_size[0], "columnCount": self.new_size[1]}},
+					"fields": "gridProperties.rowCount,gridProperties.columnCount"}})
+			if clear:
+				self.requests.append(_clear_request(self.sheet_id))
+
+	def sent(self, response:dict):
+		"""
+		Updates the sheet directory, given the response to a batch request that starts with self.requests.
+		"""
+		if self.worksheet is None:
+			self.worksheet = _worksheet_from_properties(self.spreadsheet, response["replies"][0]["addSheet"]["properties"])
+			self.directory.added(self.worksheet)
+		elif self.new_size is not None:
+			self.directory.resized(self.worksheet, *self.new_size)
+
+
+def _clear_request(sheet_id:int)->dict:
+	"""
+	Returns the request that clears all the values of a worksheet.
+	"""
+	return {"updateCells": {"range": {"sheetId": sheet_id}, "fields": "userEnteredValue"}}
+
+
+def _values_requests(sheet_id:int, values:list, number_formats:dict)->list:
+	"""
+	Returns the requests that write the given values (except empty cells) and number formats into a cleared worksheet.
+	"""
+	requests = []
+	for first_row, first_col, block in _blocks(values):
+		requests.append({"updateCells": {
+			"start": {"sheetId": sheet_id, "rowIndex": first_row, "columnIndex": first_col},
+			"rows": [{"values": [_cell_data(value) for value in row]} for row in block],
+			"fields": "userEnteredValue"}})
+	for a1_range,number_format in number_formats.items():
+		requests.append({"repeatCell": {
+			"range": gspread.utils.a1_range_to_grid_range(a1_range, sheet_id),
+			"cell": {"userEnteredFormat": {"numberFormat": number_format}},
+			"fields": "userEnteredFormat.numberFormat"}})
+	return requests
+
+
+def _size(values:list)->tuple:
+	return max(len(values), 1), max(max((len(row) for row in values), default=0), 1)
+
+
+def write_worksheet(spreadsheet:gspread.Spreadsheet, possible_names:list, values:list, number_formats:dict={}):
+	"""
+	Replaces the contents of a worksheet with a name from the given list by the given 2-D list of values.
+	If no such worksheet exists, creates one; if it is too small, enlarges it.
+	number_formats maps an A1 range (e.g. "C2:F5") to a numberFormat object of the Sheets API.
+
+	Uses one batch request that creates or resizes the worksheet, clears it, writes the values and applies the formats
+	(and one request for listing the worksheets, if they were not listed yet).
+	Empty cells (None) are not sent, so sparse values are written compactly.
+	Returns the title of the worksheet.
+	"""
+	prepared = _PreparedWorksheet(spreadsheet, possible_names, *_size(values))
+	response = spreadsheet.batch_update({"requests": prepared.requests + _values_requests(prepared.sheet_id, values, number_formats)})
+	prepared.sent(response)
+	return prepared.title
+
+
+def prepare_worksheet(spreadsheet:gspread.Spreadsheet, possible_names:list, new_row_count:int, new_col_count:int, clear:bool=True)->gspread.Worksheet:
+	"""
+	The first half of write_worksheet: creates or enlarges a worksheet with a name from the given list, and clears it (if clear is True),
+	in one request (none if the worksheet exists, is large enough, and is not cleared).
+	Returns the worksheet, for write_values.
+	"""
+	prepared = _PreparedWorksheet(spreadsheet, possible_names, new_row_count, new_col_count, clear)
+	if len(prepared.requests)>0:
+		prepared.sent(spreadsheet.batch_update({"requests": prepared.requests}))
+	return prepared.worksheet
+
+
+def write_values(spreadsheet:gspread.Spreadsheet, worksheet:gspread.Worksheet, values:list, number_formats:dict={}, clear:bool=False):
+	"""
+	The second half of write_worksheet: writes the given values and number formats into a worksheet returned by prepare_worksheet,
+	in one request. The worksheet must be large enough.
+	If clear is True, the request first clears the worksheet, so that a worksheet prepared with clear=False
+	keeps its previous values until the new ones replace them.
+
+	>>> from local_spreadsheet import LocalSpreadsheet
+	>>> spreadsheet = LocalSpreadsheet("memory", in_memory=True)
+	>>> worksheet = prepare_worksheet(spreadsheet, ["output"], 2, 2)
+	>>> write_values(spreadsheet, worksheet, [["old", "old"], ["old", "old"]])
+	>>> worksheet = prepare_worksheet(spreadsheet, ["output"], 2, 2, clear=False)
+	>>> worksheet.get_all_values()
+	[['old', 'old'], ['old', 'old']]
+	>>> write_values(spreadsheet, worksheet, [["new"]], clear=True)
+	>>> worksheet.get_all_values()
+	[['new']]
+	"""
+	requests = ([_clear_request(worksheet.id)] if clear else []) + _values_requests(worksheet.id, values, number_formats)
+	if len(requests)>0:
+		spreadsheet.batch_update({"requests": requests})
+
+
+def update_changed_rows(spreadsheet:gspread.Spreadsheet, worksheet_title:str, values:list, previous_values:list)->list:
+	"""
+	Writes to the given worksheet only the rows of values that differ from previous_values,
+	which must be the values that were last written to it (by write_worksheet or by this function), with the same dimensions.
+	Consecutive changed rows are written as one range, and all ranges in a single request (none if nothing changed).
+	Returns the 0-based indices of the changed rows.
+	"""
+	if len(values)!=len(previous_values):
+		raise ValueError(f"Expected {len(previous_values)} rows, got {len(values)}")
+	changed_rows = [r for r,(row,previous_row) in enumerate(zip(values, previous_values)) if row!=previous_row]
+	data = []
+	for r in changed_rows:
+		cells = ["" if value is None else value for value in values[r]]
+		if len(data)>0 and data[-1]["end"]==r:
+			data[-1]["values"].append(cells)
+		else:
+			data.append({"start": r, "values": [cells]})
+		data[-1]["end"] = r+1
+	if len(data)>0:
+		spreadsheet.values_batch_update(body={
+			"valueInputOption": "USER_ENTERED",
+			"data": [
+				{"range": gspread.utils.absolute_range_name(worksheet_title, f"A{block['start']+1}"), "values": block["values"]}
+				for block in data]})
+	return changed_rows
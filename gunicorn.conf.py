@@ -0,0 +1,13 @@
+# Gunicorn configuration, read automatically when gunicorn is started from this folder.
+#
+# Set FAIRWEB_PRELOAD_ALGORITHMS=1 to import all algorithms (fairpy, NumPy, gspread) once in the master process,
+# before the workers are forked, so that the workers share the imported modules copy-on-write and start quickly.
+# Otherwise, each worker imports an algorithm when it first runs it.
+
+import os
+
+def on_starting(server):
+    if os.environ.get("FAIRWEB_PRELOAD_ALGORITHMS", "") not in ("", "0"):
+        import algorithms
+        algorithms.preload()
+        server.log.info("preloaded algorithms: %s", algorithms.names())
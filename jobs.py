@@ -0,0 +1,162 @@
+"""
+A bounded pool of background jobs, so that running an algorithm does not tie up a web worker.
+Each job gets an id, that can be used to poll its state, timings, result or error.
+"""
+
+import concurrent.futures, contextvars, threading, traceback, time, uuid, os
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = int(os.environ.get("FAIRWEB_JOB_WORKERS", 4))    # Number of jobs that can run at the same time.
+MAX_REMEMBERED_JOBS = 1000                                     # Older finished jobs are forgotten.
+
+QUEUED    = "queued"
+RUNNING   = "running"
+DONE      = "done"
+FAILED    = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+	"""
+	Raised inside a running job when it was cancelled.
+	"""
+
+
+class Job:
+	"""
+	A single run of an algorithm.
+
+	>>> job = Job("example", lambda x: x+1, {"x": 1})
+	>>> job.state
+	'queued'
+	>>> job._run()
+	>>> job.state, job.result, job.error
+	('done', 2, None)
+	>>> sorted(job.to_dict().keys())
+	['error', 'finished_at', 'id', 'name', 'queue_seconds', 'result', 'run_seconds', 'started_at', 'state', 'submitted_at']
+	"""
+	def __init__(self, name:str, function, kwargs:dict):
+		self.id = uuid.uuid4().hex
+		self.name = name
+		self.function = function
+		self.kwargs = kwargs
+		self.state = QUEUED
+		self.submitted_at = time.time()
+		self.started_at = None
+		self.finished_at = None
+		self.result = None
+		self.error = None
+		self.cancel_requested = threading.Event()
+
+	def _run(self):
+		if self.cancel_requested.is_set():
+			self.state = CANCELLED
+			return
+		self.state = RUNNING
+		self.started_at = time.time()
+		token = _current.set(self)
+		try:
+			self.result = self.function(**self.kwargs)
+			self.state = DONE
+		except JobCancelled:
+			self.state = CANCELLED
+		except Exception as e:
+			traceback.print_exc()
+			self.error = str(e) or type(e).__name__
+			self.state = FAILED
+		finally:
+			_current.reset(token)
+			self.finished_at = time.time()
+			logger.info("job %s (%s) %s after %.3f seconds", self.id, self.name, self.state, self.finished_at-self.started_at)
+
+	def to_dict(self)->dict:
+		"""
+		Returns a JSON-serializable description of the job.
+		"""
+		return {
+			"id": self.id,
+			"name": self.name,
+			"state": self.state,
+			"submitted_at": self.submitted_at,
+			"started_at": self.started_at,
+			"finished_at": self.finished_at,
+			"queue_seconds": None if self.started_at is None else self.started_at-self.submitted_at,
+			"run_seconds": None if self.finished_at is None else self.finished_at-self.started_at,
+			"result": self.result,
+			"error": self.error,
+		}
+
+
+_executor = None
+_jobs = OrderedDict()   # maps a job id to a Job, in order of submission
+_lock = threading.Lock()
+_current = contextvars.ContextVar("job", default=None)   # a context variable, so that threads started by asyncio.to_thread see the job too
+
+
+def _get_executor()->concurrent.futures.ThreadPoolExecutor:
+	global _executor
+	with _lock:
+		if _executor is None:
+			_executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="job")
+		return _executor
+
+
+def submit(name:str, function, **kwargs)->Job:
+	"""
+	Adds a job that calls function(**kwargs) to the queue, and returns it immediately.
+	"""
+	job = Job(name, function, kwargs)
+	with _lock:
+		_jobs[job.id] = job
+		while len(_jobs) > MAX_REMEMBERED_JOBS:
+			oldest_id = next(iter(_jobs))
+			if _jobs[oldest_id].state in (QUEUED, RUNNING):
+				break
+			del _jobs[oldest_id]
+	_get_executor().submit(job._run)
+	logger.info("job %s (%s) submitted", job.id, name)
+	return job
+
+
+def get(job_id:str)->Job:
+	"""
+	Returns the job with the given id, or None if there is no such job.
+	"""
+	with _lock:
+		return _jobs.get(job_id, None)
+
+
+def current()->Job:
+	"""
+	Returns the job that is running in the current thread (or in a thread started by it with asyncio.to_thread), or None if there is none.
+	"""
+	return _current.get()
+
+
+def cancel(job_id:str)->Job:
+	"""
+	Requests to cancel the job with the given id, and returns it (or None if there is no such job).
+	A queued job will not start. A running job is stopped when it next waits for the solver pool (see solver_pool.solve).
+	"""
+	job = get(job_id)
+	if job is not None and job.state in (QUEUED, RUNNING):
+		job.cancel_requested.set()
+		if job.state==QUEUED:
+			job.state = CANCELLED
+	return job
+
+
+def all_jobs()->list:
+	"""
+	Returns all remembered jobs, the newest first.
+	"""
+	with _lock:
+		return list(reversed(_jobs.values()))
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
@@ -0,0 +1,523 @@
+"""
+A spreadsheet stored in local files, with the subset of the gspread API used by fairweb.
+Allows running the algorithms offline, and load-testing them without a Google account.
+
+The spreadsheet can be stored as:
+ * a directory of CSV files, one per worksheet (e.g. "instances/coalition/input.csv");
+ * an XLSX workbook (requires openpyxl);
+ * an SQLite database (a file ending with .sqlite, .sqlite3 or .db).
+
+Every method that would send a request to the Sheets API counts the call in `api_calls`,
+and waits `simulated_latency` seconds, to imitate the network round trip.
+"""
+
+import gspread
+from collections import Counter
+import csv, os, sqlite3, threading, time
+import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROW_COUNT = 1000    # The size of a new worksheet in Google Sheets
+DEFAULT_COL_COUNT = 26
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+
+
+def _formatted(value)->str:
+	"""
+	Formats a cell value the way get_all_values returns it.
+
+	>>> _formatted(None), _formatted(3.0), _formatted(0.25), _formatted("x")
+	('', '3', '0.25', 'x')
+	"""
+	if value is None:
+		return ""
+	if isinstance(value, float):
+		return "%g" % value if value==int(value) and abs(value)<1e15 else repr(value)
+	return str(value)
+
+
+def _typed(value):
+	"""
+	Converts a stored cell value to the type that Google Sheets would hold for a user-entered value.
+
+	>>> _typed("3"), _typed("2.5"), _typed("x"), _typed(""), _typed(None)
+	(3, 2.5, 'x', '', '')
+	"""
+	if value is None:
+		return ""
+	if isinstance(value, str):
+		try:
+			return int(value)
+		except ValueError:
+			pass
+		try:
+			return float(value)
+		except ValueError:
+			return value
+	return value
+
+
+def _split_range(range_name:str):
+	"""
+	Splits an absolute range name to a worksheet title and an A1 range (or None).
+
+	>>> _split_range("'it''s'!A1:B2"), _split_range("'s1'"), _split_range("s1!C3")
+	(("it's", 'A1:B2'), ('s1', None), ('s1', 'C3'))
+	"""
+	if range_name.startswith("'"):
+		end = range_name.index("'", 1)
+		while end+1 < len(range_name) and range_name[end+1]=="'":   # an escaped quote
+			end = range_name.index("'", end+2)
+		title = range_name[1:end].replace("''", "'")
+		rest = range_name[end+1:]
+	else:
+		title, _, rest = range_name.partition("!")
+		rest = "!"+rest if rest else ""
+	return title, (rest[1:] if rest.startswith("!") and len(rest)>1 else None)
+
+
+class LocalWorksheet:
+	"""
+	A worksheet of a LocalSpreadsheet. Values are kept in a list of rows.
+	"""
+	def __init__(self, spreadsheet:"LocalSpreadsheet", sheet_id:int, title:str, rows:list, row_count:int=None, col_count:int=None):
+		self.spreadsheet = spreadsheet
+		self.id = sheet_id
+		self.title = title
+		self._rows = rows
+		self.row_count = max(row_count or 0, len(rows), 1)
+		self.col_count = max(col_count or 0, max((len(row) for row in rows), default=0), 1)
+		self.formats = {}    # maps an A1 range to a format (kept only in memory)
+
+	def __repr__(self):
+		return f"<LocalWorksheet {self.title!r} id:{self.id}>"
+
+	@property
+	def properties(self)->dict:
+		return {"sheetId": self.id, "title": self.title, "index": self.spreadsheet._worksheets.index(self),
+			"gridProperties": {"rowCount": self.row_count, "columnCount": self.col_count}}
+
+	# Operations on the grid (without counting API calls):
+
+	def _resize(self, row_count:int, col_count:int):
+		self.row_count, self.col_count = row_count, col_count
+		del self._rows[row_count:]
+		for row in self._rows:
+			del row[col_count:]
+
+	def _set(self, row_index:int, col_index:int, value):
+		if row_index >= self.row_count or col_index >= self.col_count:
+			raise gspread.exceptions.GSpreadException(f"Cell {gspread.utils.rowcol_to_a1(row_index+1,col_index+1)} is outside the grid of {self.title!r} ({self.row_count}x{self.col_count})")
+		while len(self._rows) <= row_index:
+			self._rows.append([])
+		row = self._rows[row_index]
+		while len(row) <= col_index:
+			row.append(None)
+		row[col_index] = value
+
+	def _clear_range(self, a1_range:str=None):
+		if a1_range is None:
+			self._rows.clear()
+			return
+		grid_range = gspread.utils.a1_range_to_grid_range(a1_range)
+		for r in range(grid_range.get("startRowIndex",0), min(grid_range.get("endRowIndex",len(self._rows)), len(self._rows))):
+			row = self._rows[r]
+			for c in range(grid_range.get("startColumnIndex",0), min(grid_range.get("endColumnIndex",len(row)), len(row))):
+				row[c] = None
+
+	def _values(self, a1_range:str=None)->list:
+		"""
+		Returns the stored values in the given range, without trailing empty rows and columns (as the Sheets API does).
+		"""
+		rows = self._rows
+		if a1_range is not None:
+			grid_range = gspread.utils.a1_range_to_grid_range(a1_range)
+			first_col = grid_range.get("startColumnIndex",0)
+			last_col = grid_range.get("endColumnIndex",None)
+			rows = [row[first_col:last_col] for row in rows[grid_range.get("startRowIndex",0):grid_range.get("endRowIndex",None)]]
+		rows = [list(row) for row in rows]
+		for row in rows:
+			while len(row)>0 and row[-1] in (None, ""):
+				row.pop()
+		while len(rows)>0 and len(rows[-1])==0:
+			rows.pop()
+		return rows
+
+	# The gspread API:
+
+	def get_all_values(self)->list:
+		self.spreadsheet._call("values_get")
+		rows = self._values()
+		width = max((len(row) for row in rows), default=0)
+		return [[_formatted(value) for value in row] + ['']*(width-len(row)) for row in rows]
+
+	def get_values(self, range_name:str=None, value_render_option=None, **kwargs)->list:
+		self.spreadsheet._call("values_get")
+		rows = self._values(range_name)
+		if value_render_option==gspread.utils.ValueRenderOption.unformatted:
+			return [[_typed(value) for value in row] for row in rows]
+		return [[_formatted(value) for value in row] for row in rows]
+
+	def clear(self):
+		self.spreadsheet._call("values_clear")
+		self._clear_range()
+		self.spreadsheet._save(self)
+
+	def update_cells(self, cell_list:list, value_input_option=None):
+		self.spreadsheet._call("values_update")
+		for cell in cell_list:
+			self._set(cell.row-1, cell.col-1, cell.value)
+		self.spreadsheet._save(self)
+
+	def update_cell(self, row:int, col:int, value):
+		self.spreadsheet._call("values_update")
+		self._set(row-1, col-1, value)
+		self.spreadsheet._save(self)
+
+	def format(self, ranges:str, format:dict):
+		self.spreadsheet._call("batch_update")
+		self.formats[ranges] = format
+
+	def add_rows(self, rows:int):
+		self.spreadsheet._call("batch_update")
+		self._resize(self.row_count+rows, self.col_count)
+		self.spreadsheet._save(self)
+
+	def add_cols(self, cols:int):
+		self.spreadsheet._call("batch_update")
+		self._resize(self.row_count, self.col_count+cols)
+		self.spreadsheet._save(self)
+
+
+class LocalSpreadsheet:
+	"""
+	A spreadsheet stored in local files (see the module documentation).
+
+	>>> import tempfile
+	>>> directory = tempfile.mkdtemp()
+	>>> spreadsheet = LocalSpreadsheet(directory)
+	>>> worksheet = spreadsheet.add_worksheet("input", rows=3, cols=2)
+	>>> worksheet.update_cell(1, 1, "a")
+	>>> worksheet.update_cell(2, 2, 3.0)
+	>>> LocalSpreadsheet(directory).worksheet("input").get_all_values()
+	[['a', ''], ['', '3']]
+	>>> spreadsheet.api_calls
+	Counter({'values_update': 2, 'batch_update': 1})
+	>>> _ = spreadsheet.batch_update({"requests": [{"deleteSheet": {"sheetId": worksheet.id}}]})
+	>>> LocalSpreadsheet(directory).worksheets()
+	[]
+	"""
+	def __init__(self, path:str, simulated_latency:float=0.0, autosave:bool=True, in_memory:bool=False):
+		"""
+		With in_memory=True, the spreadsheet starts empty and is never saved; path is used only as its id
+		(e.g. for an uploaded file, whose worksheets are added by read_csv or read_xlsx; see uploads).
+		"""
+		self.path = path
+		self.url = path
+		self.id = path
+		self.title = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+		self.simulated_latency = simulated_latency
+		self.autosave = autosave and not in_memory
+		self.api_calls = Counter()
+		self._lock = threading.Lock()
+		self._worksheets = []
+		if not in_memory:
+			self._load()
+
+	def __repr__(self):
+		return f"<LocalSpreadsheet {self.path!r}>"
+
+	def _call(self, name:str):
+		with self._lock:
+			self.api_calls[name] += 1
+		if self.simulated_latency > 0:
+			time.sleep(self.simulated_latency)
+		metrics.count_api_call("local", name, self.simulated_latency)
+
+	def _next_id(self)->int:
+		return max((worksheet.id for worksheet in self._worksheets), default=-1)+1
+
+	def _find(self, title:str=None, sheet_id:int=None)->LocalWorksheet:
+		for worksheet in self._worksheets:
+			if worksheet.title==title or (sheet_id is not None and worksheet.id==sheet_id):
+				return worksheet
+		raise gspread.WorksheetNotFound(title if title is not None else sheet_id)
+
+	# Storage:
+
+	def _storage(self)->str:
+		if self.path.lower().endswith(".xlsx"):
+			return "xlsx"
+		if self.path.lower().endswith(SQLITE_SUFFIXES):
+			return "sqlite"
+		return "csv"
+
+	def _load(self):
+		storage = self._storage()
+		if storage=="csv":
+			if not os.path.isdir(self.path):
+				return
+			for filename in sorted(os.listdir(self.path)):
+				if filename.endswith(".csv"):
+					with open(os.path.join(self.path, filename), newline="", encoding="utf-8") as file:
+						self.read_csv(file, filename[:-4])
+		elif storage=="xlsx":
+			if not os.path.exists(self.path):
+				return
+			import openpyxl
+			workbook = openpyxl.load_workbook(self.path)
+			for sheet in workbook.worksheets:
+				rows = [list(row) for row in sheet.iter_rows(values_only=True)]
+				self._worksheets.append(LocalWorksheet(self, self._next_id(), sheet.title, rows, sheet.max_row, sheet.max_column))
+		else:
+			with sqlite3.connect(self.path) as connection:
+				connection.execute("CREATE TABLE IF NOT EXISTS sheets (id INTEGER PRIMARY KEY, title TEXT, position INTEGER, row_count INTEGER, col_count INTEGER)")
+				connection.execute("CREATE TABLE IF NOT EXISTS cells (sheet_id INTEGER, row INTEGER, col INTEGER, value, PRIMARY KEY (sheet_id, row, col))")
+				for sheet_id,title,row_count,col_count in connection.execute("SELECT id, title, row_count, col_count FROM sheets ORDER BY position").fetchall():
+					rows = []
+					for r,c,value in connection.execute("SELECT row, col, value FROM cells WHERE sheet_id=?", (sheet_id,)):
+						while len(rows)<=r:
+							rows.append([])
+						while len(rows[r])<=c:
+							rows[r].append(None)
+						rows[r][c] = value
+					self._worksheets.append(LocalWorksheet(self, sheet_id, title, rows, row_count, col_count))
+
+	def _save(self, changed_worksheet:LocalWorksheet=None):
+		"""
+		Writes the given worksheet (or all worksheets, if None) to the files.
+		"""
+		if not self.autosave:
+			return
+		self.save(changed_worksheet)
+
+	def _delete_stored(self, worksheets:list):
+		"""
+		Removes the given deleted worksheets from the files.
+		"""
+		if not self.autosave:
+			return
+		storage = self._storage()
+		if storage=="xlsx":
+			self.save()
+			return
+		with self._lock:
+			if storage=="csv":
+				for worksheet in worksheets:
+					try:
+						os.remove(os.path.join(self.path, worksheet.title+".csv"))
+					except FileNotFoundError:
+						pass
+			else:
+				with sqlite3.connect(self.path) as connection:
+					for worksheet in worksheets:
+						connection.execute("DELETE FROM sheets WHERE id=?", (worksheet.id,))
+						connection.execute("DELETE FROM cells WHERE sheet_id=?", (worksheet.id,))
+
+	def save(self, changed_worksheet:LocalWorksheet=None):
+		with self._lock:
+			storage = self._storage()
+			worksheets = self._worksheets if changed_worksheet is None else [changed_worksheet]
+			if storage=="csv":
+				os.makedirs(self.path, exist_ok=True)
+				for worksheet in worksheets:
+					with open(os.path.join(self.path, worksheet.title+".csv"), "w", newline="", encoding="utf-8") as file:
+						self.write_csv(file, worksheet.title)
+			elif storage=="xlsx":
+				self.write_xlsx(self.path)
+			else:
+				with sqlite3.connect(self.path) as connection:
+					for worksheet in worksheets:
+						connection.execute("INSERT OR REPLACE INTO sheets VALUES (?,?,?,?,?)",
+							(worksheet.id, worksheet.title, self._worksheets.index(worksheet), worksheet.row_count, worksheet.col_count))
+						connection.execute("DELETE FROM cells WHERE sheet_id=?", (worksheet.id,))
+						connection.executemany("INSERT INTO cells VALUES (?,?,?,?)", [
+							(worksheet.id, r, c, value)
+							for r,row in enumerate(worksheet._values()) for c,value in enumerate(row)
+							if value is not None])
+
+	# Reading and writing single files (without counting API calls):
+
+	def titles(self)->list:
+		return [worksheet.title for worksheet in self._worksheets]
+
+	def read_csv(self, file, title:str)->LocalWorksheet:
+		"""
+		Adds a worksheet with the rows of the given CSV text file, which is read one row at a time.
+
+		>>> import io
+		>>> spreadsheet = LocalSpreadsheet("upload", in_memory=True)
+		>>> spreadsheet.read_csv(io.StringIO("a,b\\n,3\\n"), "input").get_all_values()
+		[['a', 'b'], ['', '3']]
+		"""
+		rows = [[value if value!="" else None for value in row] for row in csv.reader(file)]
+		worksheet = LocalWorksheet(self, self._next_id(), title, rows)
+		self._worksheets.append(worksheet)
+		return worksheet
+
+	def read_xlsx(self, file):
+		"""
+		Adds the worksheets of the given XLSX file (a path or a seekable binary file), which are read one row at a time.
+		Formulas are replaced by their last computed values.
+		"""
+		import openpyxl
+		workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+		try:
+			for sheet in workbook.worksheets:
+				rows = [list(row) for row in sheet.iter_rows(values_only=True)]
+				self._worksheets.append(LocalWorksheet(self, self._next_id(), sheet.title, rows))
+		finally:
+			workbook.close()
+
+	def write_csv(self, file, title:str):
+		"""
+		Writes the values of the given worksheet to the given CSV text file.
+		"""
+		csv.writer(file).writerows([[_formatted(value) for value in row] for row in self._find(title)._values()])
+
+	def write_xlsx(self, file, titles:list=None):
+		"""
+		Writes the given worksheets (default: all) to the given XLSX file (a path or a binary file).
+		"""
+		import openpyxl
+		workbook = openpyxl.Workbook(write_only=True)
+		for title in (self.titles() if titles is None else titles):
+			sheet = workbook.create_sheet(title)
+			for row in self._find(title)._values():
+				sheet.append(row)
+		workbook.save(file)
+
+	# The gspread API:
+
+	def worksheets(self)->list:
+		self._call("fetch_sheet_metadata")
+		return list(self._worksheets)
+
+	def worksheet(self, title:str)->LocalWorksheet:
+		self._call("fetch_sheet_metadata")
+		return self._find(title)
+
+	def worksheet_from_properties(self, properties:dict)->LocalWorksheet:
+		"""
+		Returns the worksheet described by the given properties (without an API call).
+		"""
+		return self._find(sheet_id=properties["sheetId"])
+
+	def add_worksheet(self, title:str, rows:int, cols:int)->LocalWorksheet:
+		self._call("batch_update")
+		worksheet = self._add_worksheet(title, rows, cols)
+		self._save(worksheet)
+		return worksheet
+
+	def _add_worksheet(self, title:str, rows:int, cols:int, sheet_id:int=None)->LocalWorksheet:
+		if any(worksheet.title==title for worksheet in self._worksheets):
+			raise gspread.exceptions.GSpreadException(f"A sheet with the name {title!r} already exists")
+		worksheet = LocalWorksheet(self, self._next_id() if sheet_id is None else sheet_id, title, [], rows, cols)
+		self._worksheets.append(worksheet)
+		return worksheet
+
+	def fetch_sheet_metadata(self, params:dict=None)->dict:
+		self._call("fetch_sheet_metadata")
+		return {
+			"properties": {"title": self.title},
+			"sheets": [{"properties": worksheet.properties} for worksheet in self._worksheets]}
+
+	def batch_update(self, body:dict)->dict:
+		"""
+		Supports the requests addSheet, deleteSheet, updateSheetProperties (grid size), updateCells and repeatCell.
+		"""
+		self._call("batch_update")
+		replies = []
+		changed = set()
+		deleted = []
+		for request in body["requests"]:
+			kind, details = next(iter(request.items()))
+			if kind=="addSheet":
+				properties = details["properties"]
+				grid = properties.get("gridProperties", {})
+				worksheet = self._add_worksheet(properties["title"], grid.get("rowCount",DEFAULT_ROW_COUNT), grid.get("columnCount",DEFAULT_COL_COUNT), properties.get("sheetId",None))
+				changed.add(worksheet)
+				replies.append({"addSheet": {"properties": worksheet.properties}})
+				continue
+			elif kind=="deleteSheet":
+				worksheet = self._find(sheet_id=details["sheetId"])
+				self._worksheets.remove(worksheet)
+				changed.discard(worksheet)
+				deleted.append(worksheet)
+				replies.append({})
+				continue
+			elif kind=="updateSheetProperties":
+				worksheet = self._find(sheet_id=details["properties"]["sheetId"])
+				grid = details["properties"].get("gridProperties", {})
+				worksheet._resize(grid.get("rowCount", worksheet.row_count), grid.get("columnCount", worksheet.col_count))
+			elif kind=="updateCells":
+				if "start" in details:
+					worksheet = self._find(sheet_id=details["start"]["sheetId"])
+					first_row, first_col = details["start"].get("rowIndex",0), details["start"].get("columnIndex",0)
+					for r,row in enumerate(details.get("rows",[])):
+						for c,cell_data in enumerate(row.get("values",[])):
+							value = next(iter(cell_data.get("userEnteredValue",{None: None}).values()))
+							worksheet._set(first_row+r, first_col+c, value)
+				else:
+					grid_range = details["range"]
+					worksheet = self._find(sheet_id=grid_range["sheetId"])
+					if len(grid_range)==1:
+						worksheet._clear_range()
+					else:
+						worksheet._clear_range(gspread.utils.rowcol_to_a1(grid_range.get("startRowIndex",0)+1, grid_range.get("startColumnIndex",0)+1)+":"+gspread.utils.rowcol_to_a1(grid_range["endRowIndex"], grid_range["endColumnIndex"]))
+			elif kind=="repeatCell":
+				grid_range = details["range"]
+				worksheet = self._find(sheet_id=grid_range["sheetId"])
+				worksheet.formats[str(grid_range)] = details["cell"]
+			else:
+				raise NotImplementedError(f"LocalSpreadsheet does not support the request {kind}")
+			changed.add(worksheet)
+			replies.append({})
+		for worksheet in changed:
+			self._save(worksheet)
+		if len(deleted)>0:
+			self._delete_stored(deleted)
+		return {"replies": replies}
+
+	def _value_range(self, range_name:str, params:dict)->dict:
+		title, a1_range = _split_range(range_name)
+		rows = self._find(title)._values(a1_range)
+		convert = _typed if (params or {}).get("valueRenderOption", None)=="UNFORMATTED_VALUE" else _formatted
+		value_range = {"range": range_name, "majorDimension": "ROWS"}
+		if len(rows)>0:
+			value_range["values"] = [[convert(value) for value in row] for row in rows]
+		return value_range
+
+	def values_get(self, range:str, params:dict=None)->dict:
+		self._call("values_get")
+		return self._value_range(range, params)
+
+	def values_batch_get(self, ranges:list, params:dict=None)->dict:
+		self._call("values_batch_get")
+		return {"spreadsheetId": self.id, "valueRanges": [self._value_range(range_name, params) for range_name in ranges]}
+
+	def values_batch_clear(self, params:dict=None, body:dict=None):
+		self._call("values_batch_clear")
+		for range_name in body["ranges"]:
+			title, a1_range = _split_range(range_name)
+			worksheet = self._find(title)
+			worksheet._clear_range(a1_range)
+			self._save(worksheet)
+
+	def values_batch_update(self, body:dict):
+		self._call("values_batch_update")
+		for data in body["data"]:
+			title, a1_range = _split_range(data["range"])
+			worksheet = self._find(title)
+			first_row, first_col = gspread.utils.a1_to_rowcol(a1_range.split(":")[0])
+			for r,row in enumerate(data["values"]):
+				for c,value in enumerate(row):
+					worksheet._set(first_row-1+r, first_col-1+c, value)
+			self._save(worksheet)
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
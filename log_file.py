@@ -0,0 +1,193 @@
+"""
+Reading parts of the log file, without loading all of it into memory.
+Used by the /log endpoint of app.py.
+
+Output printed by background jobs is tagged with "[job <id>]" (see tag_job_output),
+so that the lines of a single job can be filtered.
+
+Configuration (environment variables):
+ * FAIRWEB_LOG_FILE - the file to which the server output is redirected (default: app.log).
+"""
+
+import sys, threading, time, os
+import jobs
+
+LOG_FILE = os.environ.get("FAIRWEB_LOG_FILE", "app.log")
+CHUNK_SIZE = 64*1024
+FOLLOW_POLL_SECONDS = 0.5
+FOLLOW_KEEPALIVE_SECONDS = 15
+
+
+class _JobTaggingStream:
+	"""
+	Wraps an output stream, and prefixes each line written by a job thread with the id of the job.
+	"""
+	def __init__(self, stream):
+		self._stream = stream
+		self._local = threading.local()   # whether the current thread is at the start of a line
+
+	def write(self, text:str)->int:
+		job = jobs.current()
+		if job is None or text=="":
+			return self._stream.write(text)
+		prefix = f"[job {job.id}] "
+		at_line_start = getattr(self._local, "at_line_start", True)
+		lines = text.split("\n")
+		tagged = "\n".join(
+			(prefix+line if line!="" and (i>0 or at_line_start) else line)
+			for i,line in enumerate(lines))
+		self._local.at_line_start = text.endswith("\n")
+		self._stream.write(tagged)
+		return len(text)
+
+	def __getattr__(self, name):
+		return getattr(self._stream, name)
+
+
+def tag_job_output():
+	"""
+	Makes all lines printed by background jobs to stdout and stderr start with "[job <id>]".
+	Calling it again has no effect.
+	"""
+	if not isinstance(sys.stdout, _JobTaggingStream):
+		sys.stdout = _JobTaggingStream(sys.stdout)
+	if not isinstance(sys.stderr, _JobTaggingStream):
+		sys.stderr = _JobTaggingStream(sys.stderr)
+
+
+def _job_tag(job_id:str)->bytes:
+	return None if job_id is None else f"[job {job_id}]".encode()
+
+
+def _lines_backwards(file, end:int):
+	"""
+	Yields the lines of the file that end at or before the given offset, from the last to the first, without their newlines.
+	Reads the file in chunks from its end.
+	"""
+	position = end
+	remainder = b""
+	while position > 0:
+		chunk_size = min(CHUNK_SIZE, position)
+		position -= chunk_size
+		file.seek(position)
+		lines = (file.read(chunk_size) + remainder).split(b"\n")
+		remainder = lines[0]
+		yield from reversed(lines[1:])
+	yield remainder
+
+
+def tail(path:str, num_lines:int, job_id:str=None)->tuple[bytes,int]:
+	"""
+	Returns the last num_lines complete lines of the given file (only those of the given job, if job_id is given),
+	and the offset after the last complete line, from which to continue reading.
+
+	>>> import tempfile
+	>>> path = os.path.join(tempfile.mkdtemp(), "test.log")
+	>>> with open(path, "w") as file: _ = file.write("a\\n[job 1] b\\nc\\n[job 1] d\\ne")
+	>>> tail(path, 2)
+	(b'c\\n[job 1] d\\n', 24)
+	>>> tail(path, 10, job_id="1")
+	(b'[job 1] b\\n[job 1] d\\n', 24)
+	>>> tail(path, 0)
+	(b'', 24)
+	"""
+	tag = _job_tag(job_id)
+	with open(path, "rb") as file:
+		end = _last_line_end(file, file.seek(0, os.SEEK_END))
+		lines = []
+		if num_lines > 0 and end > 0:
+			for line in _lines_backwards(file, end-1):   # without the last newline
+				if tag is None or tag in line:
+					lines.append(line)
+					if len(lines) >= num_lines:
+						break
+	return b"".join(line+b"\n" for line in reversed(lines)), end
+
+
+def _last_line_end(file, end:int)->int:
+	"""
+	Returns the offset just after the last newline before the given offset (0 if there is none).
+	"""
+	position = end
+	while position > 0:
+		chunk_size = min(CHUNK_SIZE, position)
+		position -= chunk_size
+		file.seek(position)
+		index = file.read(chunk_size).rfind(b"\n")
+		if index >= 0:
+			return position+index+1
+	return 0
+
+
+def read_page(path:str, offset:int, limit:int, job_id:str=None)->tuple[bytes,int]:
+	"""
+	Returns the complete lines that start in the byte range [offset, offset+limit) of the given file
+	(only those of the given job, if job_id is given), and the offset of the next page.
+	A line that is longer than the limit is returned whole.
+
+	>>> import tempfile
+	>>> path = os.path.join(tempfile.mkdtemp(), "test.log")
+	>>> with open(path, "w") as file: _ = file.write("aaa\\n[job 1] b\\nc\\nunfinished")
+	>>> read_page(path, 0, 6)
+	(b'aaa\\n', 4)
+	>>> read_page(path, 4, 100)
+	(b'[job 1] b\\nc\\n', 16)
+	>>> read_page(path, 0, 100, job_id="1")
+	(b'[job 1] b\\n', 16)
+	>>> read_page(path, 16, 100)
+	(b'', 16)
+	>>> read_page(path, 0, 2)
+	(b'aaa\\n', 4)
+	"""
+	tag = _job_tag(job_id)
+	with open(path, "rb") as file:
+		file.seek(offset)
+		data = file.read(limit)
+		last_newline = data.rfind(b"\n")
+		if last_newline < 0:
+			data += file.readline()          # the first line is longer than the limit
+			if not data.endswith(b"\n"):
+				return b"", offset           # an unfinished line at the end of the file
+			last_newline = len(data)-1
+	data = data[:last_newline+1]
+	next_offset = offset+len(data)
+	if tag is not None:
+		data = b"".join(line+b"\n" for line in data.split(b"\n")[:-1] if tag in line)
+	return data, next_offset
+
+
+def follow(path:str, offset:int, job_id:str=None):
+	"""
+	Yields server-sent events with the complete lines that are added to the given file after the given offset.
+	The id of each event is the offset after its line, so that a reconnecting client (Last-Event-ID) continues from there.
+	If job_id is given, only lines of that job are sent, and the stream ends once the job is finished.
+	"""
+	tag = _job_tag(job_id)
+	last_sent = time.monotonic()
+	while True:
+		job = None if job_id is None else jobs.get(job_id)
+		job_finished = job_id is not None and (job is None or job.state not in (jobs.QUEUED, jobs.RUNNING))
+		if os.path.getsize(path) < offset:    # the file was truncated or rotated
+			offset = 0
+		with open(path, "rb") as file:
+			file.seek(offset)
+			while True:
+				line = file.readline()
+				if not line.endswith(b"\n"):
+					break
+				offset += len(line)
+				if tag is None or tag in line:
+					yield f"id: {offset}\ndata: {line[:-1].decode('utf-8', errors='replace')}\n\n"
+					last_sent = time.monotonic()
+		if job_finished:
+			yield f"event: end\ndata: {job.state if job is not None else 'unknown'}\n\n"
+			return
+		if time.monotonic()-last_sent > FOLLOW_KEEPALIVE_SECONDS:
+			yield ": keepalive\n\n"
+			last_sent = time.monotonic()
+		time.sleep(FOLLOW_POLL_SECONDS)
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
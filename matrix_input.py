@@ -0,0 +1,66 @@
+"""
+Utilities for parsing the numeric part of input rows into NumPy arrays.
+Used by the analyze_rows functions of both algorithms.
+"""
+
+import numpy as np
+
+
+def numbers(rows:list, first_col:int, num_cols:int)->np.ndarray:
+	"""
+	Returns a float matrix with the values in columns [first_col, first_col+num_cols) of the given rows.
+	Empty cells and missing cells are parsed as 0.
+
+	>>> numbers([['a', '1', '2.5'], ['b', '', '3'], ['c', '4']], 1, 2)
+	array([[1. , 2.5],
+	       [0. , 3. ],
+	       [4. , 0. ]])
+	>>> numbers([['a', 1, 2.5]], 1, 2)    # already-typed values are accepted too
+	array([[1. , 2.5]])
+	>>> numbers([], 1, 2).shape
+	(0, 2)
+	"""
+	if len(rows)==0:
+		return np.zeros((0,num_cols))
+	last_col = first_col+num_cols
+	flat_values = [
+		value or 0     # empty cell
+		for row in rows
+		for value in (row[first_col:last_col] if len(row)>=last_col else list(row[first_col:last_col])+['']*(last_col-max(len(row),first_col)))]
+	return np.array(flat_values, dtype=float).reshape(len(rows), num_cols)
+
+
+def normalized(matrix:np.ndarray, new_sums)->np.ndarray:
+	"""
+	Multiplies each row of the given matrix by a ratio, such that its sum becomes the matching element of new_sums.
+	Raises ZeroDivisionError if some row sums to 0.
+
+	>>> normalized(np.array([[1.,3.],[2.,2.]]), 100)
+	array([[25., 75.],
+	       [50., 50.]])
+	>>> normalized(np.array([[1.,3.],[2.,2.]]), [4, 8])
+	array([[1., 3.],
+	       [4., 4.]])
+	"""
+	current_sums = matrix.sum(axis=1)
+	if np.any(current_sums==0):
+		raise ZeroDivisionError(f"Rows {list(np.flatnonzero(current_sums==0))} sum to zero and cannot be normalized")
+	ratios = np.asarray(new_sums, dtype=float) / current_sums
+	return matrix * ratios[:,np.newaxis]
+
+
+def to_dicts(agents:list, items:list, matrix:np.ndarray)->dict:
+	"""
+	Converts an agents*items matrix to a dict of dicts: agent -> item -> value (with Python numbers, not NumPy numbers).
+
+	>>> to_dicts(['a','b'], ['x','y'], np.array([[1,2],[3,4]]))
+	{'a': {'x': 1, 'y': 2}, 'b': {'x': 3, 'y': 4}}
+	"""
+	return {
+		agent: dict(zip(items, values))
+		for agent,values in zip(agents, matrix.tolist())}
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
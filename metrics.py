@@ -0,0 +1,182 @@
+"""
+Timing of the stages of a run, counting of Sheets API calls, and their export in the Prometheus text format.
+
+A run is measured by wrapping it in run_scope(algorithm_name), and each of its stages in span(stage) (or a function decorated with timed(stage)).
+The durations are added both to the result of the run and to process-wide histograms, that are rendered by render() for the /metrics endpoint.
+Since the histograms are kept in memory, each worker process exports its own.
+"""
+
+import bisect, contextlib, contextvars, functools, threading, time
+from collections import Counter
+import logging
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+COUNT_BUCKETS   = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram:
+	"""
+	A Prometheus histogram, with one series of bucket counts per combination of label values.
+
+	>>> histogram = Histogram("example_seconds", "An example.", ("stage",), buckets=(0.1, 1))
+	>>> histogram.observe(0.05, stage="read"); histogram.observe(0.5, stage="read"); histogram.observe(5, stage="read")
+	>>> print(histogram.render())
+	# HELP example_seconds An example.
+	# TYPE example_seconds histogram
+	example_seconds_bucket{stage="read",le="0.1"} 1
+	example_seconds_bucket{stage="read",le="1"} 2
+	example_seconds_bucket{stage="read",le="+Inf"} 3
+	example_seconds_sum{stage="read"} 5.55
+	example_seconds_count{stage="read"} 3
+	"""
+	def __init__(self, name:str, help:str, label_names:tuple, buckets:tuple=SECONDS_BUCKETS):
+		self.name = name
+		self.help = help
+		self.label_names = label_names
+		self.buckets = buckets
+		self._series = {}    # maps a tuple of label values to [bucket counts, sum, count]
+		self._lock = threading.Lock()
+
+	def observe(self, value:float, **labels):
+		label_values = tuple(str(labels[name]) for name in self.label_names)
+		with self._lock:
+			series = self._series.setdefault(label_values, [[0]*len(self.buckets), 0.0, 0])
+			index = bisect.bisect_left(self.buckets, value)
+			for i in range(index, len(self.buckets)):
+				series[0][i] += 1
+			series[1] += value
+			series[2] += 1
+
+	def render(self)->str:
+		lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+		with self._lock:
+			for label_values,(bucket_counts,total,count) in sorted(self._series.items()):
+				labels = ",".join(f'{name}="{_escaped(value)}"' for name,value in zip(self.label_names, label_values))
+				for bucket,bucket_count in zip(self.buckets, bucket_counts):
+					lines.append(f'{self.name}_bucket{{{labels},le="{bucket:g}"}} {bucket_count}')
+				lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+				lines.append(f'{self.name}_sum{{{labels}}} {total:g}')
+				lines.append(f'{self.name}_count{{{labels}}} {count}')
+		return "\n".join(lines)
+
+
+def _escaped(value:str)->str:
+	return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+stage_seconds = Histogram("fairweb_stage_seconds", "Duration of a stage of a run.", ("algorithm", "stage"))
+api_call_seconds = Histogram("fairweb_sheets_api_call_seconds", "Duration of a single Sheets API call.", ("backend", "method"))
+api_calls_per_run = Histogram("fairweb_sheets_api_calls_per_run", "Number of Sheets API calls in a single run.", ("algorithm",), buckets=COUNT_BUCKETS)
+
+
+class RunMeasures:
+	"""
+	The measures of a single run: the total duration of each stage, and the number of API calls of each method.
+	"""
+	def __init__(self, algorithm_name:str):
+		self.algorithm_name = algorithm_name
+		self.stage_seconds = Counter()
+		self.api_calls = Counter()
+		self._lock = threading.Lock()    # stages of a pipelined run may be measured in several threads
+
+	def add_seconds(self, stage:str, seconds:float):
+		with self._lock:
+			self.stage_seconds[stage] += seconds
+
+	def add_api_call(self, method:str):
+		with self._lock:
+			self.api_calls[method] += 1
+
+	def to_dict(self)->dict:
+		return {"stage_seconds": {stage: round(seconds,6) for stage,seconds in self.stage_seconds.items()}, "api_calls": dict(self.api_calls)}
+
+
+_current = contextvars.ContextVar("run", default=None)   # a context variable, so that threads started by asyncio.to_thread see the run too
+
+
+def current()->RunMeasures:
+	"""
+	Returns the measures of the run in the current thread (or in the thread that started it with asyncio.to_thread), or None if there is none.
+	"""
+	return _current.get()
+
+
+@contextlib.contextmanager
+def run_scope(algorithm_name:str):
+	"""
+	Measures the run of the given algorithm in the body of the with statement, and yields its RunMeasures.
+
+	>>> with run_scope("example") as measures:
+	...     with span("parse"):
+	...         pass
+	...     count_api_call("local", "values_get", 0.01)
+	>>> sorted(measures.stage_seconds.keys()), measures.api_calls
+	(['parse', 'total'], Counter({'values_get': 1}))
+	"""
+	measures = RunMeasures(algorithm_name)
+	token = _current.set(measures)
+	start = time.perf_counter()
+	try:
+		yield measures
+	finally:
+		_current.reset(token)
+		seconds = time.perf_counter()-start
+		measures.add_seconds("total", seconds)
+		stage_seconds.observe(seconds, algorithm=algorithm_name, stage="total")
+		api_calls_per_run.observe(sum(measures.api_calls.values()), algorithm=algorithm_name)
+		logger.info("run of %s: %s", algorithm_name, measures.to_dict())
+
+
+@contextlib.contextmanager
+def span(stage:str):
+	"""
+	Measures the duration of the body of the with statement as the given stage of the current run.
+	Outside a run, the duration is recorded with algorithm="".
+	"""
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		seconds = time.perf_counter()-start
+		measures = current()
+		if measures is not None:
+			measures.add_seconds(stage, seconds)
+		stage_seconds.observe(seconds, algorithm=measures.algorithm_name if measures is not None else "", stage=stage)
+		logger.debug("stage %s took %.3f seconds", stage, seconds)
+
+
+def timed(stage:str):
+	"""
+	A decorator that measures each call of the function as the given stage (see span).
+	"""
+	def decorator(function):
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			with span(stage):
+				return function(*args, **kwargs)
+		return wrapper
+	return decorator
+
+
+def count_api_call(backend:str, method:str, seconds:float):
+	"""
+	Records a single call of the Sheets API (or of a local spreadsheet) in the current run and in the histograms.
+	"""
+	measures = current()
+	if measures is not None:
+		measures.add_api_call(method)
+	api_call_seconds.observe(seconds, backend=backend, method=method)
+
+
+def render()->str:
+	"""
+	Returns all metrics of this process in the Prometheus text format.
+	"""
+	return "\n".join(histogram.render() for histogram in (stage_seconds, api_call_seconds, api_calls_per_run)) + "\n"
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
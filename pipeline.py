@@ -0,0 +1,62 @@
+"""
+An asyncio interface to the blocking spreadsheet functions, for pipelined runs (see run_course_allocation.run).
+
+Each blocking call (a Sheets API request through gspread or a local spreadsheet, or a solve in the solver pool)
+runs in a thread with asyncio.to_thread, so that independent calls overlap.
+The Sheets API requests still pass through sheets_scheduler, so the rate limit holds regardless of the number of calls in flight.
+The current job and the measures of the current run are context variables, so they are seen in these threads too.
+
+Configuration (environment variables):
+ * FAIRWEB_PIPELINE - if set, course allocation runs are pipelined by default.
+ * FAIRWEB_PIPELINE_CONCURRENCY - the maximum number of spreadsheet calls of a single run in flight at the same time (default: 4).
+"""
+
+import asyncio, os
+import gspread
+import logging
+from gspread_utils import sheet_directory
+
+logger = logging.getLogger(__name__)
+
+PIPELINED = os.environ.get("FAIRWEB_PIPELINE", "") not in ("", "0")
+MAX_CONCURRENCY = int(os.environ.get("FAIRWEB_PIPELINE_CONCURRENCY", 4))
+
+
+class AsyncSpreadsheet:
+	"""
+	Wraps a spreadsheet (of either backend), so that functions that take it as their first argument can be awaited.
+
+	>>> class Spreadsheet: title = "s"
+	>>> asyncio.run(AsyncSpreadsheet(Spreadsheet()).call(lambda spreadsheet, suffix: spreadsheet.title+suffix, "1"))
+	's1'
+	"""
+	def __init__(self, spreadsheet:gspread.Spreadsheet, max_concurrency:int=MAX_CONCURRENCY):
+		self.spreadsheet = spreadsheet
+		self._semaphore = asyncio.Semaphore(max_concurrency)
+
+	async def call(self, function, *args, **kwargs):
+		"""
+		Calls function(spreadsheet, *args, **kwargs) in a thread, and returns its result.
+		"""
+		async with self._semaphore:
+			return await asyncio.to_thread(function, self.spreadsheet, *args, **kwargs)
+
+	async def read_input(self, read_rows, guessed_title:str)->list:
+		"""
+		Returns read_rows(spreadsheet, title=guessed_title), while the worksheet list is fetched at the same time.
+		If there is no worksheet with the guessed title, returns read_rows(spreadsheet), which finds the title in the worksheet list.
+		"""
+		listing = asyncio.create_task(self.call(lambda spreadsheet: sheet_directory(spreadsheet).worksheets()))
+		try:
+			rows = await self.call(read_rows, title=guessed_title)
+		except (gspread.exceptions.APIError, gspread.WorksheetNotFound) as error:   # the Sheets API returns HTTP 400 for an unknown sheet title
+			logger.info("could not read worksheet %r (%s); looking for the input worksheet by its other names", guessed_title, error)
+			await listing
+			rows = await self.call(read_rows)
+		await listing
+		return rows
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
@@ -0,0 +1,236 @@
+"""
+Profiling a single run on demand (e.g. /run/<algorithm_name>?profile=1, see app.py), to find out why it is slow.
+
+The run gets:
+ * a sampling CPU profile: a thread takes the Python stack of the run every FAIRWEB_PROFILE_INTERVAL seconds,
+   so the profile shows wall-clock time, including the time spent waiting for the Sheets API.
+   It is written in the "folded" format of flamegraph.pl, speedscope and similar tools: one line per distinct stack,
+   with its frames from the outermost, separated by semicolons, and then the number of samples.
+ * a tracemalloc memory snapshot, taken at the end of the run, and a text summary of its largest allocations.
+During a profiled run, solves run in the thread of the run rather than in the solver pool (see solver_pool.inline),
+so that they are sampled too. Runs that are not profiled are not affected.
+
+The threads that are sampled are the thread of the job, and the threads of asyncio.to_thread (in pipelined runs).
+Since tracemalloc traces the whole process, the memory snapshot includes allocations of other runs at the same time.
+
+Configuration (environment variables):
+ * FAIRWEB_PROFILE_TOKEN - the token of the administrator, who may profile runs and download their profiles.
+   If it is not set, profiling is disabled.
+ * FAIRWEB_PROFILE_INTERVAL - the sampling interval in seconds (default: 0.005).
+ * FAIRWEB_PROFILES - the number of profiles kept in memory (default: 16). Older ones are forgotten.
+"""
+
+import collections, hmac, io, pickle, sys, threading, time, tracemalloc, zipfile, os
+import logging
+import jobs, result_cache, solver_pool
+
+logger = logging.getLogger(__name__)
+
+TOKEN        = os.environ.get("FAIRWEB_PROFILE_TOKEN", "")
+INTERVAL     = float(os.environ.get("FAIRWEB_PROFILE_INTERVAL", 0.005))
+MAX_PROFILES = int(os.environ.get("FAIRWEB_PROFILES", 16))
+
+MEMORY_FRAMES = 5          # The number of frames kept in the traceback of each allocation.
+MEMORY_TOP_LINES = 30      # The number of lines in the summary of the largest allocations.
+
+_package_directory = os.path.dirname(os.path.abspath(__file__))
+
+
+def is_authorized(token:str)->bool:
+	"""
+	Returns True if the given token is the administrator token (and profiling is enabled).
+	"""
+	return TOKEN!="" and token is not None and hmac.compare_digest(token.encode("utf-8"), TOKEN.encode("utf-8"))
+
+
+def _frame_name(code)->str:
+	"""
+	>>> _frame_name(is_authorized.__code__).startswith("is_authorized (profiling.py:")
+	True
+	"""
+	filename = code.co_filename
+	if filename.startswith(_package_directory+os.sep):
+		filename = os.path.relpath(filename, _package_directory)
+	else:
+		filename = os.sep.join(filename.split(os.sep)[-2:])
+	return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _is_idle(frame)->bool:
+	"""
+	Returns True if the given innermost frame is an idle worker of a thread pool (waiting for a task).
+	"""
+	code = frame.f_code
+	return code.co_name=="_worker" and code.co_filename.endswith(os.path.join("concurrent", "futures", "thread.py"))
+
+
+class SamplingProfiler:
+	"""
+	Samples the Python stacks of the given thread (and of the asyncio.to_thread threads) in a background thread,
+	while it is used as a context manager.
+
+	>>> def busy(seconds):
+	...     end = time.perf_counter()+seconds
+	...     while time.perf_counter()<end:
+	...         pass
+	>>> with SamplingProfiler(threading.get_ident(), interval=0.001) as profiler:
+	...     busy(0.2)
+	>>> profiler.samples > 0, any(";busy (" in line for line in profiler.folded().splitlines())
+	(True, True)
+	"""
+	def __init__(self, thread_id:int, interval:float=INTERVAL):
+		self.thread_id = thread_id
+		self.interval = interval
+		self.stacks = collections.Counter()    # maps a folded stack to its number of samples
+		self.samples = 0
+		self.seconds = 0.0
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._loop, name="profiler", daemon=True)
+
+	def __enter__(self):
+		self._start = time.perf_counter()
+		self._thread.start()
+		return self
+
+	def __exit__(self, *exc_info):
+		self._stop.set()
+		self._thread.join()
+		self.seconds = time.perf_counter()-self._start
+
+	def _loop(self):
+		own_id = threading.get_ident()
+		while not self._stop.wait(self.interval):
+			thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+			for thread_id,frame in sys._current_frames().items():
+				if thread_id==own_id:
+					continue
+				name = thread_names.get(thread_id, "")
+				if thread_id!=self.thread_id and not name.startswith("asyncio_"):
+					continue
+				if _is_idle(frame):
+					continue
+				stack = []
+				while frame is not None:
+					stack.append(_frame_name(frame.f_code))
+					frame = frame.f_back
+				stack.append(name)
+				self.stacks[";".join(reversed(stack))] += 1
+			self.samples += 1
+
+	def folded(self)->str:
+		"""
+		Returns the samples in the folded format (see the module documentation).
+		"""
+		return "".join(f"{stack} {count}\n" for stack,count in sorted(self.stacks.items()))
+
+
+_tracing_runs = 0           # The number of profiled runs that need tracemalloc; it is stopped after the last one.
+_started_tracing = False    # Whether tracemalloc was started here (and not, e.g., by a benchmark).
+_tracing_lock = threading.Lock()
+
+
+def _start_tracing():
+	global _tracing_runs, _started_tracing
+	with _tracing_lock:
+		if _tracing_runs==0:
+			_started_tracing = not tracemalloc.is_tracing()
+			if _started_tracing:
+				tracemalloc.start(MEMORY_FRAMES)
+			tracemalloc.reset_peak()
+		_tracing_runs += 1
+
+
+def _stop_tracing()->tuple:
+	"""
+	Returns a snapshot of the traced memory blocks and the peak traced memory, and stops tracemalloc after the last profiled run.
+	"""
+	global _tracing_runs
+	with _tracing_lock:
+		snapshot = tracemalloc.take_snapshot().filter_traces([
+			tracemalloc.Filter(False, tracemalloc.__file__),
+			tracemalloc.Filter(False, __file__),      # the sampled stacks
+			tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+			tracemalloc.Filter(False, "<unknown>")])
+		peak_bytes = tracemalloc.get_traced_memory()[1]
+		_tracing_runs -= 1
+		if _tracing_runs==0 and _started_tracing:
+			tracemalloc.stop()
+	return snapshot, peak_bytes
+
+
+def memory_summary(snapshot:tracemalloc.Snapshot, peak_bytes:int)->str:
+	"""
+	Returns a text summary of the given snapshot: the peak traced memory, and the source lines that allocated the most memory.
+	"""
+	statistics = snapshot.statistics("lineno")
+	lines = [f"Peak traced memory: {peak_bytes/1024:.1f} KiB",
+		f"Memory held at the end of the run: {sum(statistic.size for statistic in statistics)/1024:.1f} KiB in {len(snapshot.traces)} blocks",
+		f"The {MEMORY_TOP_LINES} source lines that hold the most memory:"]
+	lines += [str(statistic) for statistic in statistics[:MEMORY_TOP_LINES]]
+	return "\n".join(lines)+"\n"
+
+
+class Profile:
+	"""
+	The profile of a single run.
+	"""
+	def __init__(self, job_id:str, profiler:SamplingProfiler, snapshot:tracemalloc.Snapshot, peak_bytes:int):
+		self.job_id = job_id
+		self.folded = profiler.folded()
+		self.samples = profiler.samples
+		self.seconds = profiler.seconds
+		self.memory_summary = memory_summary(snapshot, peak_bytes)
+		self.snapshot = pickle.dumps(snapshot)     # in the format of tracemalloc.Snapshot.dump, so it can be loaded by tracemalloc.Snapshot.load
+		self.peak_bytes = peak_bytes
+
+	def to_dict(self)->dict:
+		return {"samples": self.samples, "seconds": self.seconds, "stacks": self.folded.count("\n"), "peak_memory_bytes": self.peak_bytes}
+
+	def archive(self)->bytes:
+		"""
+		Returns a zip with the folded stacks (<job id>.folded), the memory summary (<job id>-memory.txt),
+		and the memory snapshot (<job id>.tracemalloc).
+		"""
+		output = io.BytesIO()
+		with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+			archive.writestr(f"{self.job_id}.folded", self.folded)
+			archive.writestr(f"{self.job_id}-memory.txt", self.memory_summary)
+			archive.writestr(f"{self.job_id}.tracemalloc", self.snapshot)
+		return output.getvalue()
+
+
+_profiles = result_cache.ResultCache(max_entries=MAX_PROFILES)    # maps a job id to its Profile
+
+
+def run(algorithm, **kwargs):
+	"""
+	Runs the given algorithm module (algorithm.run(**kwargs)) in the current job (see jobs.submit) with profiling,
+	and keeps the profile of the job, also if the run fails. If the result is a dict, the summary of the profile is added to it.
+	"""
+	job = jobs.current()
+	job_id = job.id if job is not None else "run"
+	_start_tracing()
+	profiler = SamplingProfiler(threading.get_ident())
+	try:
+		with profiler, solver_pool.inline():
+			result = algorithm.run(**kwargs)
+	finally:
+		snapshot, peak_bytes = _stop_tracing()
+		profile = Profile(job_id, profiler, snapshot, peak_bytes)
+		_profiles.put(job_id, profile)
+		logger.info("profile of job %s: %s", job_id, profile.to_dict())
+	if isinstance(result, dict):
+		result = {**result, "profile": {**profile.to_dict(), "download": f"/jobs/{job_id}/profile"}}
+	return result
+
+
+def get(job_id:str)->Profile:
+	"""
+	Returns the profile of the job with the given id, or None if it was not profiled or its profile is no longer kept.
+	"""
+	return _profiles.get(job_id)
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
@@ -0,0 +1,133 @@
+"""
+A cache of allocation results, keyed by a hash of the input rows.
+Running the algorithm again on an unchanged spreadsheet returns the previous result without solving.
+
+Configuration (environment variables):
+ * FAIRWEB_RESULT_CACHE_SIZE - maximum number of results kept in memory (default: 64). 0 disables the cache.
+ * FAIRWEB_RESULT_CACHE_DIR  - if set, results are also kept in this directory, so that they survive restarts and are shared between processes.
+ * FAIRWEB_RESULT_CACHE_DISK_SIZE - maximum number of results kept in the directory (default: 1000).
+"""
+
+import hashlib, json, pickle, threading, os
+from collections import OrderedDict
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES      = int(os.environ.get("FAIRWEB_RESULT_CACHE_SIZE", 64))
+DIRECTORY        = os.environ.get("FAIRWEB_RESULT_CACHE_DIR", None)
+MAX_DISK_ENTRIES = int(os.environ.get("FAIRWEB_RESULT_CACHE_DISK_SIZE", 1000))
+
+
+def key(rows:list, algorithm_name:str, language:str)->str:
+	"""
+	Returns a hash of the given input rows, algorithm name and language.
+	Intermediate results can be cached too, by passing any JSON-serializable input instead of the rows.
+
+	>>> key([['a','1'],['b','2']], "course_allocation", "en") == key([['a','1'],['b','2']], "course_allocation", "en")
+	True
+	>>> key([['a','1'],['b','2']], "course_allocation", "en") == key([['a','1'],['b','3']], "course_allocation", "en")
+	False
+	>>> key([['a','1'],['b','2']], "course_allocation", "en") == key([['a','1'],['b','2']], "course_allocation", "he")
+	False
+	"""
+	text = json.dumps([algorithm_name, language, rows], ensure_ascii=False, default=str)
+	return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+	"""
+	A size-bounded LRU cache in memory, optionally backed by a directory of pickle files.
+
+	>>> cache = ResultCache(max_entries=2)
+	>>> cache.put("k1", 1); cache.put("k2", 2); cache.get("k1")
+	1
+	>>> cache.put("k3", 3)   # evicts k2, which is the least recently used
+	>>> cache.get("k2") is None, cache.get("k1"), cache.get("k3")
+	(True, 1, 3)
+	"""
+	def __init__(self, max_entries:int=MAX_ENTRIES, directory:str=None, max_disk_entries:int=MAX_DISK_ENTRIES):
+		self.max_entries = max_entries
+		self.directory = directory
+		self.max_disk_entries = max_disk_entries
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+		if directory is not None:
+			os.makedirs(directory, exist_ok=True)
+
+	def _path(self, key:str)->str:
+		return os.path.join(self.directory, key+".pickle")
+
+	def get(self, key:str):
+		"""
+		Returns the value stored for the given key, or None if there is none.
+		"""
+		if self.max_entries <= 0:
+			return None
+		with self._lock:
+			if key in self._entries:
+				self._entries.move_to_end(key)
+				return self._entries[key]
+		if self.directory is None:
+			return None
+		try:
+			with open(self._path(key), "rb") as file:
+				value = pickle.load(file)
+			os.utime(self._path(key))   # mark as recently used
+		except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+			return None
+		self._put_in_memory(key, value)
+		return value
+
+	def put(self, key:str, value):
+		if self.max_entries <= 0:
+			return
+		self._put_in_memory(key, value)
+		if self.directory is not None:
+			temporary_path = self._path(key)+f".{os.getpid()}.{threading.get_ident()}"
+			with open(temporary_path, "wb") as file:
+				pickle.dump(value, file)
+			os.replace(temporary_path, self._path(key))
+			self._evict_from_disk()
+
+	def _put_in_memory(self, key:str, value):
+		with self._lock:
+			self._entries[key] = value
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+
+	def _evict_from_disk(self):
+		paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".pickle")]
+		if len(paths) <= self.max_disk_entries:
+			return
+		paths.sort(key=os.path.getmtime)
+		for path in paths[:len(paths)-self.max_disk_entries]:
+			try:
+				os.remove(path)
+			except FileNotFoundError:   # removed by another process
+				pass
+
+
+_cache = ResultCache(directory=DIRECTORY)
+
+
+def get(key:str):
+	"""
+	Returns the cached result for the given key (see function key), or None.
+	"""
+	value = _cache.get(key)
+	logger.info("result cache %s for %s", "miss" if value is None else "hit", key)
+	return value
+
+
+def put(key:str, value):
+	"""
+	Stores the given result for the given key (see function key).
+	"""
+	_cache.put(key, value)
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
@@ -1,33 +1,65 @@
 import gspread
 from bounded_sharing import input, allocate, output
-from gspread_utils import get_or_create_worksheet
+from gspread_utils import write_worksheet, worksheet_has_values, forget_sheet_directory, get_worksheet_by_list_of_possible_names
+import solver_pool, spreadsheets, result_cache, metrics
 
-def run(url:str, language:str="he"):
+INPUT_SHEET_NAMES = input.INPUT_SHEET_NAMES    # for uploaded CSV files (see uploads)
+OUTPUT_SHEET_NAMES = ["output", "תוצאות"]
+
+def run(url:str, language:str="he", spreadsheet=None):
+    """
+    Runs the algorithm on the spreadsheet with the given Google URL or local path (see spreadsheets.open_spreadsheet).
+    Alternatively, an already-opened spreadsheet of either backend can be given.
+    The result includes the duration of each stage and the number of API calls (see metrics).
+    """
+    with metrics.run_scope("bounded_sharing") as measures:
+        result = _run(url, language, spreadsheet)
+    return {**result, **measures.to_dict()}
+
+def _run(url:str, language:str, spreadsheet):
     print("\nOPENING SPREADSHEET")
-    account = gspread.service_account("credentials.json")
-    spreadsheet = account.open_by_url(url)
+    if spreadsheet is None:
+        with metrics.span("open"):
+            spreadsheet = spreadsheets.open_spreadsheet(url)
+    else:
+        forget_sheet_directory(spreadsheet)   # its worksheets may have changed since it was opened
 
     print("\nREADING INPUT DATA")
     rows = input.read_rows(spreadsheet)
-    agents, items, entitlement_normalized_preferences  = input.analyze_rows(rows)
+    with metrics.span("parse"):
+        agents, items, entitlement_normalized_preferences  = input.analyze_rows(rows)
     print("agents: ", agents, "items: ", items)
 
     print("\nCOMPUTING ALLOCATION")
-    map_agent_to_fractions = allocate.allocate(agents, entitlement_normalized_preferences)
-    print("allocation: ", map_agent_to_fractions)
+    cache_key = result_cache.key(rows, "bounded_sharing", language)
+    map_agent_to_fractions = result_cache.get(cache_key)
+    from_cache = map_agent_to_fractions is not None
+    if not from_cache:
+        profile_key = result_cache.key(entitlement_normalized_preferences, "leximin_utility_profile", None)
+        leximin_profile = result_cache.get(profile_key)
+        if leximin_profile is None:
+            with metrics.span("leximin_profile"):
+                leximin_profile = solver_pool.solve(allocate.leximin_utility_profile, entitlement_normalized_preferences)
+            result_cache.put(profile_key, leximin_profile)
+        with metrics.span("allocate"):
+            map_agent_to_fractions = solver_pool.solve(allocate.allocate, agents, entitlement_normalized_preferences, leximin_profile=leximin_profile)
+        result_cache.put(cache_key, map_agent_to_fractions)
+    print("allocation: ", map_agent_to_fractions, "(from cache)" if from_cache else "")
 
     print("\nUPDATING OUTPUT SHEET")
-    new_row_count = len(agents)+2
-    new_col_count = len(items)+5
-    output_sheet = get_or_create_worksheet(spreadsheet, ["output", "תוצאות"], new_row_count, new_col_count)
-    output_sheet.clear()
-    new_cells = output.cells(rows, agents, items, map_agent_to_fractions, language)
-    output_sheet.update_cells(new_cells, value_input_option='USER_ENTERED')
-
-    print("\nFORMATTING OUTPUT SHEET")
+    input_title = get_worksheet_by_list_of_possible_names(spreadsheet, input.INPUT_SHEET_NAMES).title
+    new_values = output.values(rows, agents, items, map_agent_to_fractions, language, input_title=input_title, formulas=spreadsheets.evaluates_formulas(spreadsheet))
+    with metrics.span("compare_output"):
+        up_to_date = from_cache and worksheet_has_values(spreadsheet, OUTPUT_SHEET_NAMES, new_values)
+    if up_to_date:
+        print("The output sheet is already up to date")
+        return {"agents": len(agents), "items": len(items), "from_cache": True}
     first_cell = gspread.utils.rowcol_to_a1(2, 3)
     last_cell = gspread.utils.rowcol_to_a1(len(agents)+2, len(items)+5)
-    output_sheet.format(f"{first_cell}:{last_cell}", {"numberFormat": {"type": "PERCENT", "pattern": "##.#%"}})
+    with metrics.span("write"):
+        write_worksheet(spreadsheet, OUTPUT_SHEET_NAMES, new_values, number_formats={
+            f"{first_cell}:{last_cell}": {"type": "PERCENT", "pattern": "##.#%"}})
+    return {"agents": len(agents), "items": len(items), "from_cache": from_cache}
 
 if __name__=="__main__":
     from bounded_sharing.example_url import EXAMPLE_URL
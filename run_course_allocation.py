@@ -1,36 +1,243 @@
 import gspread
-from courses import input, allocate, output
-from gspread_utils import get_or_create_worksheet
-from fairpy.courses import divide
+from courses import input, allocate, output, incremental, components
+from courses.explanations import check_level, summaries, remember_event_log, DEFAULT_LEVEL
+from gspread_utils import get_or_create_worksheets, update_first_cells, write_worksheet, worksheet_has_values, update_changed_rows, forget_sheet_directory
+from gspread_utils import get_worksheet_by_list_of_possible_names, delete_worksheets, sheet_directory
+from gspread_utils import prepare_worksheet, write_values, replace_first_cells
+import solver_pool, spreadsheets, result_cache, metrics, pipeline
+import asyncio, os
+import numpy as np
 
-def run(url:str, language:str="he"):
+INPUT_SHEET_NAMES = input.INPUT_SHEET_NAMES    # for uploaded CSV files (see uploads)
+OUTPUT_SHEET_NAMES = ["allocation", "חלוקה"]
+SPARSE_OUTPUT = os.environ.get("FAIRWEB_SPARSE_OUTPUT", "") not in ("", "0")   # If set, unallocated courses are left empty instead of 0.
+DECOMPOSE = os.environ.get("FAIRWEB_DECOMPOSE", "") not in ("", "0")   # If set, independent components of the instance are solved separately.
+SUMMARY_SHEET_NAMES = ["explanations", "הסברים"]
+SUMMARY_HEADERS = {"he": ["סטודנט", "הסבר"], "en": ["student", "explanation"]}
+
+def run(url:str, language:str="he", spreadsheet=None, incremental_update:bool=False, explanations:str=None, pipelined:bool=None, decompose:bool=None):
+    """
+    Runs the algorithm on the spreadsheet with the given Google URL or local path (see spreadsheets.open_spreadsheet).
+    Alternatively, an already-opened spreadsheet of either backend can be given.
+    With incremental_update=True, if this process already ran on the same spreadsheet, only the output rows and explanation sheets
+    that changed since that run are rewritten (see courses.incremental). Use it only if the output sheets were not edited by hand.
+    explanations is the explanation level (see courses.explanations; default: FAIRWEB_EXPLANATIONS or "full"):
+    "full" writes an explanation sheet per student, "summary" writes a single sheet with a line per student,
+    "on_demand" keeps the explanations in memory for the /explain route, and "off" skips them.
+    With pipelined=True (default: FAIRWEB_PIPELINE), independent requests overlap (see _run_pipelined); incremental updates are not pipelined.
+    With decompose=True (default: FAIRWEB_DECOMPOSE), groups of students that value disjoint sets of courses are solved in parallel (see courses.components).
+    The result includes the duration of each stage and the number of API calls (see metrics).
+
+    >>> import contextlib, io, tempfile
+    >>> from local_spreadsheet import LocalSpreadsheet
+    >>> from gspread_utils import write_worksheet
+    >>> from benchmarks.generate import course_rows
+    >>> spreadsheet = LocalSpreadsheet(tempfile.mkdtemp())
+    >>> _ = write_worksheet(spreadsheet, input.INPUT_SHEET_NAMES, course_rows(6, 4))
+    >>> with contextlib.redirect_stdout(io.StringIO()):
+    ...     first = run(spreadsheet.path, "en", spreadsheet=spreadsheet, explanations="off")
+    ...     second = run(spreadsheet.path, "en", spreadsheet=spreadsheet, incremental_update=True, explanations="off")
+    >>> first["from_cache"], second["from_cache"]      # the same input: the output sheet is already up to date
+    (False, True)
+    >>> incremental.get_last_run(spreadsheet, "en").output_title     # but the next incremental run can compare with this one
+    'allocation'
+    >>> with contextlib.redirect_stdout(io.StringIO()):
+    ...     _ = run(spreadsheet.path, "en", spreadsheet=spreadsheet, explanations="full")
+    ...     _ = run(spreadsheet.path, "en", spreadsheet=spreadsheet, explanations="summary")
+    >>> [worksheet.title for worksheet in spreadsheet.worksheets()]     # without the sheet of each student
+    ['הערכות', 'allocation', 'explanations']
+    >>> with contextlib.redirect_stdout(io.StringIO()):
+    ...     _ = run(spreadsheet.path, "en", spreadsheet=spreadsheet, explanations="full")     # from the cache, but the sheets are written again
+    >>> [worksheet.title for worksheet in spreadsheet.worksheets()]
+    ['הערכות', 'allocation', 's1', 's2', 's3', 's4', 's5', 's6']
+    """
+    explanations = check_level(explanations or DEFAULT_LEVEL)
+    pipelined = pipeline.PIPELINED if pipelined is None else pipelined
+    decompose = DECOMPOSE if decompose is None else decompose
+    with metrics.run_scope("course_allocation") as measures:
+        if pipelined and not incremental_update:
+            result = asyncio.run(_run_pipelined(url, language, spreadsheet, explanations, decompose))
+        else:
+            result = _run(url, language, spreadsheet, incremental_update, explanations, decompose)
+    return {**result, **measures.to_dict()}
+
+def _cache_key(rows:list, language:str, explanations:str, decompose:bool)->str:
+    algorithm_key = "course_allocation" + ("" if explanations=="full" else f"/{explanations}") + ("/components" if decompose else "")
+    return result_cache.key(rows, algorithm_key, language)
+
+def _allocate(agent_capacities:dict, item_capacities:dict, valuations:dict, explanations:str, decompose:bool)->tuple:
+    if decompose:
+        return components.allocate(allocate.allocate, agent_capacities, item_capacities, valuations, explanations=explanations)
+    return solver_pool.solve(allocate.allocate, agent_capacities, item_capacities, valuations, explanations=explanations)
+
+def _summary_values(agent_capacities:dict, item_capacities:dict, valuations:dict, map_agent_to_bundle:dict, language:str)->list:
+    agents, items = list(agent_capacities.keys()), list(item_capacities.keys())
+    valuation_matrix = np.array([[valuations[agent][item] for item in items] for agent in agents], dtype=float)
+    map_agent_to_summary = summaries(agents, items, np.array(list(agent_capacities.values())), valuation_matrix, map_agent_to_bundle, language)
+    return [SUMMARY_HEADERS[language]] + [[agent, summary] for agent,summary in map_agent_to_summary.items()]
+
+def _delete_other_explanations(spreadsheet, agents:list, explanations:str):
+    """
+    Deletes the explanation sheets of the other explanation levels (e.g. the sheet of each student, written by an earlier run
+    with explanations="full", when explanations="summary"), since they no longer match the allocation.
+    """
+    names = [] if explanations=="summary" else list(SUMMARY_SHEET_NAMES)
+    if explanations!="full":
+        names += [agent for agent in agents if agent not in INPUT_SHEET_NAMES+OUTPUT_SHEET_NAMES+SUMMARY_SHEET_NAMES]
+    deleted = delete_worksheets(spreadsheet, names)
+    if len(deleted)>0:
+        print("deleted explanation sheets of another level: ", deleted)
+
+def _missing_explanation_sheets(spreadsheet, agents:list, explanations:str)->list:
+    """
+    Returns the titles of the explanation sheets of the given level that are not in the spreadsheet
+    (e.g. since an earlier run at another level deleted them).
+    """
+    directory = sheet_directory(spreadsheet)
+    if explanations=="full":
+        return [agent for agent in agents if directory.find(agent) is None]
+    if explanations=="summary" and all(directory.find(name) is None for name in SUMMARY_SHEET_NAMES):
+        return SUMMARY_SHEET_NAMES[:1]
+    return []
+
+def _run(url:str, language:str, spreadsheet, incremental_update:bool, explanations:str, decompose:bool):
     print("\nOPENING SPREADSHEET")
-    account = gspread.service_account("credentials.json")
-    spreadsheet = account.open_by_url(url)
+    if spreadsheet is None:
+        with metrics.span("open"):
+            spreadsheet = spreadsheets.open_spreadsheet(url)
+    else:
+        forget_sheet_directory(spreadsheet)   # its worksheets may have changed since it was opened
 
     print("\nREADING INPUT DATA")
     rows = input.read_rows(spreadsheet)
-    agent_capacities, item_capacities, valuations  = input.analyze_rows(rows)
+    with metrics.span("parse"):
+        agent_capacities, item_capacities, valuations  = input.analyze_rows(rows)
     print("agent_capacities: ", agent_capacities, "item_capacities: ", item_capacities)
 
     print("\nCOMPUTING ALLOCATION")
-    map_agent_to_bundle, map_agent_to_explanation = allocate.allocate(agent_capacities, item_capacities, valuations)
-    print("allocation: ", map_agent_to_bundle)
+    cache_key = _cache_key(rows, language, explanations, decompose)
+    result = result_cache.get(cache_key)
+    from_cache = result is not None
+    if not from_cache:
+        with metrics.span("allocate"):
+            result = _allocate(agent_capacities, item_capacities, valuations, explanations, decompose)
+        result_cache.put(cache_key, result)
+    return _update_output(spreadsheet, language, rows, agent_capacities, item_capacities, valuations, result, from_cache, incremental_update, explanations)
+
+def _update_output(spreadsheet, language:str, rows:list, agent_capacities:dict, item_capacities:dict, valuations:dict, result:tuple, from_cache:bool, incremental_update:bool, explanations:str):
+    map_agent_to_bundle, allocation_explanations = result
+    print("allocation: ", map_agent_to_bundle, "(from cache)" if from_cache else "")
+    if explanations=="on_demand":
+        remember_event_log(spreadsheet.id, language, allocation_explanations)
+    map_agent_to_explanation = allocation_explanations if explanations=="full" else {}
 
     print("\nUPDATING OUTPUT SHEET")
-    new_row_count = len(agent_capacities)+2
-    new_col_count = len(item_capacities)+5
-    output_sheet = get_or_create_worksheet(spreadsheet, ["allocation", "חלוקה"], new_row_count, new_col_count)
-    output_sheet.clear()
-    new_cells = output.cells(rows, agent_capacities, item_capacities, map_agent_to_bundle, map_agent_to_explanation, language)
-    output_sheet.update_cells(new_cells, value_input_option='USER_ENTERED')
+    with metrics.span("write_explanations"):
+        _delete_other_explanations(spreadsheet, list(agent_capacities.keys()), explanations)
+    new_values = output.values(rows, agent_capacities, item_capacities, map_agent_to_bundle, map_agent_to_explanation, language, sparse=SPARSE_OUTPUT, formulas=spreadsheets.evaluates_formulas(spreadsheet))
+    last_run = incremental.get_last_run(spreadsheet, language) if incremental_update else None
+    if last_run is not None and len(last_run.output_values)==len(new_values) and len(last_run.output_values[0])==len(new_values[0]):
+        changes = incremental.changed_input(last_run.rows, rows)
+        print("changed agents: ", changes["agents"], "changed items: ", changes["items"])
+        with metrics.span("write"):
+            changed_rows = update_changed_rows(spreadsheet, last_run.output_title, new_values, last_run.output_values)
+        output_title = last_run.output_title
+        missing = _missing_explanation_sheets(spreadsheet, list(map_agent_to_explanation.keys()), explanations)
+        changed_explanations = {
+            agent: explanation for agent,explanation in map_agent_to_explanation.items()
+            if last_run.map_agent_to_explanation.get(agent, None)!=explanation or agent in missing}
+        print(f"rewritten {len(changed_rows)} output rows and {len(changed_explanations)} explanation sheets")
+        result = {"changed_agents": changes["agents"], "changed_items": changes["items"], "changed_output_rows": len(changed_rows)}
+    else:
+        with metrics.span("compare_output"):
+            up_to_date = from_cache and len(_missing_explanation_sheets(spreadsheet, list(agent_capacities.keys()), explanations))==0 \
+                and worksheet_has_values(spreadsheet, OUTPUT_SHEET_NAMES, new_values)
+        if up_to_date:
+            print("The output sheet is already up to date")
+            if incremental_update:    # so that the next incremental run compares with this one
+                output_title = get_worksheet_by_list_of_possible_names(spreadsheet, OUTPUT_SHEET_NAMES).title
+                incremental.put_last_run(spreadsheet, language, incremental.LastRun(rows, output_title, new_values, map_agent_to_explanation))
+            return {"agents": len(agent_capacities), "items": len(item_capacities), "from_cache": True}
+        with metrics.span("write"):
+            output_title = write_worksheet(spreadsheet, OUTPUT_SHEET_NAMES, new_values)
+        changed_explanations = map_agent_to_explanation
+        result = {}
 
     print("\nUPDATING EXPLANATION SHEETS")
-    for agent,explanation in map_agent_to_explanation.items():
-        agent_explanation_sheet = get_or_create_worksheet(spreadsheet, [agent], 1, 1)
-        agent_explanation_sheet.clear()
+    for agent,explanation in changed_explanations.items():
         print(agent, ": ", explanation)
-        agent_explanation_sheet.update_cell(1, 1, explanation)
+    with metrics.span("write_explanations"):
+        if len(changed_explanations)>0:
+            get_or_create_worksheets(spreadsheet, list(changed_explanations.keys()), 1, 1)
+        update_first_cells(spreadsheet, changed_explanations)
+    if explanations=="summary":
+        with metrics.span("write_explanations"):
+            write_worksheet(spreadsheet, SUMMARY_SHEET_NAMES, _summary_values(agent_capacities, item_capacities, valuations, map_agent_to_bundle, language))
+    if incremental_update:
+        incremental.put_last_run(spreadsheet, language, incremental.LastRun(rows, output_title, new_values, map_agent_to_explanation))
+    return {"agents": len(agent_capacities), "items": len(item_capacities), "from_cache": from_cache, "explanations": explanations, **result}
+
+async def _run_pipelined(url:str, language:str, spreadsheet, explanations:str, decompose:bool):
+    """
+    Does the same as _run (without incremental updates), but overlaps independent requests (see pipeline):
+     * the worksheet list is fetched while the input is read;
+     * while the allocation is computed, the output and explanation sheets are created or enlarged;
+     * then the output and the explanations are written at the same time, each worksheet cleared in the same request as it is written.
+    As in _run, if the allocation fails, the previous output stays as it was.
+    """
+    print("\nOPENING SPREADSHEET")
+    if spreadsheet is None:
+        with metrics.span("open"):
+            spreadsheet = await asyncio.to_thread(spreadsheets.open_spreadsheet, url)
+    else:
+        forget_sheet_directory(spreadsheet)   # its worksheets may have changed since it was opened
+    sheets = pipeline.AsyncSpreadsheet(spreadsheet)
+
+    print("\nREADING INPUT DATA")
+    rows = await sheets.read_input(input.read_rows, guessed_title=input.INPUT_SHEET_NAMES[0 if language=="he" else 1])
+    with metrics.span("parse"):
+        agent_capacities, item_capacities, valuations  = input.analyze_rows(rows)
+    print("agent_capacities: ", agent_capacities, "item_capacities: ", item_capacities)
+
+    print("\nCOMPUTING ALLOCATION")
+    cache_key = _cache_key(rows, language, explanations, decompose)
+    result = result_cache.get(cache_key)
+    if result is not None:     # there is nothing to overlap, and the output may be up to date
+        return await asyncio.to_thread(_update_output, spreadsheet, language, rows, agent_capacities, item_capacities, valuations, result, True, False, explanations)
+
+    agents = list(agent_capacities.keys())
+    async def solve():
+        with metrics.span("allocate"):
+            return await asyncio.to_thread(_allocate, agent_capacities, item_capacities, valuations, explanations, decompose)
+    async def prepare_explanation_sheets():
+        await sheets.call(_delete_other_explanations, agents, explanations)
+        if explanations=="full":
+            await sheets.call(get_or_create_worksheets, agents, 1, 1)
+        elif explanations=="summary":
+            return await sheets.call(prepare_worksheet, SUMMARY_SHEET_NAMES, len(agents)+1, len(SUMMARY_HEADERS[language]), clear=False)
+    async def prepare():
+        with metrics.span("prepare_output"):
+            return await asyncio.gather(
+                sheets.call(prepare_worksheet, OUTPUT_SHEET_NAMES, *output.size(agent_capacities, item_capacities), clear=False),
+                prepare_explanation_sheets())
+    result, (output_sheet, summary_sheet) = await asyncio.gather(solve(), prepare())
+    result_cache.put(cache_key, result)
+    map_agent_to_bundle, allocation_explanations = result
+    print("allocation: ", map_agent_to_bundle)
+    if explanations=="on_demand":
+        remember_event_log(spreadsheet.id, language, allocation_explanations)
+    map_agent_to_explanation = allocation_explanations if explanations=="full" else {}
+
+    print("\nUPDATING OUTPUT AND EXPLANATION SHEETS")
+    new_values = output.values(rows, agent_capacities, item_capacities, map_agent_to_bundle, map_agent_to_explanation, language, sparse=SPARSE_OUTPUT, formulas=spreadsheets.evaluates_formulas(spreadsheet))
+    writes = [sheets.call(write_values, output_sheet, new_values, clear=True)]
+    if explanations=="full":
+        writes.append(sheets.call(replace_first_cells, map_agent_to_explanation))
+    elif explanations=="summary":
+        writes.append(sheets.call(write_values, summary_sheet, _summary_values(agent_capacities, item_capacities, valuations, map_agent_to_bundle, language), clear=True))
+    with metrics.span("write"):
+        await asyncio.gather(*writes)
+    return {"agents": len(agent_capacities), "items": len(item_capacities), "from_cache": False, "explanations": explanations, "pipelined": True}
 
     # print("\nFORMATTING OUTPUT SHEET")
     # first_cell = gspread.utils.rowcol_to_a1(2, 3)
@@ -0,0 +1,58 @@
+import gspread
+from courses import input, compare
+from gspread_utils import write_worksheet, forget_sheet_directory
+import spreadsheets, metrics
+
+INPUT_SHEET_NAMES = input.INPUT_SHEET_NAMES    # for uploaded CSV files (see uploads)
+OUTPUT_SHEET_NAMES = ["comparison", "השוואה"]
+
+TEXTS = {
+    "header": {
+        "he": ["אלגוריתם", "זרע", "תועלת כוללת", "תועלת מינימלית", "תועלת ממוצעת", "שניות", "שניות מעבד", "שגיאה"],
+        "en": ["algorithm", "seed", "utilitarian welfare", "egalitarian welfare", "mean utility", "seconds", "CPU seconds", "error"],
+    },
+}
+
+def run(url:str, language:str="he", spreadsheet=None, algorithms:list=None, seeds:int=1):
+    """
+    Runs several course-allocation algorithms (default: all in courses.compare.ALGORITHMS), each with the given number of
+    tie-breaking seeds, on the spreadsheet with the given URL or local path, and writes a comparison worksheet with their
+    welfare metrics and running times, the best first.
+    """
+    with metrics.run_scope("course_comparison") as measures:
+        result = _run(url, language, spreadsheet, algorithms or compare.ALGORITHMS, list(range(seeds)))
+    return {**result, **measures.to_dict()}
+
+def _run(url:str, language:str, spreadsheet, algorithms:list, seeds:list):
+    print("\nOPENING SPREADSHEET")
+    if spreadsheet is None:
+        with metrics.span("open"):
+            spreadsheet = spreadsheets.open_spreadsheet(url)
+    else:
+        forget_sheet_directory(spreadsheet)   # its worksheets may have changed since it was opened
+
+    print("\nREADING INPUT DATA")
+    rows = input.read_rows(spreadsheet)
+    with metrics.span("parse"):
+        agent_capacities, item_capacities, valuations  = input.analyze_rows(rows)
+
+    print("\nCOMPARING ALGORITHMS")
+    with metrics.span("allocate"):
+        reports = compare.compare(agent_capacities, item_capacities, valuations, algorithms, seeds)
+    for report in reports:
+        print(report["algorithm"], report["seed"], {key: value for key,value in report.items() if key not in ("algorithm", "seed", "allocation")})
+
+    print("\nUPDATING COMPARISON SHEET")
+    new_values = [TEXTS["header"][language]] + [
+        [report["algorithm"], report["seed"], report.get("utilitarian"), report.get("egalitarian"), report.get("mean_utility"),
+         report.get("seconds"), report.get("cpu_seconds"), report.get("error")]
+        for report in reports]
+    with metrics.span("write"):
+        write_worksheet(spreadsheet, OUTPUT_SHEET_NAMES, new_values, number_formats={
+            f"C2:G{len(new_values)}": {"type": "NUMBER", "pattern": "0.00"}})
+    return {"agents": len(agent_capacities), "items": len(item_capacities),
+        "variants": [{key: value for key,value in report.items() if key!="allocation"} for report in reports]}
+
+if __name__=="__main__":
+    from courses.example_url import EXAMPLE_URL
+    run(EXAMPLE_URL)
@@ -0,0 +1,154 @@
+"""
+A process-wide scheduler for Sheets API requests. It is used by the HTTP client of gspread_client, so all requests pass through it.
+
+ * Rate limiting: requests are sent at most at the rate of the project quota, using a token bucket.
+ * Retries: a request that fails with HTTP 429 (rate limit) or 5xx is retried with exponential backoff and jitter,
+   or after the delay given in the Retry-After header.
+ * Coalescing: identical GET requests that are in flight at the same time are sent once, and all callers get the same response.
+
+Configuration (environment variables):
+ * FAIRWEB_SHEETS_REQUESTS_PER_MINUTE - the sustained request rate (default: 60, the default per-user quota of the Sheets API).
+ * FAIRWEB_SHEETS_BURST - the number of requests that can be sent at once after an idle period (default: 10).
+ * FAIRWEB_SHEETS_MAX_ATTEMPTS - the maximum number of attempts of a single request (default: 6).
+"""
+
+import concurrent.futures, random, threading, time, os
+import logging
+
+logger = logging.getLogger(__name__)
+
+REQUESTS_PER_MINUTE = float(os.environ.get("FAIRWEB_SHEETS_REQUESTS_PER_MINUTE", 60))
+BURST               = int(os.environ.get("FAIRWEB_SHEETS_BURST", 10))
+MAX_ATTEMPTS        = int(os.environ.get("FAIRWEB_SHEETS_MAX_ATTEMPTS", 6))
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 64
+
+
+class TokenBucket:
+	"""
+	Allows bursts of up to `capacity` events, and on average `rate` events per second.
+
+	>>> bucket = TokenBucket(rate=1000, capacity=2)
+	>>> bucket.acquire(), bucket.acquire()     # the burst is immediate
+	(0.0, 0.0)
+	>>> 0 < bucket.acquire() < 0.01             # the next one waits for a new token
+	True
+	"""
+	def __init__(self, rate:float, capacity:int):
+		self.rate = rate
+		self.capacity = capacity
+		self._tokens = float(capacity)
+		self._updated_at = time.monotonic()
+		self._lock = threading.Lock()
+
+	def acquire(self)->float:
+		"""
+		Waits until a token is available and takes it. Returns the number of seconds waited.
+		"""
+		with self._lock:
+			now = time.monotonic()
+			self._tokens = min(self.capacity, self._tokens + (now-self._updated_at)*self.rate)
+			self._updated_at = now
+			self._tokens -= 1      # may become negative: the waiting time is reserved for this caller
+			wait = 0.0 if self._tokens >= 0 else -self._tokens/self.rate
+		if wait > 0:
+			time.sleep(wait)
+		return wait
+
+
+def status_code(error:Exception)->int:
+	"""
+	Returns the HTTP status code of the given error (e.g. a gspread.exceptions.APIError), or None if it has none.
+	"""
+	return getattr(getattr(error, "response", None), "status_code", None)
+
+
+def retry_delay(error:Exception, attempt:int)->float:
+	"""
+	Returns the number of seconds to wait before retrying after the given error in the given (0-based) attempt,
+	or None if the error should not be retried.
+	Uses the Retry-After header if the server sent one, and otherwise truncated exponential backoff with full jitter.
+
+	>>> class Response: status_code = 429; headers = {"Retry-After": "7"}
+	>>> class Error(Exception): response = Response()
+	>>> retry_delay(Error(), 0)
+	7.0
+	>>> Response.headers = {}
+	>>> 0 <= retry_delay(Error(), 3) <= 8
+	True
+	>>> Response.status_code = 400
+	>>> retry_delay(Error(), 0) is None, retry_delay(ValueError(), 0) is None
+	(True, True)
+	"""
+	if status_code(error) not in RETRYABLE_STATUS_CODES:
+		return None
+	retry_after = getattr(error.response, "headers", {}).get("Retry-After", None)
+	if retry_after is not None and retry_after.isdigit():
+		return float(retry_after)
+	return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt))
+
+
+class Scheduler:
+	"""
+	Sends requests through a token bucket, with retries and coalescing of identical reads (see the module docstring).
+	"""
+	def __init__(self, requests_per_minute:float=REQUESTS_PER_MINUTE, burst:int=BURST, max_attempts:int=MAX_ATTEMPTS):
+		self.bucket = TokenBucket(requests_per_minute/60, burst)
+		self.max_attempts = max_attempts
+		self._in_flight = {}     # maps a coalescing key to the future of the request that is being sent
+		self._lock = threading.Lock()
+
+	def call(self, send, coalescing_key=None):
+		"""
+		Calls send() (which sends a single request and returns its response) under the rate limit, with retries.
+		If coalescing_key is given and a call with the same key is in flight, waits for it and returns its response instead.
+		"""
+		if coalescing_key is None:
+			return self._call_with_retries(send)
+		with self._lock:
+			future = self._in_flight.get(coalescing_key, None)
+			is_leader = future is None
+			if is_leader:
+				future = self._in_flight[coalescing_key] = concurrent.futures.Future()
+		if not is_leader:
+			logger.debug("coalesced request %s", coalescing_key)
+			return future.result()
+		try:
+			response = self._call_with_retries(send)
+			future.set_result(response)
+			return response
+		except BaseException as error:
+			future.set_exception(error)
+			raise
+		finally:
+			with self._lock:
+				del self._in_flight[coalescing_key]
+
+	def _call_with_retries(self, send):
+		for attempt in range(self.max_attempts):
+			self.bucket.acquire()
+			try:
+				return send()
+			except Exception as error:
+				delay = retry_delay(error, attempt)
+				if delay is None or attempt+1 >= self.max_attempts:
+					raise
+				logger.warning("Sheets API returned HTTP %s; retrying in %.1f seconds", status_code(error), delay)
+				time.sleep(delay)
+
+
+_scheduler = Scheduler()
+
+
+def call(send, coalescing_key=None):
+	"""
+	Calls send() through the process-wide scheduler (see Scheduler.call).
+	"""
+	return _scheduler.call(send, coalescing_key)
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
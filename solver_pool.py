@@ -0,0 +1,230 @@
+"""
+A pool of worker processes for the CPU-bound allocation step.
+Solving in a separate process keeps the GIL of the web worker free for other requests.
+
+Configuration (environment variables):
+ * FAIRWEB_SOLVER_PROCESSES - number of worker processes (default: number of CPUs). 0 means: solve in the calling thread (as within inline()).
+ * FAIRWEB_SOLVER_CPU_SECONDS - CPU time limit per solve (default: 600). 0 means: no limit.
+ * FAIRWEB_SOLVER_JOBS_PER_PROCESS - a worker process is replaced by a fresh one after this many solves (default: 20).
+   Requires Python 3.11 or later; on earlier versions, worker processes are not replaced.
+"""
+
+import concurrent.futures, contextlib, contextvars, multiprocessing, threading, pickle, signal, sys, os
+import logging
+import jobs
+
+try:
+	import resource
+except ImportError:   # not available on Windows
+	resource = None
+
+logger = logging.getLogger(__name__)
+
+PROCESSES        = int(os.environ.get("FAIRWEB_SOLVER_PROCESSES", os.cpu_count() or 1))
+CPU_SECONDS      = float(os.environ.get("FAIRWEB_SOLVER_CPU_SECONDS", 600))
+JOBS_PER_PROCESS = int(os.environ.get("FAIRWEB_SOLVER_JOBS_PER_PROCESS", 20))
+
+POLL_SECONDS = 0.5    # How often a waiting job checks whether it was cancelled.
+CPU_GRACE_SECONDS = 5 # The hard CPU limit is this much above the soft one, for a solver that does not return to Python code.
+
+
+class CpuTimeLimitExceeded(Exception):
+	pass
+
+
+def _call_with_cpu_limit(cpu_seconds:float, function, args, kwargs):
+	"""
+	Runs in the worker process. Calls function(*args, **kwargs), limiting the CPU time it may use.
+
+	At the soft limit, the kernel sends SIGXCPU, whose handler raises CpuTimeLimitExceeded; but a Python signal handler runs
+	only between bytecodes, so a solver that is stuck in C code (e.g. a linear program) is killed by the hard limit a few seconds later.
+	Since a process cannot raise its hard limit again, the call runs in a child process forked from the worker
+	(which keeps the modules that the worker has imported), and its result or exception is sent back through a pipe.
+
+	>>> _call_with_cpu_limit(1, sum, ([1,2,3],), {})
+	6
+	>>> _call_with_cpu_limit(1, sum, ([1,"x"],), {})
+	Traceback (most recent call last):
+	...
+	TypeError: unsupported operand type(s) for +: 'int' and 'str'
+	"""
+	if not cpu_seconds or resource is None:
+		return function(*args, **kwargs)
+	read_fd, write_fd = os.pipe()
+	pid = os.fork()
+	if pid==0:    # the child
+		try:
+			os.close(read_fd)
+			soft = int(cpu_seconds) + 1    # the CPU time of a forked process starts from 0
+			_, hard = resource.getrlimit(resource.RLIMIT_CPU)
+			if hard != resource.RLIM_INFINITY:
+				soft = min(soft, hard)
+			def raise_cpu_time_limit_exceeded(signum, frame):
+				raise CpuTimeLimitExceeded(f"The solver used more than {cpu_seconds:g} CPU seconds")
+			signal.signal(signal.SIGXCPU, raise_cpu_time_limit_exceeded)
+			resource.setrlimit(resource.RLIMIT_CPU, (soft, soft+CPU_GRACE_SECONDS if hard==resource.RLIM_INFINITY else min(soft+CPU_GRACE_SECONDS, hard)))
+			try:
+				outcome = (True, function(*args, **kwargs))
+			except BaseException as error:
+				outcome = (False, error)
+			try:
+				data = pickle.dumps(outcome)
+			except Exception as error:
+				data = pickle.dumps((False, RuntimeError(f"The result of the solver cannot be sent back: {error!r}")))
+			with os.fdopen(write_fd, "wb") as pipe:
+				pipe.write(data)
+		finally:
+			os._exit(0)
+	os.close(write_fd)
+	with os.fdopen(read_fd, "rb") as pipe:
+		data = pipe.read()
+	_, status = os.waitpid(pid, 0)
+	if not data:
+		if os.WIFSIGNALED(status) and os.WTERMSIG(status) in (signal.SIGKILL, signal.SIGXCPU):
+			raise CpuTimeLimitExceeded(f"The solver used more than {cpu_seconds:g} CPU seconds, and was killed")
+		raise RuntimeError(f"The solver process ended without a result (wait status {status})")
+	succeeded, value = pickle.loads(data)
+	if not succeeded:
+		raise value
+	return value
+
+
+_pool = None
+_lock = threading.Lock()
+_inline = contextvars.ContextVar("solve_inline", default=False)
+
+
+@contextlib.contextmanager
+def inline():
+	"""
+	In the body of the with statement (and in the threads it starts with asyncio.to_thread),
+	solves run in the calling thread rather than in a worker process, e.g. so that they can be profiled (see profiling).
+	The CPU time limit does not apply to them.
+	"""
+	token = _inline.set(True)
+	try:
+		yield
+	finally:
+		_inline.reset(token)
+
+
+def _get_pool()->concurrent.futures.ProcessPoolExecutor:
+	global _pool
+	with _lock:
+		if _pool is None:
+			# Worker recycling does not work with "fork", and "forkserver" starts new workers faster than "spawn".
+			method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+			kwargs = {"max_tasks_per_child": JOBS_PER_PROCESS} if sys.version_info >= (3,11) and JOBS_PER_PROCESS>0 else {}
+			if JOBS_PER_PROCESS>0 and sys.version_info < (3,11):
+				logger.warning("FAIRWEB_SOLVER_JOBS_PER_PROCESS requires Python 3.11 or later; worker processes will not be replaced")
+			_pool = concurrent.futures.ProcessPoolExecutor(max_workers=PROCESSES, mp_context=multiprocessing.get_context(method), **kwargs)
+			logger.info("started a solver pool with %d processes", PROCESSES)
+		return _pool
+
+
+def _discard_broken_pool(pool):
+	global _pool
+	with _lock:
+		if _pool is pool:
+			_pool = None
+
+
+def submit(function, *args, **kwargs)->concurrent.futures.Future:
+	"""
+	Sends function(*args, **kwargs) to a worker process, and returns a future for its result.
+	The function and its arguments must be picklable (e.g. a module-level function).
+	"""
+	return _get_pool().submit(_call_with_cpu_limit, CPU_SECONDS, function, args, kwargs)
+
+
+def solve(function, *args, **kwargs):
+	"""
+	Calls function(*args, **kwargs) in a worker process, and waits for the result.
+
+	If the current job is cancelled while waiting, raises jobs.JobCancelled.
+	A solve that has not started yet is removed from the queue;
+	a solve that has already started cannot be interrupted, so its result is discarded
+	(it is still bounded by the CPU time limit).
+
+	>>> solve(sum, [1,2,3])
+	6
+	"""
+	if PROCESSES <= 0 or _inline.get():
+		return function(*args, **kwargs)
+	pool = _get_pool()
+	future = pool.submit(_call_with_cpu_limit, CPU_SECONDS, function, args, kwargs)
+	try:
+		return wait(future)
+	except concurrent.futures.process.BrokenProcessPool:
+		# A worker was killed (e.g. out of memory) - start a new pool for the next solve.
+		_discard_broken_pool(pool)
+		raise
+
+
+def solve_many(function, list_of_args:list, return_exceptions:bool=False, **kwargs)->list:
+	"""
+	Calls function(*args, **kwargs) for each tuple args in list_of_args, in parallel worker processes,
+	and returns the list of results (in the same order).
+	If one of the calls fails or the current job is cancelled, the calls that have not started yet are removed from the queue.
+	With return_exceptions=True, a call that fails returns its exception instead, and the other calls go on
+	(but a cancellation of the current job is still raised).
+
+	>>> solve_many(sum, [([1,2],), ([3,4],)])
+	[3, 7]
+	>>> results = solve_many(sum, [([1,2],), ([3,"x"],)], return_exceptions=True)
+	>>> results[0], type(results[1]).__name__
+	(3, 'TypeError')
+	"""
+	def result_or_exception(get_result):
+		try:
+			return get_result()
+		except jobs.JobCancelled:
+			raise
+		except Exception as error:
+			if isinstance(error, concurrent.futures.process.BrokenProcessPool):
+				_discard_broken_pool(pool)
+			if not return_exceptions:
+				raise
+			return error
+	if PROCESSES <= 0 or _inline.get():
+		pool = None
+		return [result_or_exception(lambda: function(*args, **kwargs)) for args in list_of_args]
+	pool = _get_pool()
+	futures = [pool.submit(_call_with_cpu_limit, CPU_SECONDS, function, args, kwargs) for args in list_of_args]
+	try:
+		return [result_or_exception(lambda: wait(future)) for future in futures]
+	finally:
+		for future in futures:
+			future.cancel()    # has no effect on calls that have started or finished
+
+
+def wait(future:concurrent.futures.Future):
+	"""
+	Waits for the result of the given future of a worker process.
+	If the current job is cancelled while waiting, cancels the future (if it has not started) and raises jobs.JobCancelled.
+	"""
+	job = jobs.current()
+	while True:
+		try:
+			return future.result(timeout=POLL_SECONDS)
+		except concurrent.futures.TimeoutError:
+			if job is not None and job.cancel_requested.is_set():
+				if not future.cancel():
+					logger.info("job %s was cancelled while solving; its result will be discarded", job.id)
+				raise jobs.JobCancelled()
+
+
+def shutdown():
+	"""
+	Stops all worker processes, cancelling solves that have not started yet.
+	"""
+	global _pool
+	with _lock:
+		if _pool is not None:
+			_pool.shutdown(wait=False, cancel_futures=True)
+			_pool = None
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
@@ -0,0 +1,90 @@
+"""
+Opens a spreadsheet from either of the two backends:
+ * a Google spreadsheet, given by its URL (through gspread_client);
+ * a local spreadsheet, given by a path to a directory of CSV files, an XLSX file or an SQLite file (see local_spreadsheet).
+
+Both backends provide the same subset of the gspread API:
+worksheets(), worksheet(title), add_worksheet(title, rows, cols), fetch_sheet_metadata(), batch_update(body),
+values_get(range, params), values_batch_get(ranges, params), values_batch_clear(body=...) and values_batch_update(body) on the spreadsheet;
+title, id, row_count, col_count, get_all_values(), get_values(...), clear(), update_cells(...), update_cell(...),
+format(...), add_rows(n) and add_cols(n) on its worksheets.
+"""
+
+import os
+
+
+def is_local(url:str)->bool:
+	"""
+	>>> is_local("https://docs.google.com/spreadsheets/d/1tJPV"), is_local("instances/coalition"), is_local("file:///tmp/a.xlsx")
+	(False, True, True)
+	"""
+	return not url.startswith(("http://", "https://"))
+
+
+def _local_path(url:str)->str:
+	path = url[len("file://"):] if url.startswith("file://") else url
+	return os.path.expanduser(path)
+
+
+def spreadsheet_id(url:str)->str:
+	"""
+	Returns the id of the spreadsheet with the given Google URL or local path (the same as the id of the opened spreadsheet),
+	without opening it.
+
+	>>> spreadsheet_id("https://docs.google.com/spreadsheets/d/1tJPV/edit#gid=0"), spreadsheet_id("file:///tmp/a.xlsx")
+	('1tJPV', '/tmp/a.xlsx')
+	"""
+	if is_local(url):
+		return _local_path(url)
+	else:
+		import gspread
+		return gspread.utils.extract_id_from_url(url)
+
+
+def evaluates_formulas(spreadsheet)->bool:
+	"""
+	Returns True if the given spreadsheet computes the formulas written to it (a Google spreadsheet).
+	A local spreadsheet keeps formulas as text, and so do its files and the packaged outputs of uploads (see uploads.package),
+	so the algorithms write computed values to it instead.
+
+	>>> from local_spreadsheet import LocalSpreadsheet
+	>>> evaluates_formulas(LocalSpreadsheet("upload:x", in_memory=True))
+	False
+	"""
+	from local_spreadsheet import LocalSpreadsheet
+	return not isinstance(spreadsheet, LocalSpreadsheet)
+
+
+def open_spreadsheet(url:str, simulated_latency:float=0.0):
+	"""
+	Opens the spreadsheet with the given Google URL or local path.
+	simulated_latency is used only for local spreadsheets.
+	A Google spreadsheet may be an object that was opened by an earlier run (see gspread_client.open_by_url),
+	so its worksheet directory is fetched again (see gspread_utils.sheet_directory): its worksheets may have been changed by hand since.
+
+	>>> import gspread_client, gspread_utils, tempfile, time
+	>>> from local_spreadsheet import LocalSpreadsheet
+	>>> cached = LocalSpreadsheet(tempfile.mkdtemp())
+	>>> _ = cached.add_worksheet("input", 1, 1); output = cached.add_worksheet("output", 1, 1)
+	>>> url = "https://docs.google.com/spreadsheets/d/cached/edit"
+	>>> gspread_client._map_key_to_spreadsheet["cached"] = (cached, time.monotonic())
+	>>> gspread_utils.get_worksheet_by_list_of_possible_names(open_spreadsheet(url), ["output"])
+	<LocalWorksheet 'output' id:1>
+	>>> _ = cached.batch_update({"requests": [{"deleteSheet": {"sheetId": output.id}}]})    # between two runs
+	>>> gspread_utils.get_worksheet_by_list_of_possible_names(open_spreadsheet(url), ["output"]) is None
+	True
+	"""
+	from gspread_utils import forget_sheet_directory
+	if is_local(url):
+		from local_spreadsheet import LocalSpreadsheet
+		return LocalSpreadsheet(_local_path(url), simulated_latency=simulated_latency)
+	else:
+		import gspread_client
+		spreadsheet = gspread_client.open_by_url(url)
+		forget_sheet_directory(spreadsheet)
+		return spreadsheet
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())
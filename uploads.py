@@ -0,0 +1,125 @@
+"""
+Running an algorithm on an uploaded CSV or XLSX file, instead of a Google spreadsheet.
+
+The file is parsed one row at a time into a LocalSpreadsheet that is kept in memory, with no Sheets API requests:
+a CSV file becomes the input worksheet of the algorithm, and an XLSX file keeps its worksheets (and their titles).
+The algorithm runs on it as a background job, and then its output worksheets (e.g. the allocation and the explanation
+sheets of the students) are packaged as a single XLSX workbook or as a zip of CSV files, one per worksheet,
+which can be downloaded from /jobs/<job-id>/download.
+
+Configuration (environment variables):
+ * FAIRWEB_UPLOAD_MAX_BYTES - the maximum size of an uploaded file (default: 16 MB).
+ * FAIRWEB_UPLOAD_DOWNLOADS - the number of packaged outputs kept in memory (default: 16). Older ones are forgotten.
+"""
+
+import io, os, uuid, zipfile
+import logging
+import jobs, result_cache
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES     = int(os.environ.get("FAIRWEB_UPLOAD_MAX_BYTES", 16*1024*1024))
+MAX_DOWNLOADS = int(os.environ.get("FAIRWEB_UPLOAD_DOWNLOADS", 16))
+
+FORMATS = {    # maps a download format to its MIME type
+	"xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+	"zip":  "application/zip",
+}
+
+
+def input_title(algorithm, language:str)->str:
+	"""
+	Returns the title of the input worksheet of the given algorithm module, for an uploaded CSV file.
+	An algorithm lists the possible titles in INPUT_SHEET_NAMES, the Hebrew title first (as in courses.input).
+
+	>>> class Algorithm: INPUT_SHEET_NAMES = ["הערכות", "valuations"]
+	>>> input_title(Algorithm, "en"), input_title(Algorithm, "he")
+	('valuations', 'הערכות')
+	"""
+	names = getattr(algorithm, "INPUT_SHEET_NAMES", None)
+	if not names:
+		raise ValueError(f"The algorithm {getattr(algorithm, '__name__', algorithm)} does not accept uploaded CSV files; upload an XLSX file instead")
+	return names[0] if language=="he" else names[-1]
+
+
+def open_upload(file, filename:str, algorithm, language:str)->"LocalSpreadsheet":
+	"""
+	Returns an in-memory spreadsheet with the contents of the given uploaded file (a binary file object, e.g. a werkzeug FileStorage stream).
+	A CSV file (in UTF-8) becomes the input worksheet of the given algorithm module (see input_title).
+
+	>>> class Algorithm: INPUT_SHEET_NAMES = ["הערכות", "valuations"]
+	>>> spreadsheet = open_upload(io.BytesIO("name,c1\\n,3\\n".encode("utf-8-sig")), "instance.csv", Algorithm, "en")
+	>>> spreadsheet.titles(), spreadsheet.worksheet("valuations").get_all_values()
+	(['valuations'], [['name', 'c1'], ['', '3']])
+	>>> open_upload(io.BytesIO(b""), "instance.ods", Algorithm, "en")
+	Traceback (most recent call last):
+	...
+	ValueError: Unsupported file type '.ods'. Upload a .csv or .xlsx file.
+	"""
+	from local_spreadsheet import LocalSpreadsheet    # imported here, so that importing this module does not import gspread
+	extension = os.path.splitext(filename or "")[1].lower()
+	spreadsheet = LocalSpreadsheet(f"upload:{uuid.uuid4().hex}", in_memory=True)
+	spreadsheet.title = os.path.splitext(os.path.basename(filename or "upload"))[0]
+	if extension==".csv":
+		spreadsheet.read_csv(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""), input_title(algorithm, language))
+	elif extension==".xlsx":
+		spreadsheet.read_xlsx(file)
+	else:
+		raise ValueError(f"Unsupported file type {extension!r}. Upload a .csv or .xlsx file.")
+	logger.info("uploaded %s: worksheets %s", filename, spreadsheet.titles())
+	return spreadsheet
+
+
+def package(spreadsheet:"LocalSpreadsheet", titles:list, format:str)->bytes:
+	"""
+	Returns the given worksheets of the spreadsheet as an XLSX workbook or as a zip of CSV files.
+
+	>>> class Algorithm: INPUT_SHEET_NAMES = ["output"]
+	>>> spreadsheet = open_upload(io.BytesIO(b"a,b\\n1,2\\n"), "x.csv", Algorithm, "en")
+	>>> zipfile.ZipFile(io.BytesIO(package(spreadsheet, ["output"], "zip"))).read("output.csv")
+	b'a,b\\r\\n1,2\\r\\n'
+	"""
+	output = io.BytesIO()
+	if format=="xlsx":
+		spreadsheet.write_xlsx(output, titles)
+	elif format=="zip":
+		with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+			for title in titles:
+				text = io.StringIO(newline="")
+				spreadsheet.write_csv(text, title)
+				archive.writestr(title.replace("/", "_")+".csv", text.getvalue().encode("utf-8"))
+	else:
+		raise ValueError(f"Unknown download format {format!r}. Available formats: {list(FORMATS)}")
+	return output.getvalue()
+
+
+_downloads = result_cache.ResultCache(max_entries=MAX_DOWNLOADS)    # maps a job id to a triple (filename, MIME type, contents)
+
+
+def run(algorithm, spreadsheet:"LocalSpreadsheet", language:str, format:str, **options)->dict:
+	"""
+	Runs the given algorithm module on the uploaded spreadsheet (in a job; see jobs.submit), and keeps its output for download.
+	The output contains all the worksheets except the input worksheet (or, if the algorithm does not list its input worksheet names,
+	all the worksheets that were not uploaded).
+	"""
+	input_titles = getattr(algorithm, "INPUT_SHEET_NAMES", None) or spreadsheet.titles()
+	result = algorithm.run(spreadsheet.url, language, spreadsheet=spreadsheet, **options)
+	output_titles = [title for title in spreadsheet.titles() if title not in input_titles]
+	contents = package(spreadsheet, output_titles, format)
+	job = jobs.current()
+	if job is not None:
+		_downloads.put(job.id, (f"{spreadsheet.title}-output.{format}", FORMATS[format], contents))
+		result = {**result, "download": f"/jobs/{job.id}/download"}
+	return {**result, "url": spreadsheet.url, "output_sheets": len(output_titles), "download_bytes": len(contents)}
+
+
+def download(job_id:str)->tuple:
+	"""
+	Returns the output of the upload job with the given id, as a triple (filename, MIME type, contents), or None if it is not kept.
+	"""
+	return _downloads.get(job_id)
+
+
+if __name__=="__main__":
+	import doctest
+	print(doctest.testmod())